@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP/1.1 keep-alive WSGI server on an asyncio event loop (Python 3 only).
+
+Connections are handled by the event loop, so idle keep-alive connections cost
+no thread. The blocking WSGI application runs in a bounded thread pool and
+streams its response back through the loop (chunked if the length is unknown).
+
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import sys
+
+try:
+    from urllib.parse import unquote
+except ImportError:
+    raise ImportError("asyncioserver needs Python 3")
+
+import bottle
+
+import pluginKeyHandler
+
+log = pluginKeyHandler.log
+
+MAXHEADERLINES = 100
+
+class AsyncioServer(bottle.ServerAdapter):
+    """Bottle server adapter. stop() may be called from any thread; idle
+    keep-alive connections are closed at once, requests in progress are
+    completed (up to SERVERSTOPSECONDS), then cancelled."""
+    loop = None
+    stopping = False  # no further requests are read from now on
+    closing = False  # sends of still running workers fail from now on
+
+    def run(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            self.options.get("workers", pluginKeyHandler.SERVERWORKERS))
+        self.connections = set()
+        self.idle = set()  # connection tasks waiting for the next request
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self.serve_connection, self.host, self.port))
+        self.port = server.sockets[0].getsockname()[1]
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.stopping = True
+            for task in list(self.idle):
+                task.cancel()
+            if self.connections:
+                self.loop.run_until_complete(asyncio.wait(
+                    list(self.connections), timeout=pluginKeyHandler.SERVERSTOPSECONDS))
+            self.closing = True
+            remaining = list(self.connections)
+            for task in remaining:
+                task.cancel()
+            if remaining:
+                self.loop.run_until_complete(asyncio.gather(*remaining, return_exceptions=True))
+            self.loop.run_until_complete(server.wait_closed())  # waits for the connections with Python 3.12+
+            self.executor.shutdown(wait=True)
+            self.loop.close()
+
+    def stop(self):
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            except RuntimeError:  # already stopped and closed
+                pass
+
+    async def serve_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            keepAlive = True
+            while keepAlive and not self.stopping:
+                self.idle.add(task)
+                try:
+                    requestLine = await asyncio.wait_for(reader.readline(),
+                                                         pluginKeyHandler.KEEPALIVESECONDS)
+                except asyncio.TimeoutError:
+                    break
+                except ValueError:  # longer than the limit of the reader
+                    await self.send_error(writer, "414 URI Too Long")
+                    break
+                finally:
+                    self.idle.discard(task)
+                if not requestLine.strip():
+                    break
+                keepAlive = await self.serve_request(requestLine, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except asyncio.CancelledError:  # server stopped
+            pass
+        finally:
+            writer.close()
+            self.connections.discard(task)
+
+    async def serve_request(self, requestLine, reader, writer):
+        """Handle one request, return whether the connection can be kept open."""
+        try:
+            method, target, version = requestLine.decode("latin-1").split()
+        except ValueError:
+            await self.send_error(writer, "400 Bad Request")
+            return False
+        try:
+            headers = await asyncio.wait_for(self.read_headers(reader),
+                                             pluginKeyHandler.SERVERIOSECONDS)
+        except asyncio.TimeoutError:
+            await self.send_error(writer, "408 Request Timeout")
+            return False
+        if headers is None:
+            await self.send_error(writer, "431 Request Header Fields Too Large")
+            return False
+        headerDict = dict((name.lower(), value) for name, value in headers)
+
+        if headerDict.get("transfer-encoding", "").lower() == "chunked":
+            await self.send_error(writer, "411 Length Required")
+            return False
+        try:
+            length = int(headerDict.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self.send_error(writer, "400 Bad Request")
+            return False
+        if length > pluginKeyHandler.MAXREQUESTBODYBYTES:
+            await self.send_error(writer, "413 Payload Too Large")
+            return False
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length),
+                                          pluginKeyHandler.SERVERIOSECONDS) if length else b""
+        except asyncio.TimeoutError:
+            await self.send_error(writer, "408 Request Timeout")
+            return False
+
+        connection = headerDict.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            keepAlive = connection != "close"
+        else:
+            keepAlive = connection == "keep-alive"
+
+        environ = self.make_environ(method, target, version, headers, body, writer)
+        return await self.loop.run_in_executor(self.executor, self.run_app,
+                                               environ, writer, keepAlive)
+
+    async def read_headers(self, reader):
+        """Return [(name, value), ...], None if there are too many or too long lines."""
+        headers = []
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:  # longer than the limit of the reader
+                return None
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            if len(headers) >= MAXHEADERLINES:
+                return None
+            name, _, value = line.decode("latin-1").partition(":")
+            headers.append((name.strip(), value.strip()))
+
+    def make_environ(self, method, target, version, headers, body, writer):
+        path, _, query = target.partition("?")
+        peer = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(path, "iso-8859-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": peer[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers:
+            key = name.upper().replace("-", "_")
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value
+            else:
+                key = "HTTP_" + key
+                if key in environ:
+                    value = environ[key] + "," + value
+                environ[key] = value
+        return environ
+
+    def run_app(self, environ, writer, keepAlive):
+        """Run the WSGI application in a worker thread and stream its response
+        through the event loop. Returns whether the connection can be kept open."""
+        state = {"status": None, "headers": None, "sent": False, "chunked": False,
+                 "keepAlive": keepAlive}
+
+        def send(data):
+            if self.closing:
+                raise ConnectionError("server stopped")
+            future = asyncio.run_coroutine_threadsafe(self.send(writer, data), self.loop)
+            while True:
+                try:
+                    return future.result(1)
+                except concurrent.futures.TimeoutError:
+                    if self.closing:  # the loop may not run the send any more
+                        future.cancel()
+                        raise ConnectionError("server stopped")
+
+        def send_headers():
+            headers = list(state["headers"])
+            names = set(name.lower() for name, value in headers)
+            if "content-length" not in names:
+                if environ["SERVER_PROTOCOL"] == "HTTP/1.1":
+                    headers.append(("Transfer-Encoding", "chunked"))
+                    state["chunked"] = True
+                else:
+                    state["keepAlive"] = False
+            if "connection" in names:
+                for name, value in headers:
+                    if name.lower() == "connection" and value.lower() == "close":
+                        state["keepAlive"] = False
+            elif not state["keepAlive"]:
+                headers.append(("Connection", "close"))
+            s = "HTTP/1.1 " + state["status"] + "\r\n"
+            for name, value in headers:
+                s += name + ": " + value + "\r\n"
+            send((s + "\r\n").encode("latin-1"))
+            state["sent"] = True
+
+        def write(data):
+            if not state["sent"]:
+                send_headers()
+            if data:
+                if state["chunked"]:
+                    data = ("%x\r\n" % len(data)).encode("ascii") + data + b"\r\n"
+                send(data)
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state["sent"]:
+                raise exc_info[1].with_traceback(exc_info[2])
+            state["status"] = status
+            state["headers"] = headers
+            return write
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                chunks = iter(result)
+                first = next(chunks, None)
+                if first is not None and not state["sent"]:
+                    if not any(name.lower() == "content-length" for name, value in state["headers"]):
+                        rest = next(chunks, None)
+                        if rest is None:  # single chunk - length is known
+                            state["headers"] = list(state["headers"]) + [("Content-Length", str(len(first)))]
+                        else:
+                            write(first)
+                            first = rest
+                if first is not None:
+                    write(first)
+                for data in chunks:
+                    write(data)
+                if not state["sent"]:
+                    state["headers"] = list(state["headers"]) + [("Content-Length", "0")]
+                    send_headers()
+                if state["chunked"]:
+                    send(b"0\r\n\r\n")
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        except ConnectionError:  # client gone or server stopped
+            return False
+        except Exception as e:
+            log.info("asyncioserver: application error:", repr(e))
+            if not state["sent"]:
+                body = b"Internal Server Error"
+                state["status"] = "500 Internal Server Error"
+                state["headers"] = [("Content-Type", "text/plain"),
+                                    ("Content-Length", str(len(body)))]
+                send_headers()
+                send(body)
+                return state["keepAlive"]
+            return False
+        return state["keepAlive"]
+
+    async def send(self, writer, data):
+        writer.write(data)
+        await writer.drain()
+
+    async def send_error(self, writer, status):
+        writer.write(("HTTP/1.1 " + status + "\r\nContent-Length: 0\r\n"
+                      "Connection: close\r\n\r\n").encode("latin-1"))
+        await writer.drain()
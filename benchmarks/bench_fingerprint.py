@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Compare calc_fingerprint with the pgpdump based implementation on synthetic
+armored keys of growing size (many signatures, as on popular keys).
+
+python benchmarks/bench_fingerprint.py [repetitions]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+common.app["debug"] = False
+common.logToFile = False
+import pluginKeyHandler
+
+from fixtures import make_key
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print("%10s %8s %12s %12s %8s" % ("signatures", "KB", "pgpdump ms", "native ms", "speedup"))
+    for signatures in (0, 10, 100, 1000, 3000):
+        fpr, armored = make_key(signatures)
+        assert pluginKeyHandler.calc_fingerprint(armored) == pluginKeyHandler.calc_fingerprint_pgpdump(armored)
+        old = min(timeit.repeat(lambda: pluginKeyHandler.calc_fingerprint_pgpdump(armored),
+                                number=1, repeat=repetitions)) * 1000
+        new = min(timeit.repeat(lambda: pluginKeyHandler.calc_fingerprint(armored),
+                                number=1, repeat=repetitions)) * 1000
+        print("%10d %8d %12.2f %12.2f %7.1fx" % (signatures, len(armored) // 1024, old, new, old / new))
+
+if __name__ == "__main__":
+    main()
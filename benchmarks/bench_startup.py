@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Wall time of short command line runs (python npkh.py index id/...) against
+the namecoind stand-in, with and without the cached rpc connection state.
+HOME points to a temporary directory with a namecoin.conf for the stand-in.
+
+python benchmarks/bench_startup.py [--runs=10] [--silent-nmcontrol] [--output=FILE]
+  --silent-nmcontrol  something listens on the NMControl port but never
+                      answers, so connection detection runs into its timeout
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+NPKH = os.path.join(BENCHDIR, "..", "npkh.py")
+sys.path.insert(0, BENCHDIR)
+import fakebackends
+import fixtures
+
+def run(args, env):
+    start = time.time()
+    p = subprocess.Popen([sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    seconds = time.time() - start
+    if p.returncode != 0:
+        raise RuntimeError("%s failed: %s" % (" ".join(args), err.decode("utf-8", "replace")[-500:]))
+    return seconds, out
+
+def main():
+    runs = 10
+    output = None
+    silentNmcontrol = None
+    for a in sys.argv[1:]:
+        if a.startswith("--runs="):
+            runs = int(a.split("=", 1)[1])
+        elif a.startswith("--output="):
+            output = a.split("=", 1)[1]
+        elif a == "--silent-nmcontrol":
+            silentNmcontrol = socket.socket()
+            silentNmcontrol.bind(("127.0.0.1", 9000))
+            silentNmcontrol.listen(100)  # connections are never accepted
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    namecoind = fakebackends.FakeNamecoind(fixtures.Fixtures(count=3)).start()
+    home = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(home, ".namecoin"))
+        with open(os.path.join(home, ".namecoin", "namecoin.conf"), "w") as f:
+            f.write("rpcport=%d\nrpcuser=bench\nrpcpassword=bench\n" % namecoind.port)
+        env = dict(os.environ, HOME=home)
+        stateFile = os.path.join(home, ".config", "nmcontrol", "rpcstate.json")
+
+        def detect():
+            if os.path.exists(stateFile):
+                os.remove(stateFile)
+        scenarios = [
+            ("python -c pass", ["-c", "pass"], None),
+            ("npkh --help", [NPKH, "--help"], None),
+            ("npkh index (detect)", [NPKH, "index", "id/bench0001"], detect),
+            ("npkh index (cached state)", [NPKH, "index", "id/bench0001"], None),
+        ]
+        results = {}
+        print("%-28s %10s %10s %8s" % ("", "median ms", "min ms", "rpc"))
+        for name, args, before in scenarios:
+            run(args, env)  # warm up, writes .pyc files and the state file
+            durations = []
+            namecoind.reset_counts()
+            for i in range(runs):
+                if before:
+                    before()
+                seconds, out = run(args, env)
+                durations.append(seconds)
+                if "index" in args:
+                    assert b"pub:" in out, out
+            durations.sort()
+            rpcCalls = sum(namecoind.counts.values()) / float(runs)
+            results[name] = {"median_ms": round(durations[len(durations) // 2] * 1000, 1),
+                             "min_ms": round(durations[0] * 1000, 1), "rpc_calls": rpcCalls}
+            print("%-28s %10.1f %10.1f %8.1f" % (name, results[name]["median_ms"],
+                                                 results[name]["min_ms"], rpcCalls))
+    finally:
+        shutil.rmtree(home)
+        namecoind.stop()
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
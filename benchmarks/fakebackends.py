@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-ins for namecoind (JSON-RPC) and an HKP keyserver, serving
+benchmarks.fixtures data with configurable latency. Both keep connections
+alive and count what they were asked.
+
+"""
+
+import json
+import socket
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2.X
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python 3+
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, contentType="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FakeBackend(object):
+    handlerMethods = {}
+
+    def __init__(self, latency=0):
+        self.latency = latency  # seconds per request
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.server = None
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = {}
+
+    def start(self, host="127.0.0.1", port=0):
+        backend = self
+        class BoundHandler(Handler):  # Handler is a classic class in Python 2
+            pass
+        for name, method in self.handlerMethods.items():
+            setattr(BoundHandler, name, lambda handler, method=method: getattr(backend, method)(handler))
+        self.server = ThreadingServer((host, port), BoundHandler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    @property
+    def address(self):
+        return "%s:%d" % self.server.server_address[:2]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeNamecoind(FakeBackend):
+    """JSON-RPC (single and batch calls): name_show, name_scan, getblockcount,
+    getbestblockhash, getblockhash, getblockheader, getblock and help. Block
+    hashes are the height in hex."""
+    handlerMethods = {"do_POST": "handle_post"}
+
+    def __init__(self, fixtures, latency=0, height=400000):
+        FakeBackend.__init__(self, latency)
+        self.fixtures = fixtures
+        self.height = height
+
+    def handle_post(self, handler):
+        request = json.loads(handler.rfile.read(int(handler.headers["Content-Length"])).decode("utf-8"))
+        if self.latency:
+            time.sleep(self.latency)  # one round trip, also for batches
+        if isinstance(request, list):
+            self.count("batch")
+            response = [self.call(r) for r in request]
+        else:
+            response = self.call(request)
+        handler.reply(200, json.dumps(response).encode("utf-8"), "application/json")
+
+    def call(self, request):
+        method, params = request["method"], request.get("params", [])
+        self.count(method)
+        try:
+            result = self.dispatch(method, params)
+        except KeyError:
+            return {"result": None, "id": request.get("id"),
+                    "error": {"code": -4, "message": "name not found"}}
+        except (AttributeError, IndexError, ValueError):
+            return {"result": None, "id": request.get("id"),
+                    "error": {"code": -32601, "message": "Method not found"}}
+        return {"result": result, "error": None, "id": request.get("id")}
+
+    def block_hash(self, height):
+        return "%064x" % height
+
+    def dispatch(self, method, params):
+        if method == "name_show":
+            return self.fixtures.name_show(params[0], self.height)
+        if method == "name_scan":
+            names = sorted(name for name in self.fixtures.names if name >= params[0])[:params[1]]
+            return [self.fixtures.name_show(name, self.height) for name in names]
+        if method == "getblockcount":
+            return self.height
+        if method == "getbestblockhash":
+            return self.block_hash(self.height)
+        if method == "getblockhash":
+            return self.block_hash(params[0])
+        if method in ("getblockheader", "getblock"):
+            height = int(params[0], 16)
+            block = {"hash": params[0], "height": height, "time": 1500000000 + 600 * height,
+                     "mediantime": 1499999000 + 600 * height,
+                     "confirmations": self.height - height + 1,
+                     "previousblockhash": self.block_hash(height - 1)}
+            if method == "getblock" and len(params) > 1 and params[1] == 2:
+                block["tx"] = []
+            return block
+        if method == "help":
+            return "fake namecoind"
+        raise AttributeError(method)
+
+class FakeKeyserver(FakeBackend):
+    """HKP /pks/lookup (op get and index, machine readable) for the fixture
+    keys by fingerprint or email, and /key/<fingerprint> as custom key uri."""
+    handlerMethods = {"do_GET": "handle_get"}
+
+    def __init__(self, fixtures, latency=0):
+        FakeBackend.__init__(self, latency)
+        self.fixtures = fixtures
+
+    def handle_get(self, handler):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(handler.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/key/"):
+            self.count("key")
+            k = self.fixtures.keys.get(url.path[5:].lower())
+            if k is None:
+                return handler.reply(404, b"Not found")
+            return handler.reply(200, k, "application/pgp-keys")
+        if url.path != "/pks/lookup":
+            return handler.reply(404, b"Not found")
+        op = query.get("op", [""])[0]
+        search = query.get("search", [""])[0].lower()
+        self.count(op)
+        fpr = self.fixtures.emails.get(search, search[2:] if search.startswith("0x") else search)
+        if fpr not in self.fixtures.keys:
+            return handler.reply(404, b"No keys found")
+        if op == "get":
+            return handler.reply(200, self.fixtures.keys[fpr], "application/pgp-keys")
+        if op == "index":
+            return handler.reply(200, ("info:1:1\npub:%s:1:2048:1500000000::\nuid:%s:1500000000::\n" %
+                                       (fpr.upper(), search)).encode("utf-8"))
+        return handler.reply(501, b"Not implemented")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic OpenPGP keys and Namecoin id/ names for benchmarks. The key material
+is random - only the packet structure matters, nothing here can sign or
+encrypt. Everything is derived from seeds, so runs are reproducible.
+
+"""
+
+import base64
+import hashlib
+import json
+import random
+import struct
+
+def _crc24_table():
+    table = []
+    for i in range(256):
+        crc = i << 16
+        for j in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table.append(crc & 0xFFFFFF)
+    return table
+
+CRC24TABLE = _crc24_table()
+
+def crc24(data):
+    crc = 0xB704CE
+    for b in bytearray(data):
+        crc = (CRC24TABLE[((crc >> 16) ^ b) & 0xff] ^ (crc << 8)) & 0xFFFFFF
+    return crc
+
+def packet(tag, body):
+    """New format packet with a five octet length."""
+    return struct.pack(">BBI", 0xC0 | tag, 255, len(body)) + body
+
+def mpi(bits, rnd):
+    x = rnd.getrandbits(bits) | (1 << (bits - 1))
+    return struct.pack(">H", bits) + bytes(bytearray((x >> (8 * i)) & 0xff for i in reversed(range(bits // 8))))
+
+def armor(data):
+    b64 = base64.b64encode(data)
+    lines = [b64[i:i + 64] for i in range(0, len(b64), 64)]
+    crc = base64.b64encode(struct.pack(">I", crc24(data))[1:])
+    return (b"-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n" + b"\n".join(lines) +
+            b"\n=" + crc + b"\n-----END PGP PUBLIC KEY BLOCK-----\n")
+
+def make_key(signatures, seed=1, uid=b"Benchmark <bench@example.org>"):
+    """Return (fingerprint, armored key): a v4 RSA-2048 key with one user id and
+    signatures certifications."""
+    rnd = random.Random(seed)
+    key = b"\x04" + struct.pack(">I", 1500000000) + b"\x01" + mpi(2048, rnd) + b"\x00\x11\x01\x00\x01"
+    fpr = hashlib.sha1(b"\x99" + struct.pack(">H", len(key)) + key).hexdigest()
+    data = packet(6, key) + packet(13, uid)
+    for i in range(signatures):
+        hashed = b"\x05\x02" + struct.pack(">I", 1500000000 + i)
+        unhashed = b"\x09\x10" + struct.pack(">Q", rnd.getrandbits(64))
+        sig = (b"\x04\x10\x01\x08" + struct.pack(">H", len(hashed)) + hashed +
+               struct.pack(">H", len(unhashed)) + unhashed + b"\x12\x34" + mpi(2048, rnd))
+        data += packet(2, sig)
+    return fpr, armor(data)
+
+class Fixtures(object):
+    """count id/ names id/bench0000... with keys, every customUriEvery-th one
+    offering its key at a custom uri of the keyserver stand-in, and as many
+    keys of plain email addresses (user0000@example.org) for proxied lookups.
+    Key i has signatures[i % len(signatures)] signatures."""
+    def __init__(self, count=100, signatures=(5, 20, 100), customUriEvery=2):
+        self.keys = {}  # fingerprint -> armored
+        self.names = {}  # name -> value dict
+        self.nameFprs = []  # (name, fingerprint)
+        self.emails = {}  # email -> fingerprint
+        self.customUriEvery = customUriEvery
+        for i in range(count):
+            fpr, armored = make_key(signatures[i % len(signatures)], seed=i)
+            self.keys[fpr] = armored
+            name = "id/bench%04d" % i
+            self.names[name] = {"gpg": {"fpr": fpr}, "email": "bench%04d@example.org" % i,
+                                "name": "Bench %d" % i}
+            self.nameFprs.append((name, fpr))
+            fpr, armored = make_key(signatures[i % len(signatures)], seed=100000 + i)
+            self.keys[fpr] = armored
+            self.emails["user%04d@example.org" % i] = fpr
+
+    def set_keyserver(self, address):
+        """Point the custom key uris at the keyserver stand-in on address (host:port)."""
+        for i, (name, fpr) in enumerate(self.nameFprs):
+            if self.customUriEvery and i % self.customUriEvery == 0:
+                self.names[name]["gpg"]["uri"] = "http://" + address + "/key/" + fpr
+
+    def name_show(self, name, height):
+        return {"name": name, "value": json.dumps(self.names[name]), "height": height - 1000,
+                "expires_in": 35000, "expired": False}
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+HKP load generator: drives /pks/lookup of a KeyServer with a mix of id/ index,
+id/ get, fingerprint follow-ups and proxied searches, or replays an access
+log. Without --url a KeyServer is started in this process against the local
+namecoind and keyserver stand-ins, so backend RPC calls per request can be
+counted.
+
+python benchmarks/loadtest.py [options]
+  --url=http://host:port  existing server instead of the in-process one
+  --server=threadpool     in-process server backend (threadpool, asyncio)
+  --concurrency=16        parallel clients (keep-alive connections)
+  --rate=0                requests per second (open loop), 0: as fast as possible
+  --seconds=10            test duration
+  --requests=0            stop after this many requests instead
+  --mix=id_index:4,id_get:2,fpr_index:2,fpr_get:1,proxy_index:1,proxy_get:0
+  --replay=FILE           replay /pks/ requests of an access log (or one path per line)
+  --rpc-latency=0         seconds added by the fake namecoind per request
+  --hkp-latency=0         seconds added by the fake keyserver per request
+  --no-cache              disable the name and proxy response caches
+  --output=FILE           write the report as json
+
+With --rate latencies are measured from the scheduled start, so a server
+falling behind shows up in the percentiles instead of lowering the rate.
+"""
+from __future__ import print_function
+
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+
+try:
+    import httplib  # Python 2.X
+    from urlparse import urlsplit
+    import Queue as queue
+except ImportError:
+    import http.client as httplib  # Python 3+
+    from urllib.parse import urlsplit
+    import queue
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHDIR)
+import run_benchmarks
+pluginKeyHandler = run_benchmarks.pluginKeyHandler
+
+DEFAULTMIX = "id_index:4,id_get:2,fpr_index:2,fpr_get:1,proxy_index:1,proxy_get:0"
+REPLAYRE = re.compile(r'"(?:GET|POST) (/pks/\S+)')
+
+class Workload(object):
+    """Request paths by kind. Fingerprint follow-ups ask for fingerprints of
+    names an id/ index request has returned before, like a client would."""
+    def __init__(self, fix, mix):
+        self.fix = fix
+        self.kinds = []
+        for kind, weight in mix:
+            self.kinds += [kind] * weight
+        self.names = [name for name, fpr in fix.nameFprs]
+        self.emails = sorted(fix.emails)
+        self.seenFprs = []
+        self._lock = threading.Lock()
+
+    def next(self, rnd):
+        kind = rnd.choice(self.kinds)
+        if kind.startswith("fpr_"):
+            with self._lock:
+                fpr = rnd.choice(self.seenFprs) if self.seenFprs else None
+            if fpr is None:
+                kind = "id_index"
+            else:
+                return kind, make_path(fpr, kind)
+        if kind.startswith("id_"):
+            return kind, make_path(rnd.choice(self.names), kind)
+        email = rnd.choice(self.emails)
+        if kind == "proxy_get":
+            return kind, make_path("0x" + self.fix.emails[email], kind)
+        return kind, make_path(email, kind)
+
+    def done(self, kind, status, body):
+        if kind == "id_index" and status == 200:
+            for line in body.decode("utf-8", "replace").split("\n"):
+                if line.startswith("pub:"):
+                    with self._lock:
+                        self.seenFprs.append("0x" + line.split(":")[1].lower())
+
+def make_path(search, kind):
+    return "/pks/lookup?op=" + kind.split("_")[1] + "&options=mr&search=" + search
+
+class Replay(object):
+    def __init__(self, filename):
+        self.paths = []
+        with open(filename) as f:
+            for line in f:
+                m = REPLAYRE.search(line)
+                if m:
+                    self.paths.append(m.group(1))
+                elif line.startswith("/pks/"):
+                    self.paths.append(line.strip())
+        if not self.paths:
+            raise ValueError("No /pks/ requests in " + filename)
+        self.i = 0
+        self._lock = threading.Lock()
+
+    def next(self, rnd):
+        with self._lock:
+            path = self.paths[self.i % len(self.paths)]
+            self.i += 1
+        return "replay", path
+
+    def done(self, kind, status, body):
+        pass
+
+class Client(object):
+    """One keep-alive connection, reconnecting after errors."""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = None
+
+    def get(self, path):
+        if self.conn is None:
+            self.conn = httplib.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            self.conn.request("GET", path)
+            response = self.conn.getresponse()
+            body = response.read()
+        except (socket.error, httplib.HTTPException):
+            self.conn.close()
+            self.conn = None
+            raise
+        if response.getheader("connection", "").lower() == "close":
+            self.conn.close()
+            self.conn = None
+        return response.status, body
+
+class LoadTest(object):
+    def __init__(self, url, workload, concurrency=16, rate=0, seconds=10, requests=0):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.workload = workload
+        self.concurrency = concurrency
+        self.rate = rate
+        self.seconds = seconds
+        self.requests = requests
+        self.results = []  # (kind, status or None, seconds)
+        self._lock = threading.Lock()
+
+    def run(self):
+        self.start = time.time()
+        self.end = self.start + self.seconds
+        self.schedule = queue.Queue(self.concurrency * 2) if self.rate else None
+        self.issued = 0
+        threads = []
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._work, args=(random.Random(i),))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        if self.rate:
+            self._schedule()
+        for t in threads:
+            t.join()
+        self.elapsed = time.time() - self.start
+        return self.results
+
+    def _take(self):
+        """Return the scheduled start time of the next request or None when done."""
+        if self.schedule is not None:
+            return self.schedule.get()
+        with self._lock:
+            if self.requests and self.issued >= self.requests:
+                return None
+            if not self.requests and time.time() >= self.end:
+                return None
+            self.issued += 1
+        return time.time()
+
+    def _schedule(self):
+        n = 0
+        while True:
+            scheduled = self.start + n / float(self.rate)
+            if (self.requests and n >= self.requests) or (not self.requests and scheduled >= self.end):
+                break
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.schedule.put(scheduled)
+            n += 1
+        for i in range(self.concurrency):
+            self.schedule.put(None)
+
+    def _work(self, rnd):
+        client = Client(self.host, self.port)
+        while True:
+            scheduled = self._take()
+            if scheduled is None:
+                return
+            kind, path = self.workload.next(rnd)
+            try:
+                status, body = client.get(path)
+                self.workload.done(kind, status, body)
+            except (socket.error, httplib.HTTPException):
+                status = None
+            with self._lock:
+                self.results.append((kind, status, time.time() - scheduled))
+
+def percentile(sortedValues, p):
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * p))]
+
+def latency_stats(durations):
+    if not durations:
+        return {"requests": 0, "p50_ms": 0, "p95_ms": 0, "p99_ms": 0, "max_ms": 0}
+    durations = sorted(durations)
+    return {"requests": len(durations),
+            "p50_ms": round(percentile(durations, 0.5) * 1000, 2),
+            "p95_ms": round(percentile(durations, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(durations, 0.99) * 1000, 2),
+            "max_ms": round(durations[-1] * 1000, 2)}
+
+def report(test, namecoind=None, keyserver=None):
+    results = test.results
+    completed = [status for kind, status, d in results if status is not None]
+    r = {"seconds": round(test.elapsed, 2), "concurrency": test.concurrency, "rate": test.rate,
+         "throughput": round(len(completed) / test.elapsed, 1) if test.elapsed else 0.0,
+         "statuses": {}, "kinds": {}}
+    r.update(latency_stats([d for kind, status, d in results]))
+    for kind, status, d in results:
+        key = str(status) if status is not None else "connection error"
+        r["statuses"][key] = r["statuses"].get(key, 0) + 1
+    errors = sum(n for status, n in r["statuses"].items() if not status.startswith(("2", "404")))
+    r["error_rate"] = round(float(errors) / len(results), 4) if results else 1.0
+    for kind in sorted(set(kind for kind, status, d in results)):
+        r["kinds"][kind] = latency_stats([d for k, status, d in results if k == kind])
+    if namecoind is not None:
+        counts = dict(namecoind.counts)
+        r["rpc_calls_per_request"] = round(float(sum(n for method, n in counts.items()
+                                                     if method != "batch")) / max(len(results), 1), 3)
+        r["rpc_calls"] = counts
+        r["upstream_requests"] = dict(keyserver.counts)
+    return r
+
+def print_report(r):
+    print("%d requests in %.1f s: %.1f requests/s, concurrency %d%s" % (
+        r["requests"], r["seconds"], r["throughput"], r["concurrency"],
+        ", target rate %g/s" % r["rate"] if r["rate"] else ""))
+    print("%-14s %8s %9s %9s %9s %9s" % ("kind", "requests", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    rows = sorted(r["kinds"].items()) + [("all", r)]
+    for kind, s in rows:
+        print("%-14s %8d %9.2f %9.2f %9.2f %9.2f" % (kind, s["requests"], s["p50_ms"], s["p95_ms"],
+                                                     s["p99_ms"], s["max_ms"]))
+    print("statuses:", ", ".join("%s: %d" % item for item in sorted(r["statuses"].items())),
+          " error rate: %.2f%%" % (r["error_rate"] * 100))
+    if "rpc_calls" in r:
+        print("backend rpc calls per request: %.3f" % r["rpc_calls_per_request"],
+              json.dumps(r["rpc_calls"], sort_keys=True))
+        print("upstream keyserver requests:", json.dumps(r["upstream_requests"], sort_keys=True))
+
+def parse_mix(s):
+    mix = []
+    for item in s.split(","):
+        kind, weight = item.split(":")
+        if kind not in ("id_index", "id_get", "fpr_index", "fpr_get", "proxy_index", "proxy_get"):
+            raise ValueError("Unknown request kind: " + kind)
+        mix.append((kind, int(weight)))
+    return mix
+
+def main():
+    settings = {"url": None, "server": "threadpool", "concurrency": "16", "rate": "0",
+                "seconds": "10", "requests": "0", "mix": DEFAULTMIX, "replay": None,
+                "rpc-latency": "0", "hkp-latency": "0", "output": None}
+    caches = True
+    for a in sys.argv[1:]:
+        key, _, value = a[2:].partition("=")
+        if a == "--no-cache":
+            caches = False
+        elif a.startswith("--") and key in settings and value:
+            settings[key] = value
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    fix, namecoind, keyserver = run_benchmarks.start_backends(float(settings["rpc-latency"]),
+                                                              float(settings["hkp-latency"]))
+    ks = None
+    url = settings["url"]
+    if url is None:
+        run_benchmarks.configure(namecoind.port, caches)
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        ks = pluginKeyHandler.KeyServer(port=port, standardKeyServer=keyserver.address,
+                                        serverBackend=settings["server"])
+        t = threading.Thread(target=ks.start)
+        t.daemon = True
+        t.start()
+        url = "http://127.0.0.1:%d" % port
+        for i in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), 1).close()
+                break
+            except socket.error:
+                time.sleep(0.05)
+
+    if settings["replay"]:
+        workload = Replay(settings["replay"])
+    else:
+        workload = Workload(fix, parse_mix(settings["mix"]))
+    namecoind.reset_counts()
+    keyserver.reset_counts()
+    test = LoadTest(url, workload, int(settings["concurrency"]), float(settings["rate"]),
+                    float(settings["seconds"]), int(settings["requests"]))
+    test.run()
+    if ks is not None:
+        r = report(test, namecoind, keyserver)
+        ks.stop()
+    else:
+        r = report(test)
+    print_report(r)
+    if settings["output"]:
+        with open(settings["output"], "w") as f:
+            json.dump(r, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
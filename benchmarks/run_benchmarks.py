@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks: RequestHandler.lookup for each lookup path against local
+namecoind and keyserver stand-ins (benchmarks/fakebackends.py), plus
+microbenchmarks. Results are written as JSON so runs of different commits can
+be compared.
+
+python benchmarks/run_benchmarks.py [options] [benchmark names]
+  --seconds=2           measuring time per benchmark
+  --rpc-latency=0       seconds added by the fake namecoind per request
+  --hkp-latency=0       seconds added by the fake keyserver per request
+  --output=FILE         default: benchmarks/results/<commit>.json
+  --compare=FILE        print the change relative to an earlier result file
+  --list                list benchmark names
+"""
+from __future__ import print_function
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHDIR, ".."))
+sys.path.insert(0, BENCHDIR)
+import common
+common.app["debug"] = False
+common.logToFile = False
+import pluginKeyHandler
+import namerpc
+import mylogging
+
+import fakebackends
+import fixtures
+
+RPCUSER = "bench"
+RPCPASSWORD = "bench"
+
+def configure(rpcPort, caches=False):
+    """Standalone mode against the stand-ins without anything persistent. With
+    caches=False nothing is cached across lookups that would hide the work
+    being measured."""
+    pluginKeyHandler.IdRequest = pluginKeyHandler.StandaloneIdRequest
+    pluginKeyHandler.KEYSERVERSCHEME = "http"
+    pluginKeyHandler.FPRINDEXFILE = None
+    pluginKeyHandler.BLOCKTIMECACHEFILE = None
+    pluginKeyHandler.KEYSTOREFILE = None
+    pluginKeyHandler.NAMECACHE = caches
+    pluginKeyHandler.PROXYCACHE = caches
+    namerpc.set_shared_rpc(namerpc.CoinRpc(namerpc.CONTYPECLIENT, options={
+        "rpcport": rpcPort, "rpcuser": RPCUSER, "rpcpassword": RPCPASSWORD}))
+
+def start_backends(rpcLatency=0, hkpLatency=0, count=100):
+    """Return (fixtures, FakeNamecoind, FakeKeyserver), both servers running."""
+    fix = fixtures.Fixtures(count)
+    keyserver = fakebackends.FakeKeyserver(fix, latency=hkpLatency).start()
+    fix.set_keyserver(keyserver.address)
+    namecoind = fakebackends.FakeNamecoind(fix, latency=rpcLatency).start()
+    return fix, namecoind, keyserver
+
+def measure(fn, seconds, warmup=3):
+    """Call fn repeatedly for about seconds, return per call durations."""
+    for i in range(warmup):
+        fn()
+    durations = []
+    end = time.time() + seconds
+    while time.time() < end or len(durations) < 5:
+        start = time.time()
+        fn()
+        durations.append(time.time() - start)
+    return durations
+
+def summarize(durations):
+    durations = sorted(durations)
+    n = len(durations)
+    total = sum(durations)
+    return {"calls": n, "ops_per_second": round(n / total, 1),
+            "mean_ms": round(total / n * 1000, 4),
+            "p50_ms": round(durations[n // 2] * 1000, 4),
+            "p95_ms": round(durations[min(n - 1, int(n * 0.95))] * 1000, 4)}
+
+def cycle(items):
+    state = {"i": 0}
+    def next_item():
+        state["i"] = (state["i"] + 1) % len(items)
+        return items[state["i"]]
+    return next_item
+
+def body_of(result):
+    if isinstance(result, (bytes, str)):
+        return result
+    return b"".join(result)
+
+def make_benchmarks(rh, fix, namecoind):
+    names = [name for name, fpr in fix.nameFprs]
+    fprs = ["0x" + fpr for name, fpr in fix.nameFprs]
+    for name, fpr in fix.nameFprs:
+        rh.update_cache(name, fpr)
+    emails = sorted(fix.emails)
+    emailFprs = ["0x" + fix.emails[email] for email in emails]
+    nextName, nextFpr = cycle(names), cycle(fprs)
+    nextEmail, nextEmailFpr = cycle(emails), cycle(emailFprs)
+
+    small = fix.keys[fix.nameFprs[0][1]]  # 5 signatures
+    large = fixtures.make_key(1000, seed=7)[1]
+    namecoind.reset_counts()
+    idRequest = pluginKeyHandler.IdRequest(names[0], rh.standardKeyServer)
+    logArgs = ("lookup: search:", "id/bench0001", " request:", True, " op:", "get", 1234,
+               b"bytes \xc3\xa4", u"unicode \xe4")
+
+    return [
+        ("lookup_id_index", lambda: body_of(rh.lookup(nextName(), "index"))),
+        ("lookup_id_get", lambda: body_of(rh.lookup(nextName(), "get"))),
+        ("lookup_fpr_index", lambda: body_of(rh.lookup(nextFpr(), "index"))),
+        ("lookup_fpr_get", lambda: body_of(rh.lookup(nextFpr(), "get"))),
+        ("lookup_proxy_index", lambda: body_of(rh.lookup(nextEmail(), "index"))),
+        ("lookup_proxy_get", lambda: body_of(rh.lookup(nextEmailFpr(), "get"))),
+        ("calc_fingerprint_small", lambda: pluginKeyHandler.calc_fingerprint(small)),
+        ("calc_fingerprint_large", lambda: pluginKeyHandler.calc_fingerprint(large)),
+        ("get_index", idRequest.get_index),
+        ("join_args_unicode", lambda: mylogging.join_args_unicode(*logArgs)),
+        ("log_debug_disabled", lambda: pluginKeyHandler.log.debug(*logArgs)),
+    ]
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=BENCHDIR).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results, filename):
+    with open(filename) as f:
+        old = json.load(f)
+    print()
+    print("compared with", old.get("commit"), "(" + filename + "): mean time new/old")
+    for name, r in sorted(results["benchmarks"].items()):
+        if name in old["benchmarks"]:
+            ratio = r["mean_ms"] / old["benchmarks"][name]["mean_ms"]
+            print("%-24s %7.2f%s" % (name, ratio, "  slower" if ratio > 1.1 else "  faster" if ratio < 0.9 else ""))
+
+def main():
+    settings = {"seconds": 2.0, "rpc-latency": 0.0, "hkp-latency": 0.0}
+    output = None
+    compareWith = None
+    selected = []
+    for a in sys.argv[1:]:
+        if a == "--list":
+            selected = None
+        elif a.startswith("--output="):
+            output = a.split("=", 1)[1]
+        elif a.startswith("--compare="):
+            compareWith = a.split("=", 1)[1]
+        elif a.startswith("--") and a[2:].split("=")[0] in settings:
+            key, value = a[2:].split("=", 1)
+            settings[key] = float(value)
+        elif a.startswith("--"):
+            print(__doc__)
+            sys.exit(1)
+        else:
+            selected.append(a)
+
+    fix, namecoind, keyserver = start_backends(settings["rpc-latency"], settings["hkp-latency"])
+    configure(namecoind.port)
+    rh = pluginKeyHandler.RequestHandler(standardKeyServer=keyserver.address)
+    benchmarks = make_benchmarks(rh, fix, namecoind)
+    if selected is None:
+        for name, fn in benchmarks:
+            print(name)
+        return
+
+    results = {"commit": git_commit(), "python": platform.python_version(),
+               "time": int(time.time()), "settings": settings, "benchmarks": {}}
+    print("%-24s %10s %10s %10s %10s %8s" % ("benchmark", "ops/s", "mean ms", "p50 ms", "p95 ms", "rpc/op"))
+    for name, fn in benchmarks:
+        if selected and name not in selected:
+            continue
+        namecoind.reset_counts()
+        r = summarize(measure(fn, settings["seconds"]))
+        rpcCalls = sum(namecoind.counts.values())
+        r["rpc_per_call"] = round(float(rpcCalls) / (r["calls"] + 3), 2)  # incl. warmup calls
+        results["benchmarks"][name] = r
+        print("%-24s %10.1f %10.4f %10.4f %10.4f %8.2f" % (name, r["ops_per_second"], r["mean_ms"],
+                                                          r["p50_ms"], r["p95_ms"], r["rpc_per_call"]))
+    keyserver.stop()
+    namecoind.stop()
+
+    if output is None:
+        resultsDir = os.path.join(BENCHDIR, "results")
+        if not os.path.isdir(resultsDir):
+            os.makedirs(resultsDir)
+        output = os.path.join(resultsDir, results["commit"] + ".json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print()
+    print("results:", output)
+    if compareWith:
+        compare(results, compareWith)
+
+if __name__ == "__main__":
+    main()
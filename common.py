@@ -8,6 +8,7 @@ import platformDep
 
 logToFile = True  # will be set to False for client mode
 LOGFILENAME = "log.txt"
+LOGINBACKGROUND = True  # console and file output are written by a separate thread
 
 def get_logger(name, clear=False):
     global app
@@ -21,4 +22,4 @@ def get_logger(name, clear=False):
         logFilenamePath = platformDep.getNmcontrolDir() + "/" + LOGFILENAME
 
     return mylogging.get_my_logger(name, levelConsole=level, filename=logFilenamePath,
-                                   levelFile=level, clear=clear)
+                                   levelFile=level, clear=clear, background=LOGINBACKGROUND)
@@ -3,10 +3,22 @@
 MIT license
 
 Screen and file logger. Supports print() style arguments and encoded strings.
+Arguments are only converted if the level is enabled, lazy() defers more
+expensive work the same way. With background=True a thread does the writing.
 
 """
 
 import os
+import atexit
+import threading
+
+try:
+    import Queue as queue  # Python 2.X
+except ImportError:
+    import queue  # Python 3+
+
+BACKGROUNDQUEUESIZE = 10000  # records - more are dropped while the writer thread is behind
+BACKGROUNDSTOPSECONDS = 5  # at exit queued records are written for at most this long
 
 def ensure_dirs(path):
     try:
@@ -22,10 +34,28 @@ try:
 except NameError:
     unicode_str = str  # Python 3+
 
+class lazy(object):
+    """Log argument evaluated only if the record is written:
+    log.debug("value:", lazy(json.dumps, value, indent=2))"""
+    __slots__ = ("fn", "args", "kwargs")
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return self.fn(*self.args, **self.kwargs)
+
+    def __str__(self):
+        return str(self())
+
 def join_args_unicode(*args):
     """Join arguments as unicode string representations."""
     args2 = []
     for arg in args:
+        if isinstance(arg, lazy):
+            arg = arg()
         try:
             arg = unicode_str(arg)
         except UnicodeDecodeError:
@@ -45,30 +75,115 @@ Also support encoded strings."""
         Logger._log(self, level, msg, args, **kwargs)
 setLoggerClass(MyLogger)
 
-def get_my_logger(name=None, levelConsole=INFO, filename=None, levelFile=DEBUG, clear=False):
-    """Logger logging to both screen and file as configured."""
-    # create formatter
-    formatter = Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+class BackgroundWriter(threading.Thread):
+    """Passes records to their handlers in its own thread. Never blocks the
+    logging thread: if the queue is full the record is dropped and counted."""
+    def __init__(self, maxSize=BACKGROUNDQUEUESIZE):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue.Queue(maxSize)
+        self.dropped = 0
+        self.reported = 0
+
+    def put(self, handler, record):
+        try:
+            self.queue.put_nowait((handler, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            handler, record = item
+            if self.dropped != self.reported:
+                dropped = self.dropped
+                handler.handle(makeLogRecord({"name": record.name, "levelno": WARNING, "levelname": "WARNING",
+                                              "msg": "mylogging: %d records dropped" % (dropped - self.reported)}))
+                self.reported = dropped
+            handler.handle(record)
 
+    def stop(self, timeout=BACKGROUNDSTOPSECONDS):
+        """Write what is queued, then end the thread."""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.join(timeout)
+
+_writer = None
+_writerLock = threading.Lock()
+
+def get_background_writer():
+    global _writer
+    with _writerLock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+            _writer.start()
+            atexit.register(_writer.stop)
+    return _writer
+
+class QueueHandler(Handler):
+    """Hands records to the background writer for target."""
+    def __init__(self, target):
+        Handler.__init__(self, target.level)
+        self.target = target
+        self.writer = get_background_writer()
+
+    def emit(self, record):
+        # everything that refers to the caller's objects is converted now
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.writer.put(self.target, record)
+
+    def close(self):
+        self.target.close()
+        Handler.close(self)
+
+def get_my_logger(name=None, levelConsole=INFO, filename=None, levelFile=DEBUG, clear=False,
+                  background=False):
+    """Logger logging to both screen and file as configured. Calling it again
+    for the same name replaces the handlers instead of adding more."""
+    config = (levelConsole, filename, levelFile, background)
     logger = getLogger(name)
-    logger.setLevel(DEBUG)  # set max Level to output
+    if getattr(logger, "myConfig", None) == config:
+        return logger
+    for h in getattr(logger, "myHandlers", []):
+        logger.removeHandler(h)
+        h.close()
+
+    # create formatter
+    formatter = Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
     ch = StreamHandler()
     ch.setLevel(levelConsole)
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    handlers = [ch]
 
     if filename:
         ensure_dirs(os.path.dirname(filename))
         fh = FileHandler(filename, mode='w' if clear else 'a')
         fh.setLevel(levelFile)
         fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        handlers.append(fh)
+
+    if background:
+        handlers = [QueueHandler(h) for h in handlers]
+    for h in handlers:
+        logger.addHandler(h)
+    logger.setLevel(min(h.level for h in handlers))  # lower levels return before building a record
+    logger.myHandlers = handlers
+    logger.myConfig = config
     return logger
 
 if __name__ == "__main__":
-    log = get_my_logger("test", levelConsole=DEBUG, filename="./logtest\\t/test.txt", clear=True)
-    log.info("test", 1)
+    log = get_my_logger("test", levelConsole=DEBUG, filename="./logtest\\t/test.txt", clear=True,
+                        background=True)
+    log.info("test", 1, lazy(sorted, [3, 2, 1]))
     log.debug("teeeesüst2", u"teäst2b")
     try:
         1/0
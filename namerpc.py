@@ -23,14 +23,12 @@
 
 # todo: read datadir path from registry
 
-# todo: timeout authproxy
 # todo: proper translation of error codes
 # todo: setting an empty value does not work
 # separate NMControl and client?
 
 from __future__ import print_function
 
-import bitcoinrpc.authproxy
 import socket
 import json
 import sys
@@ -38,6 +36,14 @@ import os
 import platform
 import time
 import traceback
+import threading
+import base64
+import decimal
+
+try:
+    import httplib  # Python 2.X
+except ImportError:
+    import http.client as httplib  # Python 3+
 
 import locale
 encoding = locale.getpreferredencoding().lower()
@@ -49,6 +55,15 @@ HOST = "127.0.0.1"
 
 COOKIEAUTH_FILE = ".cookie"
 
+# persistent keep-alive connections to the client, shared by all CoinRpc instances
+POOLSIZE = 4  # max number of idle connections kept open per server
+POOLIDLETIMEOUT = 30  # seconds - idle connections older than this are not reused
+HTTPTIMEOUT = 30  # seconds
+STATEFILE = None  # path: get_shared_rpc reuses connection type and credentials detected by an earlier process
+
+# functions f(method, seconds, error) called after every call, e.g. for metrics
+callObservers = []
+
 CONTYPECLIENT = "client"
 CONTYPENMCONTROL = "nmcontrol"
 
@@ -119,13 +134,145 @@ for e in clientErrorCodes:
     globals()[c.__name__] = c  # register in module
     clientErrorClasses.append(c)  # allow for easy access
 
+def _encode_decimal(o):
+    if isinstance(o, decimal.Decimal):
+        return float(round(o, 8))
+    raise TypeError(repr(o) + " is not JSON serializable")
+
+class ConnectionPool(object):
+    """Thread safe pool of persistent HTTP/1.1 keep-alive connections to one
+    JSON-RPC server. Connections that went stale (closed by the host or idle
+    for longer than idleTimeout) are replaced transparently."""
+    def __init__(self, host, port, user, password, size=POOLSIZE,
+                 idleTimeout=POOLIDLETIMEOUT, timeout=HTTPTIMEOUT):
+        self.host = host
+        self.port = int(port)
+        self.size = size
+        self.idleTimeout = idleTimeout
+        self.timeout = timeout
+        authpair = (str(user) + ":" + str(password)).encode("utf-8")
+        self.authHeader = b"Basic " + base64.b64encode(authpair)
+        self._idle = []  # [(lastUsed, connection), ...] most recently used last
+        self._lock = threading.Lock()
+        self._idCount = 0
+
+    def next_id(self):
+        with self._lock:
+            self._idCount += 1
+            return self._idCount
+
+    def _acquire(self):
+        """Return (connection, reused)."""
+        now = time.time()
+        stale = []
+        conn = None
+        with self._lock:
+            while self._idle and now - self._idle[0][0] >= self.idleTimeout:
+                stale.append(self._idle.pop(0)[1])
+            if self._idle:
+                conn = self._idle.pop()[1]
+        for c in stale:
+            c.close()
+        if conn:
+            return conn, True
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((time.time(), conn))
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for lastUsed, c in idle:
+            c.close()
+
+    def _post(self, conn, postdata):
+        conn.request("POST", "/", postdata,
+                     {"Host": self.host,
+                      "Authorization": self.authHeader,
+                      "Content-type": "application/json"})
+        response = conn.getresponse()
+        body = response.read()  # always read completely so the connection can be reused
+        if response.getheader("Content-Type") != "application/json":
+            return {"result": None, "id": None, "error":
+                    {"code": -342, "message": "non-JSON HTTP response with '%i %s' from server" %
+                     (response.status, response.reason)}}
+        return json.loads(body.decode("utf-8"), parse_float=decimal.Decimal)
+
+    def request(self, data):
+        """Send a JSON-RPC request object (or a batch list) and return the decoded response."""
+        postdata = json.dumps(data, default=_encode_decimal)
+        conn, reused = self._acquire()
+        try:
+            response = self._post(conn, postdata)
+        except (socket.error, httplib.HTTPException) as e:
+            conn.close()
+            if not reused:
+                raise RpcConnectionError("Connection to client failed: " + repr(e))
+            # keep-alive connection was closed by the host in the meantime - retry once with a fresh one
+            if DEBUG:
+                print("stale connection, setting up new one:", repr(e))
+            conn = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                response = self._post(conn, postdata)
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                raise RpcConnectionError("Connection to client failed: " + repr(e))
+            except:
+                conn.close()
+                raise
+        except:  # e.g. an undecodable response - the state of the connection is unknown
+            conn.close()
+            raise
+        self._release(conn)
+        return response
+
+_pools = {}
+_poolsLock = threading.Lock()
+
+def get_pool(host, port, user, password, size=POOLSIZE, idleTimeout=POOLIDLETIMEOUT):
+    """Return the process wide connection pool for these credentials. Size and
+    idle timeout of an existing pool are updated to the given values."""
+    key = (host, int(port), str(user), str(password))
+    with _poolsLock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(host, port, user, password, size, idleTimeout)
+            _pools[key] = pool
+        else:
+            pool.size = size
+            pool.idleTimeout = idleTimeout
+    return pool
+
+def drop_pool(pool):
+    """Forget a pool whose credentials are outdated and close its idle connections."""
+    with _poolsLock:
+        for key, p in list(_pools.items()):
+            if p is pool:
+                del _pools[key]
+    pool.close()
+
 
 class CoinRpc(object):
     """connectionType: auto, nmcontrol or client"""
-    def __init__(self, connectionType="auto", options=None, datadir=None, timeout=5):
+    def __init__(self, connectionType="auto", options=None, datadir=None, timeout=5,
+                 poolSize=POOLSIZE, poolIdleTimeout=POOLIDLETIMEOUT):
         self.bufsize = 4096
         self.host = HOST
-        self.authServiceProxy = None
+        self.pool = None
+        self.poolSize = poolSize
+        self.poolIdleTimeout = poolIdleTimeout
+        self.cookieFile = None  # set if credentials come from the cookie file
+        self.cookieMtime = None
+        self._reloadLock = threading.Lock()
+        self.stateFile = None  # set if connection type and credentials come from a state file
+        self.stateRedetected = None  # time the stale state was replaced
+        self._stateLock = threading.RLock()  # the detection's own calls fail through redetect_stale_state
 
         self.timeout = timeout  # If set to None the global default will be used.
 
@@ -143,14 +290,12 @@ class CoinRpc(object):
         if not connectionType in [CONTYPECLIENT, CONTYPENMCONTROL]:
             self._detect_connection()
 
-        if self.connectionType == CONTYPECLIENT and not self.authServiceProxy:
-            self.setup_authServiceProxy()
+        if self.connectionType == CONTYPECLIENT and not self.pool:
+            self.setup_pool()
 
-    def setup_authServiceProxy(self):
-        s = ("http://" + str(self.options["rpcuser"]) + ":" +
-            str(self.options["rpcpassword"]) +"@" + self.host +
-            ":" + str(self.options["rpcport"]))
-        self.authServiceProxy = bitcoinrpc.authproxy.AuthServiceProxy(s)
+    def setup_pool(self):
+        self.pool = get_pool(self.host, self.options["rpcport"], self.options["rpcuser"],
+                             self.options["rpcpassword"], self.poolSize, self.poolIdleTimeout)
 
     def _detect_connection(self):
         options = self.options
@@ -168,15 +313,61 @@ class CoinRpc(object):
         self.connectionType = CONTYPECLIENT
         if options == None:
             self.options = self.get_options()
-        self.setup_authServiceProxy()
+        self.setup_pool()
         try:
             self.call("help")
         except:
             errorString += "\n\n" + traceback.format_exc()
             raise RpcConnectionError("Auto detect connection failed: " + errorString)
 
+    def reload_cookie_if_changed(self):
+        """Re-read the credentials if the client has written a new cookie file
+        (e.g. after a restart). Only costs a stat() call otherwise."""
+        if not self.cookieFile:
+            return
+        try:
+            mtime = os.path.getmtime(self.cookieFile)
+        except OSError:
+            return  # client is not running - keep the old credentials
+        if mtime == self.cookieMtime:
+            return
+        with self._reloadLock:
+            if mtime == self.cookieMtime:
+                return  # reloaded by another thread
+            if DEBUG:
+                print("cookie file changed, reloading credentials")
+            oldPool = self.pool
+            self.options = self.get_options()
+            self.setup_pool()
+            if oldPool is not None and oldPool is not self.pool:
+                drop_pool(oldPool)  # the old cookie is not accepted any more
+
     def call(self, method="getinfo", params=[]):
+        if not callObservers:
+            return self._call(method, params)
+        start = time.time()
+        error = None
+        try:
+            return self._call(method, params)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            for observer in callObservers:
+                observer(method, time.time() - start, error)
+
+    def _call(self, method, params):
+        started = time.time()
+        try:
+            return self._send_call(method, params)
+        except (RpcConnectionError, RpcError) as e:
+            if not self.redetect_stale_state(e, started):
+                raise
+        return self._send_call(method, params)
+
+    def _send_call(self, method, params):
         if self.connectionType == CONTYPECLIENT:
+            self.reload_cookie_if_changed()
             val = self.query_server_asp(method, *params)
             #except Exception as e:
               #  raise RpcError(e)
@@ -189,33 +380,162 @@ class CoinRpc(object):
             assert False
 
         if val["error"]:
-            if self.connectionType == CONTYPECLIENT:
-                for e in clientErrorClasses:
-                    if e.code == val["error"]["code"]:
-                        raise e(val["error"])
-            raise RpcError(val)  # attn: different format for client and nmcontrol
+            raise self._error(val)
 
         return val["result"]
 
-    def query_server_asp(self, method, *params):
-        val = {"error" : None, "code":None}
+    def _error(self, val):
+        """Return the exception matching an error result."""
+        if self.connectionType == CONTYPECLIENT:
+            for e in clientErrorClasses:
+                if e.code == val["error"]["code"]:
+                    return e(val["error"])
+        return RpcError(val)  # attn: different format for client and nmcontrol
+
+    def call_batch(self, calls, raiseErrors=True):
+        """Send several calls [(method, params), ...] in a single JSON-RPC 2.0
+        batch round trip and return their results in order. With raiseErrors=False
+        failed calls are returned as exception instances instead of raising the
+        first error."""
+        if not callObservers:
+            return self._call_batch(calls, raiseErrors)
+        start = time.time()
+        error = None
+        try:
+            return self._call_batch(calls, raiseErrors)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            for observer in callObservers:
+                observer("batch", time.time() - start, error)
+
+    def _call_batch(self, calls, raiseErrors):
+        if not calls:
+            return []
+        started = time.time()
         try:
+            return self._send_batch(calls, raiseErrors)
+        except (RpcConnectionError, RpcError) as e:
+            if not self.redetect_stale_state(e, started):
+                raise
+        return self._send_batch(calls, raiseErrors)
+
+    def _send_batch(self, calls, raiseErrors):
+        batch = []
+        for method, params in calls:
+            if self.connectionType == CONTYPECLIENT:
+                requestId = self.pool.next_id()
+            else:
+                requestId = len(batch) + 1
+            batch.append({"jsonrpc": "2.0", "method": method, "params": list(params),
+                          "id": requestId})
+
+        if self.connectionType == CONTYPECLIENT:
+            self.reload_cookie_if_changed()
+            resp = self.pool.request(batch)
+        elif self.connectionType == CONTYPENMCONTROL:
+            resp = self.query_server(json.dumps(batch))
+            try:
+                resp = json.loads(resp.decode(encoding))
+            except ValueError:
+                resp = None
+        else:
+            assert False
+
+        if not isinstance(resp, list):
+            if self.connectionType == CONTYPENMCONTROL:
+                # no batch support on the server side - fall back to single calls
+                return self._call_sequential(calls, raiseErrors)
+            val = {"error": resp.get("error"), "result": None}
+            val["code"] = val["error"]["code"] if val["error"] else None
+            raise self._error(val)
+
+        responses = {}
+        for r in resp:
+            responses[r.get("id")] = r
+        results = []
+        for request in batch:
+            r = responses.get(request["id"],
+                              {"error": {"code": -343, "message": "missing JSON-RPC result"}})
+            val = {"error": r.get("error"), "result": r.get("result")}
+            if val["error"]:
+                val["code"] = val["error"].get("code", "NA")
+                e = self._error(val)
+                if raiseErrors:
+                    raise e
+                results.append(e)
+            else:
+                results.append(val["result"])
+        return results
+
+    def _call_sequential(self, calls, raiseErrors):
+        results = []
+        for method, params in calls:
             try:
-                val['result'] = self.authServiceProxy.__getattr__(method)(*params)
-            except socket.error as e:
-                if e.errno == 10053:  # closed by host
-                    # workaround for closed connection - why? timeout?
-                    if DEBUG:
-                        print("connection closed by host, setting up new one")
-                    self.setup_authServiceProxy()
-                    val['result'] = self.authServiceProxy.__getattr__(method)(*params)
-                else:
+                results.append(self.call(method, params))
+            except (RpcError, ClientError) as e:
+                if raiseErrors:
                     raise
-        except bitcoinrpc.authproxy.JSONRPCException as e:
-            val = {"error" : e.error}
+                results.append(e)
+        return results
+
+    def save_state(self, filename):
+        """Write connection type and credentials for get_cached_rpc, readable
+        by the current user only."""
+        state = {"connectionType": self.connectionType, "options": self.options,
+                 "datadir": self.datadir, "cookieFile": self.cookieFile,
+                 "cookieMtime": self.cookieMtime}
+        tmpFilename = filename + ".tmp"
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with os.fdopen(os.open(tmpFilename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(state, f, default=_encode_decimal)
+        try:
+            os.replace(tmpFilename, filename)  # Python 3.3+
+        except AttributeError:
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpFilename, filename)
+
+    def redetect_stale_state(self, e, started):
+        """Detect the connection again if the state file is out of date (client
+        moved, new credentials) - once per process. Returns whether a call that
+        failed with e and was started at started should be retried."""
+        if self.stateFile is None:
+            return False
+        if not isinstance(e, RpcConnectionError):
+            val = e.args[0] if e.args else None
+            if not isinstance(val, dict) or val.get("code") != -342:  # -342: HTTP error, e.g. 401
+                return False
+        with self._stateLock:
+            if self.stateRedetected is None:
+                if DEBUG:
+                    print("connection state is stale, detecting again:", repr(e))
+                self.stateRedetected = time.time()  # once, even if the detection fails
+                self.connectionType = "auto"
+                self.options = None
+                self.pool = None
+                self.cookieFile = None
+                self._detect_connection()
+                try:
+                    self.save_state(self.stateFile)
+                except (IOError, OSError):
+                    pass
+                return True
+            return started < self.stateRedetected  # failed with the old state
+
+    def query_server_asp(self, method, *params):
+        data = {"version": "1.1", "method": method, "params": params,
+                "id": self.pool.next_id()}
+        resp = self.pool.request(data)
+        if resp.get("error") is None and not "result" in resp:
+            resp["error"] = {"code": -343, "message": "missing JSON-RPC result"}
+        val = {"error": resp.get("error"), "code": None, "result": resp.get("result")}
+        if val["error"]:
             try:
-                val["code"] = e.error["code"]
-            except KeyError:
+                val["code"] = val["error"]["code"]
+            except (KeyError, TypeError):
                 val["code"] = "NA"
         return val
 
@@ -227,8 +547,8 @@ class CoinRpc(object):
             if self.timeout:
                 s.settimeout(self.timeout)
             s.connect((self.host, int(self.options["rpcport"])))
-            s.sendall(data)
-            result = ""
+            s.sendall(data.encode("utf-8"))
+            result = b""
             while True:
                 tmp = s.recv(self.bufsize)
                 if not tmp:
@@ -274,8 +594,11 @@ class CoinRpc(object):
         try:
             filename = self.datadir + "/" + COOKIEAUTH_FILE
             with open(filename) as f:
+                    mtime = os.fstat(f.fileno()).st_mtime
                     line = f.readline()
                     options['rpcuser'], options['rpcpassword'] = line.split (':')
+            self.cookieFile = filename
+            self.cookieMtime = mtime
         except IOError as e:
             if e.errno == 2:
                 raise IOError(e.errno, "namerpc: Could not open cookie file: " + str(filename))
@@ -320,11 +643,11 @@ class CoinRpc(object):
 
     def chainage(self):
         c = self.call("getblockcount")
+        hashes = self.call_batch([("getblockhash", [c - i]) for i in [0, 1, 2]])
+        headers = self.call_batch([("getblockheader", [h]) for h in hashes])
         T = 0
         for i in [0, 1, 2]:
-            h = self.call("getblockhash", [c - i])
-            t = self.call("getblock", [h])["time"]
-            T += t + i * 60 * 9  # conservative
+            T += headers[i]["time"] + i * 60 * 9  # conservative
         t = T / 3
         return int(round(time.time() - t))
 
@@ -346,6 +669,51 @@ class CoinRpc(object):
                 raise NameDoesNotExistError()
         return data
 
+_sharedRpcs = {}
+_sharedRpcsLock = threading.Lock()
+
+def get_shared_rpc(connectionType="auto", datadir=None):
+    """Return the process wide CoinRpc for connectionType and datadir.
+    Connection auto detection and reading the credentials happen only once;
+    concurrent first callers wait for the single detection. With STATEFILE set
+    auto detection is done only once across processes."""
+    key = (connectionType, datadir)
+    with _sharedRpcsLock:
+        rpc = _sharedRpcs.get(key)
+        if rpc is None:
+            if STATEFILE and connectionType == "auto":
+                rpc = get_cached_rpc(STATEFILE, datadir)
+            else:
+                rpc = CoinRpc(connectionType=connectionType, datadir=datadir)
+            _sharedRpcs[key] = rpc
+    return rpc
+
+def get_cached_rpc(stateFile, datadir=None):
+    """CoinRpc with the connection type and credentials stored in stateFile
+    (one per datadir), without auto detection. If there is no usable state it is detected and
+    written. A state that turns out stale on the first failing call is
+    detected again."""
+    try:
+        with open(stateFile) as f:
+            state = json.load(f)
+        rpc = CoinRpc(connectionType=state["connectionType"], options=state["options"])
+        rpc.datadir = state["datadir"]
+        rpc.cookieFile = state["cookieFile"]
+        rpc.cookieMtime = state["cookieMtime"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        rpc = CoinRpc(datadir=datadir)
+        try:
+            rpc.save_state(stateFile)
+        except (IOError, OSError):
+            pass
+    rpc.stateFile = stateFile
+    return rpc
+
+def set_shared_rpc(rpc, connectionType="auto", datadir=None):
+    """Register an existing CoinRpc (e.g. with explicit options) as shared client."""
+    with _sharedRpcsLock:
+        _sharedRpcs[(connectionType, datadir)] = rpc
+
 if __name__ == "__main__":
     rpc = CoinRpc(connectionType=CONTYPECLIENT)
     print(rpc.call("getblockhash", [33]))
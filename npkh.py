@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
+import json
 import sys
 
 import common
@@ -15,10 +16,53 @@ pluginKeyHandler.IdRequest = pluginKeyHandler.StandaloneIdRequest
 
 urlopen = pluginKeyHandler.urlopen
 
-# nicer exceptions for command line
+# nicer exceptions for command line - not for --serve, the server answers with the HTTP error
 def raise_exception(code, message):
     raise Exception(str(code) + ": " + str(message))
-pluginKeyHandler.bottle.abort = raise_exception
+
+def setup_command_line(abortRaisesHttpError=False):
+    if not abortRaisesHttpError:  # --bulk reports the status codes
+        pluginKeyHandler.bottle.abort = raise_exception
+    pluginKeyHandler.FPRINDEXSAVE = False  # the server or other runs may be writing the index
+    if pluginKeyHandler.RPCSTATEFILE:  # reuse the connection detected by an earlier run
+        import namerpc
+        import platformDep
+        namerpc.STATEFILE = platformDep.getNmcontrolDir() + "/" + pluginKeyHandler.RPCSTATEFILE
+
+def bulk(op, filename=None, workers=pluginKeyHandler.BULKWORKERS, ordered=False):
+    """Look up the names, fingerprints or other searches in filename (one per
+    line, stdin if None or "-") concurrently, print one json object per
+    lookup. Returns the number of failed lookups."""
+    f = sys.stdin if filename in (None, "-") else open(filename)
+    try:
+        searches = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    import namerpc
+    rpc = namerpc.get_shared_rpc()
+    rpc.poolSize = workers  # keep a connection per worker open
+    if rpc.pool:
+        rpc.pool.size = workers
+    rh = pluginKeyHandler.RequestHandler()
+    failed = 0
+    for i, search, status, body, seconds in rh.iter_lookups(searches, op, workers, ordered):
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", "replace")
+        result = {"search": search, "op": op, "status": status, "ms": round(seconds * 1000, 1)}
+        if status == 200:
+            result["result"] = body
+            if op == "index":
+                for line in body.split("\n"):
+                    if line.startswith("pub:"):
+                        result["fpr"] = "0x" + line.split(":")[1]
+                        break
+        else:
+            result["error"] = str(body)
+            failed += 1
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+    return failed
 
 def help():
     print("npkh - Namecoin PGP Key Handler v0.2")
@@ -28,6 +72,10 @@ def help():
     print("npkh get 0xFC819E25D6AC1119F748479DCBF940B772132E18")
     print()
     print("--serve (needs Namecoin client running)")
+    print("  --server=threadpool|asyncio|wsgiref (default: " + pluginKeyHandler.DEFAULTSERVERBACKEND + ")")
+    print("--bulk index|get [FILE] (one search per line, default stdin; prints json lines)")
+    print("  --workers=N (default: " + str(pluginKeyHandler.BULKWORKERS) + ")")
+    print("  --ordered (in input order instead of as the lookups finish)")
     print("--rpcinfo")
     print("--debug")
     print("--test_direct")
@@ -46,12 +94,47 @@ for op in ["get", "index"]:
 if "--help" in sys.argv:
     help()
 elif "--serve" in sys.argv:
-    ks = pluginKeyHandler.KeyServer()
+    idIndex = None
+    if pluginKeyHandler.IDINDEX:
+        idIndex = pluginKeyHandler.start_id_namespace_index()
+    serverBackend = pluginKeyHandler.DEFAULTSERVERBACKEND
+    for a in sys.argv:
+        if a.startswith("--server="):
+            serverBackend = a.split("=", 1)[1]
+    ks = pluginKeyHandler.KeyServer(idIndex=idIndex, serverBackend=serverBackend)
     ks.start()
+elif "--bulk" in sys.argv:
+    setup_command_line(abortRaisesHttpError=True)
+    bulkOp = "index"
+    filename = None
+    workers = pluginKeyHandler.BULKWORKERS
+    for a in sys.argv[1:]:
+        if a in ("get", "index"):
+            bulkOp = a
+        elif a.startswith("--workers="):
+            try:
+                workers = int(a.split("=", 1)[1])
+            except ValueError:
+                workers = 0
+            if workers < 1:
+                sys.exit("npkh --bulk: --workers needs a positive number: " + a)
+        elif a in ("--bulk", "--ordered"):
+            pass
+        elif a.startswith("-") and a != "-":
+            sys.exit("npkh --bulk: unknown option: " + a + " (--help for help)")
+        elif filename is None:
+            filename = a
+        else:
+            sys.exit("npkh --bulk: more than one input file: " + a)
+    sys.exit(1 if bulk(bulkOp, filename, workers, "--ordered" in sys.argv) else 0)
 elif "--rpcinfo" in sys.argv:
-    print(pluginKeyHandler.rpcConnectionType)
-    print(pluginKeyHandler.rpcOptions)
+    setup_command_line()
+    import namerpc
+    rpc = namerpc.get_shared_rpc()
+    print(rpc.connectionType)
+    print(rpc.options)
 elif "--test_direct" in sys.argv:
+        setup_command_line()
         print("testing...")
         def parse_fpr(s):
             s = s.split("\n")[1]
@@ -83,6 +166,8 @@ elif "--test_query" in sys.argv:
         print(url_read("http://127.0.0.1:8083/pks/lookup?search=0xFC819E25D6AC1119F748479DCBF940B772132E18&op=get")[0:100] + "..." + "\n")
         print(url_read("http://127.0.0.1:8083/pks/lookup?search=0x1142850e6dff65ba63d688a8b2492ac4a7330737&op=get")[0:100] + "..." + "\n")
 elif op:
+    setup_command_line()
+    pluginKeyHandler.NAMECACHE = False  # a single lookup gains nothing from following the chain tip
     rh = pluginKeyHandler.RequestHandler()
     print(str(rh.lookup(arg, op)))
 else:
@@ -2,14 +2,9 @@ import common
 app = common.app  # global NMControl app object
 import threading
 import os
-from optparse import OptionGroup
 
-try:
-    from ConfigParser import SafeConfigParser  # Python 2.X
-except ImportError:
-    from configparser import SafeConfigParser  # Python 3+
-
-import inspect
+# optparse, configparser and inspect are imported where they are used - the
+# key handler loads this module also for command line lookups
 
 log = common.get_logger(__name__)
 
@@ -130,6 +125,7 @@ class PluginThread(threading.Thread):
         return help
 
     def _getPluginMethods(self):
+        import inspect
         parents = []
         parentmethods = inspect.getmembers(threading.Thread)
         for (method, value) in parentmethods:
@@ -160,6 +156,7 @@ class PluginThread(threading.Thread):
 
         # add command line args to the program options + build default configuration data
         defaultConf = '[' + self.name + ']\n'
+        from optparse import OptionGroup
         group = OptionGroup(app['parser'], self.name.capitalize() + " Options", self.desc)
         for option in self.options:
             value = self.options[option]
@@ -188,6 +185,10 @@ class PluginThread(threading.Thread):
             fp.close()
 
         # read user config
+        try:
+            from ConfigParser import SafeConfigParser  # Python 2.X
+        except ImportError:
+            from configparser import SafeConfigParser  # Python 3+
         fileconf = SafeConfigParser()
         fileconf.read(userConfFile)
 
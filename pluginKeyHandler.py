@@ -3,9 +3,74 @@
 DEFAULTHOST = "127.0.0.1"  # 0.0.0.0 allows public access
 DEFAULTPORT = "8083"
 DEFAULTKEYSERVER = "sks-keyservers.net"  # only TLS enabled servers!
-
-CACHETIMETOLIVEMINUTES = 5
-MAXCACHESIZE = 10
+KEYSERVERSCHEME = "https"  # "http" only for local test servers
+RPCSTATEFILE = "rpcstate.json"  # in the NMControl dir, command line: reuse the detected rpc connection, None: detect every time
+DEFAULTSERVERBACKEND = "threadpool"  # "threadpool", "asyncio" (Python 3) or "wsgiref" (one request at a time)
+SERVERWORKERS = 16  # max concurrently handled requests
+KEEPALIVESECONDS = 5  # idle keep-alive connections are closed after this
+SERVERIOSECONDS = 60  # socket timeout while a request is read and its response written
+MAXREQUESTBODYBYTES = 1024 * 1024  # larger request bodies are refused (asyncio backend)
+SERVERSTOPSECONDS = 10  # stop() waits this long for running requests
+UPSTREAMCONNECTIONSPERHOST = 4  # max parallel connections to one upstream server
+UPSTREAMIDLESECONDS = 30  # idle upstream keep-alive connections are not reused after this
+UPSTREAMTIMEOUT = 15  # seconds
+KEYFETCHSECONDS = 15  # deadline for downloading a key from all sources
+KEYFETCHHEDGESECONDS = 1  # start the next key source if the previous one has not answered by then, 0: all at once
+
+# fingerprint <-> name index for follow up requests by fingerprint
+CACHETIMETOLIVEMINUTES = 60 * 24  # fingerprints are checked against the name on every use anyway
+MAXCACHESIZE = 50000
+FPRINDEXFILE = "fprindex.json"  # in the NMControl dir, None: memory only
+FPRINDEXSAVESECONDS = 60
+FPRINDEXSAVE = True  # False: the index file is loaded but never written (command line runs)
+
+# verified keys by fingerprint
+KEYSTOREFILE = "keystore.sqlite"  # in the NMControl dir, None: no key store
+KEYSTOREMAXBYTES = 50 * 1024 * 1024  # least recently used keys are evicted beyond this
+KEYREFRESHHOURS = 24  # older keys are served but refetched in the background (e.g. for revocations)
+
+# standalone mode: block height -> (block hash, mediantime) of name registrations
+REORGSAFETYDEPTH = 12  # blocks - only headers with more confirmations are cached
+BLOCKTIMECACHESIZE = 10000
+BLOCKTIMECACHEFILE = "blocktimes.json"  # in the NMControl dir, None: memory only
+BLOCKTIMECACHESAVESECONDS = 60
+
+# standalone mode: name_show results cached until a block touches the name
+NAMECACHE = True
+NAMECACHESIZE = 10000
+NAMECACHEMAXWALK = 6  # max number of new blocks inspected, more drops the whole cache
+TIPPOLLSECONDS = 5  # getbestblockhash poll interval - bounds staleness without push notifications
+NAMECACHECHECKTIP = 1  # without push notifications a hit rechecks the tip if the last check is older (seconds), None: up to TIPPOLLSECONDS stale
+ZMQHASHBLOCK = None  # e.g. "tcp://127.0.0.1:28332" (client option zmqpubhashblock, needs pyzmq)
+
+# standalone mode: fingerprint index over the whole id/ namespace
+MAXKEYBYTES = 16 * 1024 * 1024  # larger keys and keyserver responses are refused
+STREAMTHRESHOLDBYTES = 256 * 1024  # larger proxied responses are spooled to a temporary file and not cached
+GZIPMINBYTES = 1024  # smaller responses are not compressed
+GZIPLEVEL = 6
+METRICS = True  # /metrics in Prometheus text format
+LATENCYBUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+SERVERTIMING = True  # per lookup phase durations in a Server-Timing header and the debug log
+PROFILESAMPLESECONDS = 0.005  # stack sampling interval of the on demand profiler
+BATCHMAXSEARCHES = 100  # per /pks/batch request
+BATCHWORKERS = 8  # concurrently resolved searches per batch request
+BULKWORKERS = 16  # concurrent lookups of the command line bulk mode (npkh.py --bulk)
+
+PROXYCACHE = True  # cache responses of the standard keyserver
+PROXYCACHEMAXBYTES = 16 * 1024 * 1024
+PROXYCACHEINDEXSECONDS = 10 * 60
+PROXYCACHEGETSECONDS = 60 * 60
+PROXYCACHENOTFOUNDSECONDS = 60  # "No keys found." is cached shortly
+
+IDINDEX = True
+IDINDEXPAGESIZE = 1000  # names per name_scan call
+IDINDEXMAXSIZE = 1000000
+IDINDEXFILE = "idindex.json"  # in the NMControl dir, None: memory only
+IDINDEXREORGDEPTH = 100  # blocks with undo records, deeper reorgs trigger a rebuild
+IDINDEXMAXCATCHUP = 2000  # blocks - further behind a rebuild is cheaper than per block sync
+IDINDEXSYNCSECONDS = 60  # sync interval if no new tip was signalled
+NAMEEXPIRATIONDEPTH = 36000  # blocks
+BLOCKSECONDS = 600  # average
 
 """
 The main OpenPGP HTTP Keyserver Protocol functions are 'index' to search for a list
@@ -21,54 +86,75 @@ verifying that a key matches a long fingerprint).
 
 """
 
-# workaround to make bottle stoppable - this can be cleaned up with bottle 0.13
-import wsgiref.simple_server
-original_make_server = wsgiref.simple_server.make_server
-def my_make_server(*args, **kwargs):
-    server = original_make_server(*args, **kwargs)
-    args[2].server = server  # app
-    return server
-wsgiref.simple_server.make_server = my_make_server
-# now stop via app.server.shutdown()
-
 # Python3 compatibility
 try:
     unicode("")
 except NameError:
     unicode = str
 
-def remove_value(dic, value):
-    """remove all items with value if any (in place)"""
-    for k, v in list(dic.items()):
-        if v == value:
-           del dic[k]
-
 import re
 ALLOWEDRE = "^id/[a-z0-9]+([-]?[a-z0-9])*$"
 reg = re.compile(ALLOWEDRE)
 
+import sys
 import json
+import threading
+import socket
+import os
+import time
+import atexit
+import logging
+import hashlib
+import bisect
+import zlib
+import types
+import binascii
+import struct
+import tempfile
+from collections import OrderedDict
 
 import contextlib
+import copy
+import importlib
 
 try:
     from urllib import quote  # Python 2.X
+    from urlparse import urlsplit, urljoin
 except ImportError:
-    from urllib.parse import quote  # Python 3+
+    from urllib.parse import quote, urlsplit, urljoin  # Python 3+
+
+class LazyModule(object):
+    """Imports the module on first attribute access - command line lookups
+    don't need the web framework or the HTTP client. Attributes set on the
+    proxy (npkh replaces bottle.abort) shadow the module's."""
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+httplib = LazyModule("httplib" if sys.version_info[0] < 3 else "http.client")
+def urlopen(url, timeout=None):  # ensure "with"-context manager also in Python 2
+    try:
+        from urllib2 import urlopen as urlopen_orig # Python 2.X
+    except ImportError:
+        from urllib.request import urlopen as urlopen_orig  # Python 3+
+    if timeout is None:
+        return contextlib.closing(urlopen_orig(url))
+    return contextlib.closing(urlopen_orig(url, timeout=timeout))
+
 try:
-    from urllib2 import urlopen as urlopen_orig # Python 2.X
+    import Queue as queue  # Python 2.X
 except ImportError:
-    from urllib.request import urlopen as urlopen_orig  # Python 3+
-
-def urlopen(url):  # ensure "with"-context manager also in Python 2
-    return contextlib.closing(urlopen_orig(url))
-
-import bottle
-
-from expiringdict import ExpiringDict
+    import queue  # Python 3+
 
+bottle = LazyModule("bottle")
 
 import common
+import platformDep
 
 if __name__ == "__main__":
     common.app['debug'] = True
@@ -86,6 +172,10 @@ class pluginKeyHandler(plugin.PluginThread):
         'port' : ['Listen on port', DEFAULTPORT, '<port>'],
         'keyserver' : ['Proxy keyserver', DEFAULTKEYSERVER, '<keyserver>'],
     }
+    helps = {
+        'profile' : [1, 1, '[requests]', 'Sample stacks of the next requests lookups (default 20), admin only'],
+        'profileReport' : [0, 0, '', 'Last profile report, admin only'],
+    }
     server = None
 
     def pStart(self):
@@ -105,20 +195,196 @@ class pluginKeyHandler(plugin.PluginThread):
         self.server = None
         return True
 
-import pgpdump
-def calc_fingerprint(asciiArmored):
+    def profile(self, requests=20, *args):  # not public: admin api user only
+        """Profile the next requests lookups, the report is written to the NMControl dir."""
+        if not profiler.arm(int(requests)):
+            return "Profiler is busy."
+        return "Profiling the next " + str(int(requests)) + " lookups."
+
+    def profileReport(self, *args):  # not public: admin api user only
+        if profiler.lastReport is None:
+            return "No profile yet."
+        return profiler.lastReport
+
+def calc_fingerprint_pgpdump(asciiArmored):
+    import pgpdump  # only needed if the fast path fails
     a = pgpdump.AsciiData(asciiArmored)
     p = a.packets()
     try:  # python 2 compatibility
         n = p.next()
     except AttributeError:
         n = next(p)
-    fpr = "0x" + n.fingerprint.lower().decode("utf-8")
+    return "0x" + n.fingerprint.lower().decode("utf-8")
+
+CRC24POLY = 0x1864CFB
+
+def _clmul(a, b):
+    """Carry-less (GF(2) polynomial) multiplication."""
+    r = 0
+    while b:
+        low = b & -b
+        r ^= a << (low.bit_length() - 1)
+        b ^= low
+    return r
+
+def _polymod24(d):
+    for i in range(d.bit_length() - 1, 23, -1):
+        if d >> i & 1:
+            d ^= CRC24POLY << (i - 24)
+    return d
+
+CRC24XPOW = [2]  # x^(2^j) mod CRC24POLY
+for _j in range(48):
+    CRC24XPOW.append(_polymod24(_clmul(CRC24XPOW[-1], CRC24XPOW[-1])))
+
+def crc24(data):
+    """OpenPGP armor checksum. Computed as (init * x^(8n) + data * x^24) mod P on
+    one big integer, folding the upper half onto the lower one until it is
+    small - much faster than a Python loop per byte."""
+    if not data:
+        return 0xB704CE
+    d = (0xB704CE << (8 * len(data))) ^ (int(binascii.hexlify(data), 16) << 24)
+    while d.bit_length() > 48:
+        j = (d.bit_length() - 1).bit_length() - 1
+        k = 1 << j
+        d = _clmul(d >> k, CRC24XPOW[j]) ^ (d & ((1 << k) - 1))
+    return _polymod24(d)
+
+class ArmorChecksumError(ValueError):
+    pass
+
+def dearmor(data, partial=False):
+    """Return the binary OpenPGP data of the first armored block in data. The
+    checksum is verified if present. Binary input is returned unchanged. With
+    partial=True data may be the beginning of a block only - nothing is
+    verified then and only the complete base64 groups are decoded."""
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    begin = data.find(b"-----BEGIN PGP")
+    if begin == -1:
+        return data
+    pos = data.find(b"\n", begin) + 1
+    while True:  # skip armor headers up to the empty line
+        eol = data.find(b"\n", pos)
+        line = data[pos:eol]
+        if eol == -1 or not line.strip() or b":" not in line:
+            break
+        pos = eol + 1
+    end = data.find(b"-----END", pos)
+    if pos == 0 or (end == -1 and not partial):
+        raise ValueError("Incomplete armor.")
+    body = data[pos:end] if end != -1 else data[pos:]
+    checksum = None
+    crcPos = body.rfind(b"\n=")  # base64 lines never start with "="
+    if crcPos != -1:
+        body, checksum = body[:crcPos], body[crcPos + 2:].strip()
+    if partial:
+        body = b"".join(body.split())
+        body = body[:len(body) - len(body) % 4]
+        checksum = None
+    try:
+        binary = binascii.a2b_base64(body)
+        if checksum is not None:
+            expected = struct.unpack(">I", b"\x00" + binascii.a2b_base64(checksum))[0]
+    except (binascii.Error, struct.error):
+        raise ValueError("Bad armor.")
+    if checksum is not None and crc24(binary) != expected:
+        raise ArmorChecksumError("Armor checksum mismatch.")
+    return binary
+
+def iter_packets(data):
+    """Yield (tag, start, end) of the packet bodies in binary OpenPGP data
+    without parsing them."""
+    pos = 0
+    while pos < len(data):
+        b = bytearray(data[pos:pos + 6])  # indexing yields ints with Python 2 and 3
+        if not b[0] & 0x80:
+            raise ValueError("Bad packet header.")
+        if b[0] & 0x40:  # new format
+            tag = b[0] & 0x3f
+            pos += 1
+            start = pos
+            chunks = 0
+            while True:
+                l = bytearray(data[pos:pos + 5])
+                if l[0] < 192:
+                    length, pos = l[0], pos + 1
+                elif l[0] < 224:
+                    length, pos = ((l[0] - 192) << 8) + l[1] + 192, pos + 2
+                elif l[0] == 255:
+                    length, pos = struct.unpack(">I", bytes(l[1:5]))[0], pos + 5
+                else:  # partial body length - only for data packets, skipped here
+                    pos += 1 + (1 << (l[0] & 0x1f))
+                    chunks += 1
+                    continue
+                pos += length
+                break
+            if chunks:
+                start = None  # body is not contiguous
+            else:
+                start = pos - length
+        else:  # old format
+            tag = (b[0] >> 2) & 0xf
+            lengthType = b[0] & 3
+            if lengthType == 3:
+                start, pos = pos + 1, len(data)
+            else:
+                size = (1, 2, 4)[lengthType]
+                length = struct.unpack(">" + "BHI"[lengthType], bytes(b[1:1 + size]))[0]
+                start = pos + 1 + size
+                pos = start + length
+        if pos > len(data):
+            raise ValueError("Truncated packet.")
+        yield tag, start, pos
+
+def key_fingerprint(body):
+    """Fingerprint of a public key packet body: SHA-1 for v4 keys, SHA-256 for
+    v5 and v6 keys."""
+    version = bytearray(body[:1])[0]
+    if version == 4:
+        return hashlib.sha1(b"\x99" + struct.pack(">H", len(body)) + body).hexdigest()
+    if version in (5, 6):
+        prefix = b"\x9a" if version == 5 else b"\x9b"
+        return hashlib.sha256(prefix + struct.pack(">I", len(body)) + body).hexdigest()
+    raise ValueError("Unsupported key version: " + str(version))
+
+def iter_primary_fingerprints(data, partial=False):
+    """Yield the lowercase fingerprints of all primary keys in armored or binary
+    data, e.g. a keyring."""
+    binary = dearmor(data, partial)
+    for tag, start, end in iter_packets(binary):
+        if tag == 6:  # public key packet
+            if start is None:
+                raise ValueError("Bad public key packet.")
+            yield key_fingerprint(binary[start:end])
+
+def calc_fingerprint(asciiArmored):
+    """Fingerprint of the first primary key. Only the armor and the packet
+    headers are processed, pgpdump is used for anything unexpected."""
+    try:
+        fpr = "0x" + next(iter_primary_fingerprints(asciiArmored))
+    except StopIteration:
+        fpr = calc_fingerprint_pgpdump(asciiArmored)
+    except ArmorChecksumError:
+        raise
+    except (ValueError, IndexError, struct.error) as e:
+        log.debug("calc_fingerprint: fast path failed, using pgpdump:", repr(e))
+        fpr = calc_fingerprint_pgpdump(asciiArmored)
     log.debug("calc_fingerprint:", fpr)
     return fpr
 
-def validate_fingerprint(fpr, s):
-    calculatedFpr = calc_fingerprint(s)
+def head_fingerprint(head):
+    """Fingerprint of the first primary key from the beginning of armored or
+    binary data, None if that is not complete yet."""
+    try:
+        return "0x" + next(iter_primary_fingerprints(head, partial=True))
+    except (StopIteration, ValueError, IndexError, struct.error):
+        return None
+
+def validate_fingerprint(fpr, s, partial=False):
+    """With partial=True s may be the beginning of the key only."""
+    with span("fprcheck"):
+        calculatedFpr = head_fingerprint(s) if partial else calc_fingerprint(s)
     if not "0x" in fpr:
         fpr = "0x" + fpr
     try:
@@ -129,9 +395,682 @@ def validate_fingerprint(fpr, s):
     else:
         log.debug("validate_fingerprint: proxy_to_standard_pks: match", calculatedFpr)
 
+class NoFprError(ValueError):
+    pass
+
+def extract_fpr(value):
+    """Return the lowercase fingerprint from the name value fields 'gpg/fpr' or
+    'fpr'. Raises NoFprError or ValueError for missing or unusable fingerprints."""
+    try:
+        fpr = value["gpg"]["fpr"]
+    except (KeyError, TypeError):
+        try:
+            fpr = value["fpr"]  # untidy?
+        except (KeyError, TypeError):
+            raise NoFprError("No fingerprint found.")
+    try:
+        fpr = fpr.lower()
+        int(fpr, base=16)
+    except (AttributeError, ValueError):
+        raise ValueError("Bad fingerprint.")
+    if len(fpr) < 40:  # 40: sha1
+        raise ValueError("Insecure fingerprint.")
+    return fpr
+
+class Counter(object):
+    """Prometheus counter with a fixed set of label names. Label values are
+    passed as a tuple."""
+    def __init__(self, name, help, labelNames):
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append("%s%s %s" % (self.name, format_labels(self.labelNames, labels), value))
+        return lines
+
+class Histogram(object):
+    """Prometheus histogram. An observation costs a bisect and a few integer
+    increments under a short lock."""
+    def __init__(self, name, help, labelNames, buckets=LATENCYBUCKETS):
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.buckets = buckets
+        self._series = {}  # labels -> [count per bucket..., count above, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                total += count
+                lines.append("%s_bucket%s %d" % (self.name, format_labels(
+                    self.labelNames + ("le",), labels + (str(bound),)), total))
+            lines.append("%s_sum%s %r" % (self.name, format_labels(self.labelNames, labels), series[-1]))
+            lines.append("%s_count%s %d" % (self.name, format_labels(self.labelNames, labels), total))
+        return lines
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for n, v in zip(names, values)) + "}"
+
+class Metrics(object):
+    """Process wide request, backend and upstream metrics."""
+    def __init__(self):
+        self.requests = Counter("npkh_requests_total", "Lookups by op, path and HTTP status.",
+                                ("op", "path", "status"))
+        self.requestSeconds = Histogram("npkh_request_duration_seconds", "Lookup latency.",
+                                        ("op", "path"))
+        self.rpcCalls = Counter("npkh_rpc_calls_total", "Namecoin RPC calls.", ("method", "result"))
+        self.rpcSeconds = Histogram("npkh_rpc_duration_seconds", "Namecoin RPC latency.", ("method",))
+        self.upstreamSeconds = Histogram("npkh_upstream_duration_seconds",
+                                         "Time to the response headers of upstream servers.", ("host",))
+        self.upstreamErrors = Counter("npkh_upstream_errors_total", "Failed upstream requests.", ("host",))
+
+    def observe_request(self, op, path, status, seconds):
+        self.requests.inc((op, path, status))
+        self.requestSeconds.observe((op, path), seconds)
+
+    def observe_rpc(self, method, seconds, error):
+        self.rpcCalls.inc((method, "ok" if error is None else "error"))
+        self.rpcSeconds.observe((method,), seconds)
+
+    def render(self):
+        lines = []
+        for metric in (self.requests, self.requestSeconds, self.rpcCalls, self.rpcSeconds,
+                       self.upstreamSeconds, self.upstreamErrors):
+            lines.extend(metric.render())
+        return lines
+
+metrics = Metrics()
+
+requestContext = threading.local()  # state of the lookup handled by the current thread
+
+class RequestTimer(object):
+    """Durations and counts of the phases of one lookup."""
+    def __init__(self):
+        self.start = time.time()
+        self.phases = OrderedDict()  # phase -> [seconds, count]
+
+    def add(self, phase, seconds):
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def merge(self, other):
+        """Add the phases of a timer of a finished helper thread."""
+        for phase, entry in other.phases.items():
+            mine = self.phases.setdefault(phase, [0, 0])
+            mine[0] += entry[0]
+            mine[1] += entry[1]
+
+    def server_timing(self):
+        parts = ["%s;dur=%.1f" % (phase, entry[0] * 1000) for phase, entry in self.phases.items()]
+        parts.append("total;dur=%.1f" % ((time.time() - self.start) * 1000))
+        return ", ".join(parts)
+
+    def record(self):
+        return dict((phase, {"ms": round(entry[0] * 1000, 2), "count": entry[1]})
+                    for phase, entry in self.phases.items())
+
+class span(object):
+    """Context manager adding the time spent inside to a phase of the lookup of
+    the current thread, if any."""
+    __slots__ = ("phase", "timer", "start")
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.timer = getattr(requestContext, "timer", None)
+
+    def __enter__(self):
+        if self.timer is not None:
+            self.start = time.time()
+
+    def __exit__(self, *exc):
+        if self.timer is not None:
+            self.timer.add(self.phase, time.time() - self.start)
+
+class SamplingProfiler(object):
+    """Samples the stacks of the threads handling the next N lookups every
+    interval seconds and writes a report when they are done. Costs nothing
+    while not armed."""
+    def __init__(self, interval=PROFILESAMPLESECONDS):
+        self.interval = interval
+        self.remaining = 0  # lookups still to be profiled
+        self.lastReport = None
+        self.lastFilename = None
+        self._threads = {}  # thread id -> number of profiled lookups in progress
+        self._stacks = {}  # (outermost frame, ..., innermost frame) -> samples
+        self._started = 0
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def arm(self, requests):
+        with self._lock:
+            if self._sampler is not None:
+                return False
+            self.remaining = requests
+            self._started = 0
+            self._stacks = {}
+            self._sampler = threading.Thread(target=self._run)
+            self._sampler.daemon = True
+            self._sampler.start()
+        log.info("SamplingProfiler: profiling the next", requests, "lookups")
+        return True
+
+    def enter(self):
+        """Called by a thread starting a lookup, True if it is profiled."""
+        if not self.remaining:
+            return False
+        with self._lock:
+            if not self.remaining:
+                return False
+            self.remaining -= 1
+            self._started += 1
+            ident = threading.current_thread().ident
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+        return True
+
+    def leave(self):
+        with self._lock:
+            ident = threading.current_thread().ident
+            self._threads[ident] -= 1
+            if not self._threads[ident]:
+                del self._threads[ident]
+
+    def _run(self):
+        own = threading.current_thread().ident
+        while True:
+            with self._lock:
+                if not self.remaining and not self._threads:
+                    break
+                threads = list(self._threads)
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name,
+                                               code.co_firstlineno))
+                    frame = frame.f_back
+                stack = tuple(reversed(stack))
+                self._stacks[stack] = self._stacks.get(stack, 0) + 1
+            time.sleep(self.interval)
+        self.dump()
+        with self._lock:
+            self._sampler = None
+
+    def dump(self):
+        """Write the report (hot functions, then collapsed stacks for flame graph
+        tools) to the NMControl dir."""
+        total = sum(self._stacks.values())
+        own = {}
+        inclusive = {}
+        for stack, n in self._stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + n
+            for function in set(stack):
+                inclusive[function] = inclusive.get(function, 0) + n
+        lines = ["npkh profile: %d lookups, %d samples every %s s" % (self._started, total, self.interval), "",
+                 "%8s %8s  function (self, inclusive samples)" % ("self", "incl")]
+        for function, n in sorted(own.items(), key=lambda item: -item[1])[:30]:
+            lines.append("%8d %8d  %s" % (n, inclusive[function], function))
+        lines += ["", "collapsed stacks:"]
+        lines += ["%s %d" % (";".join(stack), n) for stack, n in sorted(self._stacks.items())]
+        self.lastReport = "\n".join(lines) + "\n"
+        filename = platformDep.getNmcontrolDir() + "/profile-" + time.strftime("%Y%m%d-%H%M%S") + ".txt"
+        try:
+            with open(filename, "w") as f:
+                f.write(self.lastReport)
+            self.lastFilename = filename
+        except IOError as e:
+            log.info("SamplingProfiler: could not write", filename, repr(e))
+        log.info("SamplingProfiler: done,", total, "samples, report:", filename)
+
+profiler = SamplingProfiler()
+
+class UpstreamError(Exception):
+    """Upstream server answered with an HTTP error status."""
+    def __init__(self, status, reason, url):
+        Exception.__init__(self, "%s %s: %s" % (status, reason, url))
+        self.status = status
+        self.reason = reason
+        self.url = url
+
+class UpstreamBusyError(UpstreamError):
+    """No connection to the upstream server became free in time."""
+    def __init__(self, url):
+        UpstreamError.__init__(self, 503, "All connections busy", url)
+
+class ResponseTooLargeError(ValueError):
+    pass
+
+def acquire_timeout(lock, timeout):
+    """lock.acquire() giving up after timeout seconds, returns whether acquired."""
+    try:
+        return lock.acquire(True, timeout)
+    except TypeError:  # Python 2.X: no timeout parameter
+        endTime = time.time() + timeout
+        while not lock.acquire(False):
+            if time.time() >= endTime:
+                return False
+            time.sleep(0.01)
+        return True
+
+PooledHTTPSConnection = None  # defined on first use by define_pooled_https_connection()
+
+def define_pooled_https_connection():
+    """Define PooledHTTPSConnection - subclassing loads http.client and ssl."""
+    global PooledHTTPSConnection
+    if PooledHTTPSConnection is not None:
+        return PooledHTTPSConnection
+    class PooledHTTPSConnection(httplib.HTTPSConnection):
+        """Resumes the TLS session of a previous connection to the same server."""
+        def __init__(self, host, port, pool, timeout):
+            httplib.HTTPSConnection.__init__(self, host, port, timeout=timeout,
+                                             context=pool.sslContext)
+            self.pool = pool
+
+        def connect(self):
+            httplib.HTTPConnection.connect(self)
+            session = self.pool.get_tls_session(self.host, self.port)
+            if session is not None:
+                self.sock = self.pool.sslContext.wrap_socket(self.sock, server_hostname=self.host,
+                                                             session=session)
+            else:
+                self.sock = self.pool.sslContext.wrap_socket(self.sock, server_hostname=self.host)
+    return PooledHTTPSConnection
+
+class HttpPool(object):
+    """Keep-alive connections to upstream HTTP(S) servers shared by all outbound
+    fetches. TLS sessions are resumed for new connections and there are at most
+    maxPerHost connections per server."""
+    redirectStatus = (301, 302, 303, 307, 308)
+
+    def __init__(self, maxPerHost=UPSTREAMCONNECTIONSPERHOST, idleSeconds=UPSTREAMIDLESECONDS,
+                 maxRedirects=5):
+        self.maxPerHost = maxPerHost
+        self.idleSeconds = idleSeconds
+        self.maxRedirects = maxRedirects
+        self._sslContext = None
+        self._idle = {}  # (scheme, host, port) -> [(lastUsed, connection), ...]
+        self._slots = {}  # (scheme, host, port) -> semaphore
+        self._tlsSessions = {}  # (host, port) -> ssl session
+        self._lock = threading.Lock()
+        self.metricHosts = set()  # configured upstreams, other hosts are labeled "custom"
+
+    def add_metric_host(self, hostPort):
+        """Label metrics of a configured upstream ("host" or "host:port") with
+        its host name. gpg.uri hosts of names are not added - they come from
+        the blockchain and would give an unbounded number of labels."""
+        self.metricHosts.add(urlsplit("//" + hostPort).hostname)
+
+    def metric_label(self, host):
+        return (host if host in self.metricHosts else "custom",)
+
+    @property
+    def sslContext(self):
+        """Created on first use - loading the CA certificates takes a while."""
+        with self._lock:
+            if self._sslContext is None:
+                import ssl
+                self._sslContext = ssl.create_default_context()
+            return self._sslContext
+
+    def get_tls_session(self, host, port):
+        return self._tlsSessions.get((host, port))
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.maxPerHost)
+            return self._slots[key]
+
+    def _acquire(self, key, timeout):
+        """Return (connection, reused)."""
+        now = time.time()
+        conn = None
+        stale = []
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle and now - idle[0][0] >= self.idleSeconds:
+                stale.append(idle.pop(0)[1])
+            if idle:
+                conn = idle.pop()[1]
+        for c in stale:
+            c.close()
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        return self._connect(key, timeout), False
+
+    def _connect(self, key, timeout):
+        scheme, host, port = key
+        if scheme == "https":
+            return define_pooled_https_connection()(host, port, self, timeout)
+        return httplib.HTTPConnection(host, port, timeout=timeout)
+
+    def _release(self, key, conn, response):
+        if response.will_close or not response.isclosed():
+            conn.close()
+            return
+        session = getattr(conn.sock, "session", None)  # Python 3.6+
+        with self._lock:
+            if session is not None:
+                self._tlsSessions[key[1:]] = session
+            self._idle.setdefault(key, []).append((time.time(), conn))
+
+    def _send(self, conn, path):
+        conn.request("GET", path, headers={"User-Agent": "npkh"})
+        return conn.getresponse()
+
+    @contextlib.contextmanager
+    def open(self, url, timeout=UPSTREAMTIMEOUT):
+        """GET url following redirects. Yields the response; its connection is
+        reused if the body was read completely. Raises UpstreamError for error
+        status codes and UpstreamBusyError if no connection to the server became
+        free within timeout."""
+        endTime = time.time() + timeout
+        for i in range(self.maxRedirects + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ("http", "https"):
+                raise ValueError("Unsupported url scheme: " + url)
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            slot = self._slot(key)
+            if not acquire_timeout(slot, max(0, endTime - time.time())):
+                metrics.upstreamErrors.inc(self.metric_label(key[1]))
+                raise UpstreamBusyError(url)
+            try:
+                conn, reused = self._acquire(key, timeout)
+                start = time.time()
+                try:
+                    try:
+                        response = self._send(conn, path)
+                    except (socket.error, httplib.HTTPException):
+                        conn.close()
+                        if not reused:
+                            raise
+                        # keep-alive connection was closed by the server meanwhile
+                        conn = self._connect(key, timeout)
+                        response = self._send(conn, path)
+                except:
+                    metrics.upstreamErrors.inc(self.metric_label(key[1]))
+                    raise
+                metrics.upstreamSeconds.observe(self.metric_label(key[1]), time.time() - start)
+                error = None
+                try:
+                    if response.status in self.redirectStatus and response.getheader("Location"):
+                        response.read()
+                        location = response.getheader("Location")
+                    elif response.status >= 400:
+                        response.read()
+                        error = UpstreamError(response.status, response.reason, url)
+                    else:
+                        location = None
+                        yield response
+                except:
+                    conn.close()
+                    raise
+                self._release(key, conn, response)
+            finally:
+                slot.release()
+            if error is not None:
+                raise error
+            if location is None:
+                return
+            url = urljoin(url, location)
+        raise UpstreamError(310, "Too many redirects", url)
+
+    def read(self, url, timeout=UPSTREAMTIMEOUT, cancelled=None, maxBytes=MAXKEYBYTES):
+        """Return the body of url, stop early once the cancelled event is set.
+        Raises ResponseTooLargeError for bodies larger than maxBytes."""
+        chunks = []
+        size = 0
+        with self.open(url, timeout) as response:
+            check_length(response, maxBytes)
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    raise KeyFetchError("cancelled")
+                data = response.read(65536)
+                if not data:
+                    break
+                size += len(data)
+                if maxBytes and size > maxBytes:
+                    raise ResponseTooLargeError("More than %s bytes: %s" % (maxBytes, url))
+                chunks.append(data)
+        return b"".join(chunks)
+
+def check_length(response, maxBytes):
+    """Refuse a response early if it announces more than maxBytes."""
+    try:
+        length = int(response.getheader("Content-Length") or 0)
+    except ValueError:
+        return
+    if maxBytes and length > maxBytes:
+        raise ResponseTooLargeError("Content-Length %s > %s" % (length, maxBytes))
+
+upstream = HttpPool()
+
+class KeyFetchError(Exception):
+    """No source delivered a valid key in time."""
+    pass
+
+def fetch_verified_key(url, fpr, timeout=KEYFETCHSECONDS, cancelled=None):
+    k = upstream.read(url, timeout, cancelled)
+    validate_fingerprint(fpr, k)
+    return k
+
+def fetch_first_valid_key(urls, fpr, deadline=KEYFETCHSECONDS, hedgeSeconds=KEYFETCHHEDGESECONDS):
+    """Fetch the key for fpr from urls in order of preference. The next source is
+    started when the previous ones have not answered within hedgeSeconds or
+    failed. Returns (key, url) of the first download passing validate_fingerprint,
+    the others are cancelled. Raises KeyFetchError after deadline seconds."""
+    results = queue.Queue()
+    cancelled = threading.Event()
+    endTime = time.time() + deadline
+    pending = list(urls)
+    errors = []
+
+    timer = getattr(requestContext, "timer", None)
+
+    def fetch(url):
+        # a timer of its own - merged into the lookup's only once the worker is done,
+        # hedged losers may still be running after the lookup has returned
+        requestContext.timer = workerTimer = RequestTimer() if timer is not None else None
+        try:
+            k = fetch_verified_key(url, fpr, max(0.1, endTime - time.time()), cancelled)
+            results.put((url, k, None, workerTimer))
+        except Exception as e:
+            results.put((url, None, e, workerTimer))
+
+    def start_next():
+        url = pending.pop(0)
+        log.debug("fetch_first_valid_key: trying", url)
+        t = threading.Thread(target=fetch, args=(url,))
+        t.daemon = True
+        t.start()
+
+    running = 0
+    try:
+        while pending or running:
+            if pending and (running == 0 or hedgeSeconds <= 0):
+                start_next()
+                running += 1
+                continue
+            remaining = endTime - time.time()
+            if remaining <= 0:
+                errors.append("deadline of %s s exceeded" % deadline)
+                break
+            try:
+                url, k, e, workerTimer = results.get(timeout=min(remaining, hedgeSeconds) if pending else remaining)
+            except queue.Empty:
+                if pending:
+                    start_next()  # hedge: previous sources are slow
+                    running += 1
+                continue
+            running -= 1
+            if timer is not None:
+                timer.merge(workerTimer)
+            if e is None:
+                return k, url
+            log.debug("fetch_first_valid_key: failed:", url, repr(e))
+            errors.append(url + ": " + repr(e))
+    finally:
+        cancelled.set()
+    raise KeyFetchError("; ".join(errors))
+
+class KeyStore(object):
+    """On-disk store fingerprint -> validated key with fetch metadata (sqlite).
+    A fingerprint binds the primary key, so stored keys are served without
+    revalidation beyond a checksum. Keys older than refreshHours are refetched
+    in the background from the sources the name points to now, a key whose
+    source is not among them any more is dropped. Least recently used keys are
+    evicted beyond maxBytes."""
+    def __init__(self, filename, maxBytes=KEYSTOREMAXBYTES, refreshHours=KEYREFRESHHOURS):
+        self.filename = filename
+        self.maxBytes = maxBytes
+        self.refreshSeconds = refreshHours * 3600
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if filename != ":memory:" and not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        global sqlite3
+        import sqlite3
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS keys (fpr TEXT PRIMARY KEY, key BLOB, "
+                         "sha256 TEXT, size INTEGER, source TEXT, fetched REAL, used REAL)")
+        self._db.commit()
+
+    def get(self, fpr, sources):
+        """Return the stored key or None. sources are the current key urls of
+        the name, in order of preference. Schedules a refresh if it is old."""
+        fpr = fpr.lower()
+        with self._lock:
+            row = self._db.execute("SELECT key, sha256, source, fetched, used FROM keys WHERE fpr=?",
+                                   (fpr,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            k = bytes(row[0])
+            if hashlib.sha256(k).hexdigest() != row[1]:
+                log.info("KeyStore: checksum mismatch, dropping key", fpr)
+                self._db.execute("DELETE FROM keys WHERE fpr=?", (fpr,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            if row[2] not in sources:
+                log.debug("KeyStore: source changed, dropping key", fpr)
+                self._db.execute("DELETE FROM keys WHERE fpr=?", (fpr,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            self.hits += 1
+            if time.time() - row[4] > 60:  # LRU order does not need to be exact, spare the disk writes
+                self._db.execute("UPDATE keys SET used=? WHERE fpr=?", (time.time(), fpr))
+                self._db.commit()
+        if time.time() - row[3] > self.refreshSeconds:
+            self.schedule_refresh(fpr, sources)
+        return k
+
+    def put(self, fpr, k, source):
+        fpr = fpr.lower()
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (fpr, sqlite3.Binary(k), hashlib.sha256(k).hexdigest(), len(k),
+                              source, now, now))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM keys").fetchone()[0]
+        if total <= self.maxBytes:
+            return
+        for fpr, size in self._db.execute("SELECT fpr, size FROM keys ORDER BY used").fetchall():
+            self._db.execute("DELETE FROM keys WHERE fpr=?", (fpr,))
+            log.debug("KeyStore: evicted", fpr, size)
+            self.evictions += 1
+            total -= size
+            if total <= self.maxBytes:
+                break
+
+    def schedule_refresh(self, fpr, sources):
+        with self._lock:
+            if fpr in self._refreshing:
+                return
+            self._refreshing.add(fpr)
+        t = threading.Thread(target=self._refresh, args=(fpr, list(sources)))
+        t.daemon = True
+        t.start()
+
+    def _refresh(self, fpr, sources):
+        try:
+            k, source = fetch_first_valid_key(sources, fpr)
+            self.put(fpr, k, source)
+            log.debug("KeyStore: refreshed", fpr)
+        except Exception as e:
+            log.debug("KeyStore: refresh failed:", fpr, repr(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(fpr)
+
+keyStore = None
+_keyStoreLock = threading.Lock()
+
+def get_key_store():
+    """Return the process wide KeyStore or None if disabled."""
+    global keyStore
+    if not KEYSTOREFILE:
+        return None
+    with _keyStoreLock:
+        if keyStore is None:
+            keyStore = KeyStore(platformDep.getNmcontrolDir() + "/" + KEYSTOREFILE)
+    return keyStore
+
 class BaseIdRequest(object):
     def __init__(self, name, standardKeyServer):
-        if not reg.match(name):
+        with span("validate"):
+            valid = reg.match(name)
+        if not valid:
             bottle.abort(400, "Wrong id/ format.")
         self.name = name
         self.standardKeyServer = standardKeyServer
@@ -143,32 +1082,28 @@ class BaseIdRequest(object):
     def __init2__(self):
         pass
 
+    @classmethod
+    def prefetch(cls, names, memo):
+        """Load the data of several names at once into memo (name -> data), e.g.
+        for batch lookups. Lookups of a thread with requestContext.prefetched
+        set to memo use it."""
+        pass
+
     def get_fpr(self):
         return self.fpr
 
     def _extract_fpr(self):
-        # extract fpr
         try:
-            fpr = self.value["gpg"]["fpr"]
-        except KeyError:
-            try:
-                fpr = self.value["fpr"]  # untidy?
-            except KeyError:
-                bottle.abort(415, "No fingerprint found in " + str(self.name))
-        fpr = fpr.lower()
-
-        # check fpr
-        try:
-            int(fpr, base=16)
-        except ValueError:
-            bottle.abort(415, "Bad fingerprint.")
-        if len(fpr) < 40:  # 40: sha1
-            bottle.abort(415, "Insecure fingerprint.")
-        return fpr
+            return extract_fpr(self.value)
+        except NoFprError:
+            bottle.abort(415, "No fingerprint found in " + str(self.name))
+        except ValueError as e:
+            bottle.abort(415, str(e))
 
     def get_value(self, name):  # is overwritten for standalone mode in class StandaloneIdRequest
         try:
-            value = common.app['plugins']['data'].getValueProcessed(name)
+            with span("rpc"):
+                value = common.app['plugins']['data'].getValueProcessed(name)
         except Exception as e:  # todo: proper error handling in NMControl
             bottle.abort(502, "Backend error (NMControl internal): " + repr(e))
         if value == False:
@@ -184,7 +1119,10 @@ class BaseIdRequest(object):
         #"pub:<keyid>:<algo>:<keylen>:<creationdate>:<expirationdate>:<flags>"
 
         age = self.get_time()
+        with span("format"):
+            return self._format_index(age)
 
+    def _format_index(self, age):
         s = "info:1:1\n"
         s += "pub:" + self.fpr + ":::" + str(age) + "::\n"
 
@@ -204,52 +1142,440 @@ class BaseIdRequest(object):
         return s
 
     def get_key(self):
+        urls = []
         try:
-            url = self.value["gpg"]["uri"]
-            log.debug("get_key: trying custom key url:", url)
-            with urlopen(url) as response:
-                k = response.read()
-        except:
-            url = ("https://" + self.standardKeyServer +
-                   "/pks/lookup?op=get&options=mr&search=0x" + self.fpr)
-            log.debug("get_key: trying keyserver url:", url)
-            with urlopen(url) as response:
-                k = response.read()
-        validate_fingerprint(self.fpr, k)
-        log.debug("get_key: ok, len: " + str(len(k)))
+            urls.append(self.value["gpg"]["uri"])  # custom key url first
+        except (KeyError, TypeError):
+            pass
+        urls.append(KEYSERVERSCHEME + "://" + self.standardKeyServer +
+                    "/pks/lookup?op=get&options=mr&search=0x" + self.fpr)
+        store = get_key_store()
+        if store is not None:
+            with span("keystore"):
+                k = store.get(self.fpr, urls)
+            if k is not None:
+                log.debug("get_key: from key store, len:", len(k))
+                return k
+        try:
+            with span("keyfetch"):
+                k, url = fetch_first_valid_key(urls, self.fpr)
+        except KeyFetchError as e:
+            bottle.abort(502, "Key download failed: " + str(e))
+        log.debug("get_key: ok, len:", len(k), "from:", url)
+        if store is not None:
+            store.put(self.fpr, k, url)
         return k
 
+class BlockTimeCache(object):
+    """LRU cache height -> (block hash, mediantime) for blocks deep enough below
+    the chain tip to be safe from reorgs - their headers never change. Optionally
+    persisted to a json file."""
+    def __init__(self, maxLen=BLOCKTIMECACHESIZE, filename=None,
+                 saveSeconds=BLOCKTIMECACHESAVESECONDS):
+        self.maxLen = maxLen
+        self.filename = filename
+        self.saveSeconds = saveSeconds
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._lastSave = 0
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load()
+
+    def get(self, height):
+        with self._lock:
+            entry = self._cache.pop(height, None)
+            if entry is not None:
+                self._cache[height] = entry  # most recently used last
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def put(self, height, blockHash, mediantime):
+        with self._lock:
+            self._cache.pop(height, None)
+            self._cache[height] = (blockHash, mediantime)
+            while len(self._cache) > self.maxLen:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+        if self.filename and time.time() - self._lastSave > self.saveSeconds:
+            self.save()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def load(self):
+        if not self.filename or not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+        except (IOError, ValueError) as e:
+            log.debug("BlockTimeCache: could not load", self.filename, repr(e))
+            return
+        with self._lock:
+            for height, blockHash, mediantime in entries[-self.maxLen:]:
+                self._cache[height] = (blockHash, mediantime)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[h, e[0], e[1]] for h, e in self._cache.items()]
+            self._dirty = False
+            self._lastSave = time.time()
+        tmpFilename = self.filename + ".tmp"
+        try:
+            if not os.path.isdir(os.path.dirname(self.filename)):
+                os.makedirs(os.path.dirname(self.filename))
+            with open(tmpFilename, "w") as f:
+                json.dump(entries, f)
+            try:
+                os.replace(tmpFilename, self.filename)  # Python 3.3+
+            except AttributeError:
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(tmpFilename, self.filename)
+        except (IOError, OSError) as e:
+            log.debug("BlockTimeCache: could not save", self.filename, repr(e))
+
+blockTimeCache = None
+_blockTimeCacheLock = threading.Lock()
+
+def get_block_time_cache():
+    global blockTimeCache
+    with _blockTimeCacheLock:
+        if blockTimeCache is None:
+            filename = None
+            if BLOCKTIMECACHEFILE:
+                filename = platformDep.getNmcontrolDir() + "/" + BLOCKTIMECACHEFILE
+            blockTimeCache = BlockTimeCache(filename=filename)
+            if filename:
+                atexit.register(blockTimeCache.save)
+    return blockTimeCache
+
+class ChainTipWatcher(threading.Thread):
+    """Follows the best block of the client by polling getbestblockhash every
+    pollSeconds. A zmq 'hashblock' publisher (client option zmqpubhashblock) or
+    a call to notify() wakes it up immediately. Listeners are called with
+    (oldTip, newTip), tips being (blockHash, height) tuples."""
+    def __init__(self, getRpc, pollSeconds=TIPPOLLSECONDS, zmqAddress=ZMQHASHBLOCK):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.getRpc = getRpc
+        self.pollSeconds = pollSeconds
+        self.zmqAddress = zmqAddress
+        self.tip = None
+        self.lastCheck = 0  # start time of the last successful check
+        self.pushActive = False  # zmq notifications are being received
+        self.listeners = []
+        self._checkLock = threading.Lock()
+        self._wakeEvent = threading.Event()
+        self._stopEvent = threading.Event()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def is_current(self):
+        """False if the tip could not be checked recently (e.g. client down)."""
+        return self.tip is not None and time.time() - self.lastCheck < 2 * self.pollSeconds + 1
+
+    def notify(self, blockHash=None):
+        self._wakeEvent.set()
+
+    def check(self):
+        with self._checkLock:
+            self._check()
+
+    def check_now(self, maxAge=0):
+        """Make sure the tip was checked at most maxAge seconds before this
+        call began. Concurrent callers share a check."""
+        requested = time.time() - maxAge
+        if self.lastCheck >= requested:
+            return
+        with self._checkLock:
+            if self.lastCheck < requested:
+                self._check()
+
+    def _check(self):
+        started = time.time()
+        rpc = self.getRpc()
+        blockHash = rpc.call("getbestblockhash")
+        if self.tip is None or blockHash != self.tip[0]:
+            height = rpc.call("getblockheader", [blockHash])["height"]
+            oldTip = self.tip
+            self.tip = (blockHash, height)
+            log.debug("ChainTipWatcher: new tip", height, blockHash)
+            for listener in self.listeners:
+                listener(oldTip, self.tip)
+        self.lastCheck = started
+
+    def run(self):
+        if self.zmqAddress:
+            try:
+                global zmq
+                import zmq  # optional, for block push notifications
+            except ImportError:
+                log.info("ChainTipWatcher: pyzmq not installed, polling only")
+            else:
+                t = threading.Thread(target=self._run_zmq)
+                t.daemon = True
+                t.start()
+                self.pushActive = True
+        while not self._stopEvent.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                log.debug("ChainTipWatcher: check failed:", repr(e))
+            self._wakeEvent.wait(self.pollSeconds)
+            self._wakeEvent.clear()
+
+    def _run_zmq(self):
+        socket = zmq.Context.instance().socket(zmq.SUB)
+        socket.setsockopt(zmq.SUBSCRIBE, b"hashblock")
+        socket.connect(self.zmqAddress)
+        while not self._stopEvent.is_set():
+            if socket.poll(1000):
+                socket.recv_multipart()
+                self.notify()
+        socket.close()
+
+    def stop(self):
+        self._stopEvent.set()
+        self._wakeEvent.set()
+
+def get_block_name_ops(rpc, blockHash):
+    """Return (block, [nameOp, ...]) for the name operations in a block."""
+    block = rpc.call("getblock", [blockHash, 2])
+    nameOps = []
+    for tx in block["tx"]:
+        for vout in tx.get("vout", []):
+            nameOp = vout.get("scriptPubKey", {}).get("nameOp")
+            if nameOp and "name" in nameOp:
+                nameOps.append(nameOp)
+    return block, nameOps
+
+class NameCache(object):
+    """name -> name_show data, valid until a later block touches the name. On a
+    new tip only names with operations in the new block(s) and names that
+    expired are dropped. A reorg or a jump of more than maxWalk blocks drops
+    everything. Nothing is served while the tip watcher is not current.
+    Without push notifications a hit rechecks the tip with getbestblockhash
+    (shared by concurrent lookups) if it was last checked more than checkTip
+    seconds ago, so a value is at most that old after a new block. With
+    checkTip None it can be up to the poll interval old."""
+    def __init__(self, watcher, maxLen=NAMECACHESIZE, maxWalk=NAMECACHEMAXWALK, checkTip=NAMECACHECHECKTIP):
+        self.watcher = watcher
+        self.maxLen = maxLen
+        self.maxWalk = maxWalk
+        self.checkTip = checkTip
+        self.tip = None
+        self.generation = 0  # changes with every tip - results fetched before are not stored
+        self._cache = OrderedDict()  # name -> (data, tip height when fetched)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        watcher.add_listener(self.on_new_tip)
+
+    def get(self, name, checkTip=True):
+        if checkTip and self.checkTip is not None and not self.watcher.pushActive and name in self._cache:
+            try:
+                self.watcher.check_now(self.checkTip)  # a new block may have changed the name
+            except Exception as e:
+                log.debug("NameCache: tip check failed:", repr(e))
+                with self._lock:
+                    self.misses += 1
+                return None
+        with self._lock:
+            if self.tip is None or not self.watcher.is_current():
+                self.misses += 1
+                return None
+            entry = self._cache.pop(name, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._cache[name] = entry  # most recently used last
+            self.hits += 1
+        return entry[0]
+
+    def put(self, name, data, generation):
+        with self._lock:
+            if self.tip is None or generation != self.generation:
+                return
+            self._cache.pop(name, None)
+            self._cache[name] = (data, self.tip[1])
+            while len(self._cache) > self.maxLen:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._cache)
+
+    def on_new_tip(self, oldTip, newTip):
+        with self._lock:
+            self.tip = None
+            self.generation += 1
+        try:
+            touched = self.get_touched_names(oldTip, newTip)
+        except Exception as e:
+            log.debug("NameCache: could not inspect new blocks:", repr(e))
+            touched = None
+        with self._lock:
+            if touched is None:
+                self._cache.clear()
+            else:
+                for name in touched:
+                    self._cache.pop(name, None)
+                for name, (data, height) in list(self._cache.items()):
+                    if "expires_in" in data and data["expires_in"] - (newTip[1] - height) <= 0:
+                        del self._cache[name]
+            self.generation += 1
+            self.tip = newTip
+        log.debug("NameCache: new tip", newTip[1], "dropped:",
+                  "all" if touched is None else len(touched), "size:", len(self._cache))
+
+    def get_touched_names(self, oldTip, newTip):
+        """Names with operations between oldTip and newTip, None if unknown."""
+        if oldTip is None or not self._cache:
+            return None
+        if newTip[1] <= oldTip[1] or newTip[1] - oldTip[1] > self.maxWalk:
+            return None
+        rpc = self.watcher.getRpc()
+        names = set()
+        blockHash = newTip[0]
+        for i in range(newTip[1] - oldTip[1]):
+            block, nameOps = get_block_name_ops(rpc, blockHash)
+            for nameOp in nameOps:
+                names.add(nameOp["name"])
+            blockHash = block.get("previousblockhash")
+        if blockHash != oldTip[0]:
+            return None  # reorg
+        return names
+
+chainTipWatcher = None
+nameCache = None
+_chainCachesLock = threading.Lock()
+
+def get_chain_tip_watcher():
+    """Return the process wide, running ChainTipWatcher."""
+    global chainTipWatcher
+    with _chainCachesLock:
+        if chainTipWatcher is None:
+            import namerpc
+            chainTipWatcher = ChainTipWatcher(namerpc.get_shared_rpc)
+            chainTipWatcher.start()
+    return chainTipWatcher
+
+def get_name_cache():
+    """Return the process wide NameCache or None if disabled."""
+    global nameCache
+    if not NAMECACHE:
+        return None
+    watcher = get_chain_tip_watcher()
+    with _chainCachesLock:
+        if nameCache is None:
+            nameCache = NameCache(watcher)
+    return nameCache
+
 class StandaloneIdRequest(BaseIdRequest):
+    rpcCallsTotal = 0  # backend calls of all requests, for instrumentation
+    _rpcCallsTotalLock = threading.Lock()
+
     def __init2__(self):
         log.debug("StandaloneIdRequest: init2")
-        self.rpcConnectionType = None
         global namerpc
         import namerpc
+        # request scoped memo: identical (method, params) calls are sent only once per lookup
+        self.rpcMemo = {}
+        self.rpcCalls = []  # (method, params) actually sent to the backend
+        self.rpcMemoHits = 0
 
     def get_rpc(self):
-        if not self.rpcConnectionType:
-            log.debug("get_rpc: init rpc")
-            tmpRpc = namerpc.CoinRpc(connectionType="auto")
-            self.rpcConnectionType = tmpRpc.connectionType
-            self.rpcOptions = tmpRpc.options
-        return namerpc.CoinRpc(connectionType=self.rpcConnectionType,
-                              options=self.rpcOptions)
+        # connection detection and credentials are shared by all requests of the process
+        return namerpc.get_shared_rpc()
+
+    @classmethod
+    def prefetch(cls, names, memo):
+        """name_show of names not in the name cache with one batch round trip,
+        into memo (not found errors included) and the name cache. The cache
+        drops results while a new tip is processed, memo keeps them for the
+        lookups of the batch."""
+        cache = get_name_cache()
+        names = [name for name in set(names) if reg.match(name) and name not in memo and
+                 (cache is None or cache.get(name, checkTip=False) is None)]
+        if not names:
+            return
+        import namerpc
+        generation = cache.generation if cache is not None else None
+        log.debug("StandaloneIdRequest: prefetch", len(names))
+        with cls._rpcCallsTotalLock:
+            StandaloneIdRequest.rpcCallsTotal += len(names)
+        with span("rpc"):
+            results = namerpc.get_shared_rpc().call_batch([("name_show", [name]) for name in names],
+                                                          raiseErrors=False)
+        for name, data in zip(names, results):
+            if not isinstance(data, Exception):
+                memo[name] = data
+                if cache is not None:
+                    cache.put(name, data, generation)
+            elif isinstance(data, (namerpc.NameDoesNotExistError, namerpc.WalletError)):
+                memo[name] = data  # the lookup answers 404 without asking again
 
     def rpc(self, method, args=[]):
+        key = (method, json.dumps(args, sort_keys=True))
+        if key in self.rpcMemo:
+            self.rpcMemoHits += 1
+            return self.rpcMemo[key]
         rpc = self.get_rpc()
-        log.debug("StandaloneIdRequest:rpc: ", repr(method), repr(args))
-        return rpc.call(method, args)
+        log.debug("StandaloneIdRequest:rpc:", method, args)
+        self.rpcCalls.append((method, args))
+        with self._rpcCallsTotalLock:
+            StandaloneIdRequest.rpcCallsTotal += 1
+        with span("rpc"):
+            result = rpc.call(method, args)
+        self.rpcMemo[key] = result
+        return result
+
+    def name_show(self):
+        key = ("name_show", json.dumps([self.name], sort_keys=True))  # the key rpc() memoizes under
+        if key in self.rpcMemo:
+            self.rpcMemoHits += 1
+            return self.rpcMemo[key]
+        prefetched = getattr(requestContext, "prefetched", None)
+        if prefetched is not None and self.name in prefetched:
+            data = prefetched.pop(self.name)  # a duplicate search asks the cache or the client again
+            if isinstance(data, Exception):
+                raise data
+            self.rpcMemo[key] = data
+            return data
+        cache = get_name_cache()
+        if cache is not None:
+            data = cache.get(self.name)
+            if data is not None:
+                self.rpcMemo[key] = data  # one cache lookup and tip check per request
+                return data
+            generation = cache.generation
+        data = self.rpc("name_show", [self.name])
+        if cache is not None:
+            cache.put(self.name, data, generation)
+        return data
 
     def get_data(self):
         try:
-            data = self.rpc("name_show", [self.name])
-        except namerpc.NameDoesNotExistError:
+            data = self.name_show()
+        except (namerpc.NameDoesNotExistError, namerpc.WalletError):  # WalletError: name_show of an unknown name
             bottle.abort(404, "Name not found: " + str(self.name))
-        except namerpc.RpcError:
+        except (namerpc.RpcError, namerpc.ClientError):
             bottle.abort(502, "Backend error (rpc).")
 
         try:
-            data = json.loads(data)
+            with span("decode"):
+                data = json.loads(data)
         except TypeError:
             pass
         if data["expired"] != False:
@@ -262,7 +1588,8 @@ class StandaloneIdRequest(BaseIdRequest):
         value = data["value"]
 
         try:
-            value = json.loads(value)
+            with span("decode"):
+                value = json.loads(value)
         except TypeError:
             pass
         except ValueError:  # generic error from json decode
@@ -274,27 +1601,584 @@ class StandaloneIdRequest(BaseIdRequest):
     def get_time(self):
         try:
             data = self.get_data()
-            height = data["height"]
-            blockHash = self.rpc("getblockhash", [height])
-            nameTime = self.rpc("getblockheader", [blockHash])["mediantime"]
+            nameTime = self.get_block_time(data["height"])
             log.debug("get_time:nameTime", nameTime)
         except Exception as e:
-            log.debug("get_time: Exception: " + repr(e))
+            log.debug("get_time: Exception:", repr(e))
             nameTime = 468374400  # 1984-11-04
         return nameTime
 
+    def get_block_time(self, height):
+        cache = get_block_time_cache()
+        entry = cache.get(height)
+        if entry is not None:
+            return entry[1]
+        blockHash = self.rpc("getblockhash", [height])
+        header = self.rpc("getblockheader", [blockHash])
+        if header.get("confirmations", 0) > REORGSAFETYDEPTH:
+            cache.put(height, blockHash, header["mediantime"])
+        return header["mediantime"]
+
 class IdRequest(BaseIdRequest):
     pass
 
+class FprIndex(object):
+    """Bidirectional index fingerprint <-> name with O(1) insert, remove by name
+    and lookup by fingerprint. Entries expire after their time to live, least
+    recently updated entries are evicted beyond maxLen. Optionally persisted to
+    a json file so the index survives restarts. Fingerprints are stored
+    lowercase with "0x" prefix."""
+    def __init__(self, maxLen=MAXCACHESIZE, ttlSeconds=60 * CACHETIMETOLIVEMINUTES,
+                 filename=None, saveSeconds=FPRINDEXSAVESECONDS, readOnly=False):
+        self.maxLen = maxLen
+        self.ttlSeconds = ttlSeconds
+        self.filename = filename
+        self.readOnly = readOnly  # load the file but never write it
+        self.saveSeconds = saveSeconds
+        self._fprs = OrderedDict()  # fpr -> (name, expiry time)
+        self._names = {}  # name -> fpr
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lastSave = 0
+        self._dirty = False
+        self.load()
+
+    def put(self, name, fpr, ttlSeconds=None):
+        """Set the fingerprint of a name, replacing a previous one (e.g. revoked key)."""
+        if ttlSeconds is None:
+            ttlSeconds = self.ttlSeconds
+        with self._lock:
+            self._set(name, fpr, time.time() + ttlSeconds)
+            while len(self._fprs) > self.maxLen:
+                oldFpr, (oldName, expiry) = self._fprs.popitem(last=False)
+                if self._names.get(oldName) == oldFpr:
+                    del self._names[oldName]
+                self.evictions += 1
+            self._dirty = True
+        if self.filename and not self.readOnly and time.time() - self._lastSave > self.saveSeconds:
+            self.save()
+
+    def get_name(self, fpr):
+        """Return the name for a fingerprint or None."""
+        with self._lock:
+            entry = self._fprs.get(fpr)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] < time.time():
+                self._remove_name(entry[0])
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def get_fpr(self, name):
+        with self._lock:
+            fpr = self._names.get(name)
+        if fpr is not None and self.get_name(fpr) == name:
+            return fpr
+        return None
+
+    def remove_name(self, name):
+        with self._lock:
+            self._remove_name(name)
+
+    def _set(self, name, fpr, expiry):
+        """A fingerprint belongs to one name - a previous owner loses it."""
+        self._remove_name(name)
+        previous = self._fprs.pop(fpr, None)
+        if previous is not None and self._names.get(previous[0]) == fpr:
+            del self._names[previous[0]]
+        self._fprs[fpr] = (name, expiry)
+        self._names[name] = fpr
+
+    def _remove_name(self, name):
+        fpr = self._names.pop(name, None)
+        if fpr is not None:
+            entry = self._fprs.get(fpr)
+            if entry is not None and entry[0] == name:  # not handed to another name since
+                del self._fprs[fpr]
+            self._dirty = True
+
+    def __contains__(self, fpr):
+        return self.get_name(fpr) is not None
+
+    def __len__(self):
+        return len(self._fprs)
+
+    def load(self):
+        """Returns True if the file was read."""
+        if not self.filename or not os.path.isfile(self.filename):
+            return False
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+            now = time.time()
+            with self._lock:
+                for fpr, name, expiry in entries[-self.maxLen:]:
+                    if expiry > now:
+                        self._set(name, fpr, expiry)
+                self._dirty = False
+        except (IOError, ValueError, TypeError) as e:
+            log.debug("FprIndex: could not load", self.filename, repr(e))
+            return False
+        return True
+
+    def save(self):
+        if self.readOnly:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = self._entries()
+            self._dirty = False
+            self._lastSave = time.time()
+        tmpFilename = None
+        try:
+            if not os.path.isdir(os.path.dirname(self.filename)):
+                os.makedirs(os.path.dirname(self.filename))
+            # a temporary file of its own - other processes may be saving the index at the same time
+            fd, tmpFilename = tempfile.mkstemp(dir=os.path.dirname(self.filename),
+                                               prefix=os.path.basename(self.filename) + ".", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            try:
+                os.replace(tmpFilename, self.filename)  # Python 3.3+
+            except AttributeError:
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(tmpFilename, self.filename)
+        except (IOError, OSError) as e:
+            log.debug("FprIndex: could not save", self.filename, repr(e))
+            if tmpFilename and os.path.exists(tmpFilename):
+                os.remove(tmpFilename)
+
+    def _entries(self):
+        """[[fpr, name, expiry], ...] to save, load() puts them in this order."""
+        return [[fpr, e[0], e[1]] for fpr, e in self._fprs.items()]
+
+class NamespaceFprIndex(FprIndex):
+    """FprIndex for a whole namespace, where several names may hold the same
+    fingerprint. It maps to the name that took it last; the other names are
+    remembered and one of them takes over when that name drops it."""
+    def __init__(self, *args, **kwargs):
+        self._shadowed = {}  # fpr -> {name: expiry} of the names it does not map to
+        self._shadowedFprs = {}  # name -> fpr
+        FprIndex.__init__(self, *args, **kwargs)
+
+    def get_fpr(self, name):
+        fpr = FprIndex.get_fpr(self, name)
+        if fpr is None:
+            with self._lock:
+                fpr = self._shadowedFprs.get(name)
+                if fpr is not None and self._shadowed[fpr][name] < time.time():
+                    fpr = None
+        return fpr
+
+    def _set(self, name, fpr, expiry):
+        self._unshadow(name)
+        if self._names.get(name) == fpr:  # no change - the other names keep their place
+            self._fprs.pop(fpr)
+            self._fprs[fpr] = (name, expiry)
+            return
+        entry = self._fprs.get(fpr)
+        if entry is not None:
+            self._shadowed.setdefault(fpr, {})[entry[0]] = entry[1]
+            self._shadowedFprs[entry[0]] = fpr
+        FprIndex._set(self, name, fpr, expiry)
+
+    def _remove_name(self, name):
+        self._unshadow(name)
+        fpr = self._names.get(name)
+        FprIndex._remove_name(self, name)
+        if fpr is not None and fpr not in self._fprs:
+            self._take_over(fpr)
+
+    def _unshadow(self, name):
+        fpr = self._shadowedFprs.pop(name, None)
+        if fpr is not None:
+            del self._shadowed[fpr][name]
+            if not self._shadowed[fpr]:
+                del self._shadowed[fpr]
+            self._dirty = True
+
+    def _take_over(self, fpr):
+        """Map fpr to the remaining name with the latest expiry."""
+        names = self._shadowed.get(fpr, {})
+        now = time.time()
+        for name, expiry in sorted(names.items(), key=lambda item: item[1], reverse=True):
+            self._unshadow(name)
+            if expiry > now:
+                self._fprs[fpr] = (name, expiry)
+                self._names[name] = fpr
+                return
+
+    def _entries(self):
+        shadowed = [[fpr, name, expiry] for fpr, names in self._shadowed.items()
+                    for name, expiry in names.items()]
+        return shadowed + FprIndex._entries(self)  # loading the owner last shadows the others again
+
+class IdNamespaceIndex(threading.Thread):
+    """Fingerprint -> name index over the whole id/ namespace (standalone mode).
+    Resolves fingerprints that were never looked up by name before.
+
+    Built once by scanning all names with name_scan in large pages, then kept
+    current by applying the id/ name operations of each new block. Undo records
+    of the last reorgDepth blocks allow rolling back on a reorg. The checkpoint
+    (last applied block) is persisted with the index so restarts resume
+    incrementally instead of rescanning."""
+    def __init__(self, getRpc, pageSize=IDINDEXPAGESIZE, filename=None,
+                 reorgDepth=IDINDEXREORGDEPTH, maxCatchUp=IDINDEXMAXCATCHUP):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.getRpc = getRpc
+        self.pageSize = pageSize
+        self.filename = filename
+        self.reorgDepth = reorgDepth
+        self.maxCatchUp = maxCatchUp
+        self.index = self._new_index()
+        self.buildSeconds = None
+        self.builtAt = None
+        self.scanned = 0
+        self.building = False
+        self.height = None  # last applied block
+        self.blockHash = None
+        self.tipHeight = None
+        self.recent = []  # [[height, blockHash, undo], ...] - undo: [[name, previous fpr], ...]
+        self._syncEvent = threading.Event()
+        self._stopEvent = threading.Event()
+        if filename:
+            self.index.filename = filename
+            if self.index.load():
+                self.load_checkpoint()  # without the index it belongs to the first sync builds a new one
+
+    def _new_index(self):
+        index = NamespaceFprIndex(maxLen=IDINDEXMAXSIZE, ttlSeconds=NAMEEXPIRATIONDEPTH * BLOCKSECONDS)
+        index.saveSeconds = float("inf")  # saved together with the checkpoint
+        return index
+
+    def get_name(self, fpr):
+        return self.index.get_name(fpr)
+
+    def __len__(self):
+        return len(self.index)
+
+    def lag(self):
+        """Number of blocks the index is behind the chain tip, None if unknown."""
+        if self.height is None or self.tipHeight is None:
+            return None
+        return max(0, self.tipHeight - self.height)
+
+    def stats(self):
+        return {"size": len(self.index), "scanned": self.scanned,
+                "buildSeconds": self.buildSeconds, "builtAt": self.builtAt,
+                "building": self.building, "height": self.height, "lag": self.lag()}
+
+    def build(self):
+        """Scan the namespace and replace the index with the result."""
+        self.building = True
+        start = time.time()
+        try:
+            rpc = self.getRpc()
+            # blocks after this one are applied afterwards - replaying a name operation the scan already saw is harmless
+            height = rpc.call("getblockcount")
+            blockHash = rpc.call("getblockhash", [height])
+            index = self._new_index()
+            scanned = 0
+            fromName = "id/"
+            count = self.pageSize
+            while True:
+                names = rpc.call("name_scan", [fromName, count])
+                for n in names:
+                    if n["name"] == fromName and fromName != "id/":
+                        continue  # last name of the previous page
+                    if not n["name"].startswith("id/"):
+                        names = []  # past the namespace
+                        break
+                    scanned += 1
+                    self.add_name(index, n)
+                if len(names) < count:
+                    break
+                fromName = names[-1]["name"]
+                count = self.pageSize + 1  # pages start with the last name of the previous one
+            index.filename = self.filename
+            self.index = index
+            self.height, self.blockHash, self.recent = height, blockHash, []
+            self.scanned = scanned
+            self.buildSeconds = time.time() - start
+            self.builtAt = time.time()
+            self.save()
+            log.info("IdNamespaceIndex: built, names:", scanned, "fingerprints:", len(index),
+                     "seconds: %.1f" % self.buildSeconds)
+        finally:
+            self.building = False
+
+    @staticmethod
+    def add_name(index, n):
+        """Add a name_scan entry or a block's name operation to index if it has a
+        valid fingerprint, otherwise drop the name. Returns the previous fpr."""
+        name = n["name"]
+        previousFpr = index.get_fpr(name)
+        if n.get("expired"):
+            index.remove_name(name)
+            return previousFpr
+        try:
+            value = n["value"]
+            if not isinstance(value, dict):
+                value = json.loads(value)
+            fpr = extract_fpr(value)
+        except ValueError:
+            index.remove_name(name)
+            return previousFpr
+        ttlSeconds = None
+        if "expires_in" in n:
+            ttlSeconds = n["expires_in"] * BLOCKSECONDS  # lookups verify the name anyway
+        index.put(name, "0x" + fpr, ttlSeconds)
+        return previousFpr
+
+    def sync(self):
+        """Apply new blocks up to the chain tip, rolling back reorged blocks first."""
+        rpc = self.getRpc()
+        self.tipHeight = rpc.call("getblockcount")
+        if self.height is None or self.tipHeight - self.height > self.maxCatchUp:
+            self.build()
+            return
+        changed = False
+        while self.height > self.tipHeight or rpc.call("getblockhash", [self.height]) != self.blockHash:
+            if not self.recent:
+                log.info("IdNamespaceIndex: reorg deeper than recorded blocks, rebuilding")
+                self.build()
+                return
+            self.rollback()
+            changed = True
+        while self.height < self.tipHeight and not self._stopEvent.is_set():
+            blockHash = rpc.call("getblockhash", [self.height + 1])
+            block, nameOps = get_block_name_ops(rpc, blockHash)
+            if block.get("previousblockhash") != self.blockHash:
+                break  # reorg while syncing - handled by the next sync
+            undo = []
+            for nameOp in nameOps:
+                if nameOp["name"].startswith("id/") and "value" in nameOp:
+                    undo.append([nameOp["name"], self.add_name(self.index, nameOp)])
+            self.height, self.blockHash = self.height + 1, blockHash
+            self.recent.append([self.height, blockHash, undo])
+            del self.recent[:-self.reorgDepth]
+            changed = True
+        if changed:
+            self.save()
+            log.debug("IdNamespaceIndex: synced to", self.height, "lag:", self.lag())
+
+    def rollback(self):
+        """Undo the last applied block."""
+        height, blockHash, undo = self.recent.pop()
+        for name, previousFpr in reversed(undo):
+            if previousFpr is None:
+                self.index.remove_name(name)
+            else:
+                self.index.put(name, previousFpr)
+        if self.recent:
+            self.height, self.blockHash = self.recent[-1][0], self.recent[-1][1]
+        else:
+            self.height = height - 1
+            self.blockHash = self.getRpc().call("getblockheader", [blockHash])["previousblockhash"]
+        log.info("IdNamespaceIndex: rolled back block", height)
+
+    def checkpoint_filename(self):
+        return self.filename + ".checkpoint"
+
+    def load_checkpoint(self):
+        if not os.path.isfile(self.checkpoint_filename()):
+            return
+        try:
+            with open(self.checkpoint_filename()) as f:
+                checkpoint = json.load(f)
+            height, blockHash, recent = checkpoint["height"], checkpoint["hash"], checkpoint["recent"]
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            log.debug("IdNamespaceIndex: could not load checkpoint", repr(e))
+            return
+        self.height, self.blockHash, self.recent = height, blockHash, recent
+
+    def save(self):
+        """Persist the index and then the checkpoint it corresponds to."""
+        if not self.filename:
+            return
+        self.index.save()
+        checkpoint = {"height": self.height, "hash": self.blockHash, "recent": self.recent}
+        tmpFilename = self.checkpoint_filename() + ".tmp"
+        try:
+            with open(tmpFilename, "w") as f:
+                json.dump(checkpoint, f)
+            try:
+                os.replace(tmpFilename, self.checkpoint_filename())  # Python 3.3+
+            except AttributeError:
+                if os.path.exists(self.checkpoint_filename()):
+                    os.remove(self.checkpoint_filename())
+                os.rename(tmpFilename, self.checkpoint_filename())
+        except (IOError, OSError) as e:
+            log.debug("IdNamespaceIndex: could not save checkpoint", repr(e))
+
+    def on_new_tip(self, oldTip, newTip):
+        self.tipHeight = newTip[1]
+        self._syncEvent.set()
+
+    def run(self):
+        while not self._stopEvent.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                log.info("IdNamespaceIndex: sync failed:", repr(e))
+            self._syncEvent.wait(IDINDEXSYNCSECONDS)
+            self._syncEvent.clear()
+
+    def stop(self):
+        self._stopEvent.set()
+        self._syncEvent.set()
+
+def start_id_namespace_index():
+    """Load the persisted id/ namespace index and keep it in sync in the background."""
+    import namerpc
+    filename = None
+    if IDINDEXFILE:
+        filename = platformDep.getNmcontrolDir() + "/" + IDINDEXFILE
+    idIndex = IdNamespaceIndex(namerpc.get_shared_rpc, filename=filename)
+    get_chain_tip_watcher().add_listener(idIndex.on_new_tip)
+    idIndex.start()
+    return idIndex
+
+class ResponseCache(object):
+    """LRU cache for standard keyserver responses with a byte size budget. A body
+    of None records an upstream 404."""
+    def __init__(self, maxBytes=PROXYCACHEMAXBYTES, ttlSeconds=None,
+                 notFoundSeconds=PROXYCACHENOTFOUNDSECONDS):
+        self.maxBytes = maxBytes
+        self.ttlSeconds = ttlSeconds or {"index": PROXYCACHEINDEXSECONDS,
+                                         "get": PROXYCACHEGETSECONDS}
+        self.notFoundSeconds = notFoundSeconds
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache = OrderedDict()  # key -> (expires, body)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(search, op, options=()):
+        return (search.strip().lower(), op.lower(), tuple(sorted(options)))
+
+    def get(self, key):
+        """Return (True, body) for a hit, (False, None) otherwise."""
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self.size -= self._entry_size(entry)
+                self.misses += 1
+                return False, None
+            self._cache[key] = entry  # most recently used last
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, body):
+        if body is None:
+            ttl = self.notFoundSeconds
+        else:
+            ttl = self.ttlSeconds.get(key[1], 0)
+        entry = (time.time() + ttl, body)
+        if ttl <= 0 or self._entry_size(entry) > self.maxBytes:
+            return
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self.size -= self._entry_size(old)
+            self._cache[key] = entry
+            self.size += self._entry_size(entry)
+            while self.size > self.maxBytes:
+                self.size -= self._entry_size(self._cache.popitem(last=False)[1])
+                self.evictions += 1
+
+    @staticmethod
+    def _entry_size(entry):
+        return 100 + len(entry[1] or b"")  # rough overhead per entry
+
+    def __len__(self):
+        return len(self._cache)
+
+class SingleFlight(object):
+    """Runs concurrent calls with the same key only once - the other callers wait
+    and get the same result or a copy of the exception each."""
+    class Call(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise self.copy_error(call.error)
+            if isinstance(call.result, types.GeneratorType):
+                return fn(*args, **kwargs)  # a stream can be consumed only once
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:  # includes bottle.HTTPError from abort()
+            call.error = self.copy_error(e)  # not raised anywhere, so it stays unchanged
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    @staticmethod
+    def copy_error(e):
+        """An exception object of the caller's own: request handlers add headers
+        to an HTTPError and raising it sets its traceback."""
+        if isinstance(e, bottle.HTTPError):
+            error = e.copy(cls=type(e))
+            error.body, error.exception, error.traceback = e.body, e.exception, e.traceback
+            error.args = e.args
+            return error
+        try:
+            return copy.copy(e)
+        except Exception:  # constructor arguments that differ from e.args
+            return e
+
 class RequestHandler(object):
-    def __init__(self, standardKeyServer=DEFAULTKEYSERVER):
+    def __init__(self, standardKeyServer=DEFAULTKEYSERVER, idIndex=None):
         # cache for connecting fingerprints to names - all lowercase so we don't have to handle 0X instead of 0x
-        self.idFprs = ExpiringDict(max_len=MAXCACHESIZE, max_age_seconds=60*CACHETIMETOLIVEMINUTES)
+        filename = None
+        if FPRINDEXFILE:
+            filename = platformDep.getNmcontrolDir() + "/" + FPRINDEXFILE
+        self.idFprs = FprIndex(filename=filename, readOnly=not FPRINDEXSAVE)
+        if filename and FPRINDEXSAVE:
+            atexit.register(self.idFprs.save)
         self.standardKeyServer = standardKeyServer
+        upstream.add_metric_host(standardKeyServer)
+        self.idIndex = idIndex  # optional IdNamespaceIndex
+        self.responseCache = ResponseCache() if PROXYCACHE else None
+        self.inFlight = SingleFlight()  # coalesces concurrent identical lookups
         log.debug("New RequestHandler")
 
     def build_url(self, search, op):
-        url = "https://" + self.standardKeyServer + "/pks/lookup?search=" + search + "&op=" + op
+        url = KEYSERVERSCHEME + "://" + self.standardKeyServer + "/pks/lookup?search=" + search + "&op=" + op
         url += "&options=mr"  # text
         log.debug("build_url:", url)
         return url
@@ -303,28 +2187,108 @@ class RequestHandler(object):
         """Pass request through to default keyserver."""
         # currently this will break with NMControl as global system DNS because of
         # getaddrinfo not being thread safe
-        log.debug("proxying to " + self.standardKeyServer)
+        log.debug("proxying to", self.standardKeyServer)
         if request:
             url = request.urlparts._replace(  # _replace is a public function despite the underscore
-                        netloc=self.standardKeyServer, scheme="https").geturl()
+                        netloc=self.standardKeyServer, scheme=KEYSERVERSCHEME).geturl()
             log.debug("modified request:", url)
+            options = [(k, v) for k, v in request.query.allitems() if k not in ("search", "op")]
         else:
             url = self.build_url(search, op)
-        with urlopen(url) as response:
-            s = response.read()
+            options = [("options", "mr")]
+
+        cacheKey = ResponseCache.make_key(search, op, options)
+        if self.responseCache is not None:
+            hit, s = self.responseCache.get(cacheKey)
+            if hit:
+                log.debug("proxying: cache hit")
+                if s is None:
+                    bottle.abort(404, "No keys found.")
+                return s
+
+        spool = None
+        try:
+            with span("upstream"):
+                with upstream.open(url) as response:
+                    check_length(response, MAXKEYBYTES)
+                    s = response.read(STREAMTHRESHOLDBYTES + 1)
+                    if len(s) > STREAMTHRESHOLDBYTES:
+                        # large response: keep it in a file and let the upstream connection go
+                        log.debug("proxying: spooling")
+                        spool = self.spool_response(response, s)
+        except UpstreamBusyError:
+            bottle.abort(503, "Keyserver busy, try again later.")
+        except UpstreamError as e:
+            if e.status == 404:
+                if self.responseCache is not None:
+                    self.responseCache.put(cacheKey, None)
+                bottle.abort(404, "No keys found.")
+            bottle.abort(502, "Keyserver error: " + str(e.status))
+        except ResponseTooLargeError:
+            bottle.abort(502, "Keyserver response too large.")
+        except (socket.error, httplib.HTTPException) as e:
+            bottle.abort(502, "Keyserver not reachable: " + repr(e))
+        if spool is not None:
+            if op.lower() == "get":
+                try:
+                    validate_fingerprint(search, spool.read())  # the whole key, armor checksum included
+                    spool.seek(0)
+                except:
+                    spool.close()
+                    raise
+            return self.stream_response(spool)
+
         if op.lower() == "get":
             validate_fingerprint(search, s)
+        if self.responseCache is not None:
+            self.responseCache.put(cacheKey, s)
         log.debug("proxying done. bytes:", len(s))
         return s
 
+    def spool_response(self, response, head):
+        """Copy head and the rest of the upstream response into a temporary file
+        (in memory up to STREAMTHRESHOLDBYTES), so the upstream connection is not
+        held while a slow client reads. Returns the file positioned at the start."""
+        spool = tempfile.SpooledTemporaryFile(max_size=STREAMTHRESHOLDBYTES)
+        try:
+            spool.write(head)
+            size = len(head)
+            while True:
+                data = response.read(65536)
+                if not data:
+                    break
+                size += len(data)
+                if size > MAXKEYBYTES:
+                    raise ResponseTooLargeError("Response larger than %s bytes" % MAXKEYBYTES)
+                spool.write(data)
+            spool.seek(0)
+        except:
+            spool.close()
+            raise
+        log.debug("proxying done. bytes:", size)
+        return spool
+
+    def stream_response(self, spool):
+        """Yield the spooled response, the spool is closed at the end or when
+        the client is gone."""
+        try:
+            while True:
+                data = spool.read(65536)
+                if not data:
+                    break
+                yield data
+        finally:
+            spool.close()
+
     def get_cached_name(self, fpr):
-        name = self.idFprs[fpr]
+        name = self.idFprs.get_name(fpr)
+        if name is None:
+            raise KeyError(fpr)
         return name
 
     def update_cache(self, name, fpr):
-        remove_value(self.idFprs, name)  # maybe a key was revoked (in place operation)
         cacheFpr = "0x" + fpr.lower()
-        self.idFprs[cacheFpr] = name
+        self.idFprs.put(name, cacheFpr)  # replaces an older fingerprint - maybe a key was revoked
         log.debug("lookup: updated cache:", name, cacheFpr, len(self.idFprs))
 
     def lookup_from_name(self, name, op):
@@ -336,9 +2300,10 @@ class RequestHandler(object):
             return idRequest.get_key()
         return idRequest.get_index()
 
-    def lookup_op_from_idFpr(self, idFpr, op):
+    def lookup_op_from_idFpr(self, idFpr, op, name=None):
         log.debug("lookup_idFpr", idFpr, op)
-        name = self.get_cached_name(idFpr)
+        if name is None:
+            name = self.get_cached_name(idFpr)
 
         # is the requested fingerprint still the correct one for the name in the cache or is the cache wrong by now?
         idRequest = IdRequest(name, self.standardKeyServer)
@@ -359,43 +2324,312 @@ class RequestHandler(object):
             bottle.abort(501, "Operation not implemented: " + str(op))
         return self.lookup(search, op, request=request)
 
+    def names_of(self, searches):
+        """The id/ names behind searches, fingerprints resolved via the caches."""
+        names = []
+        for search in searches:
+            if search.startswith("id/"):
+                names.append(search)
+            else:
+                name = self.idFprs.get_name(search.lower())
+                if name is None and self.idIndex is not None:
+                    name = self.idIndex.get_name(search.lower())
+                if name is not None:
+                    names.append(name)
+        return names
+
+    def lookup_batch(self, searches, op):
+        """Look up several searches concurrently. Returns a list of
+        (search, HTTP status, body or error message) in the order of searches."""
+        return [(search, status, body) for i, search, status, body, seconds
+                in self.iter_lookups(searches, op, BATCHWORKERS)]
+
+    def iter_lookups(self, searches, op, workers=BATCHWORKERS, ordered=True):
+        """Look up searches with up to workers threads. Yields
+        (index, search, HTTP status, body or error message, seconds) in the
+        order of searches or, if not ordered, as the lookups finish. Names are
+        prefetched in batches of BATCHMAXSEARCHES, one batch ahead of the workers,
+        into a memo used by these lookups only."""
+        if op not in ["get", "index"]:
+            bottle.abort(501, "Operation not implemented: " + str(op))
+        chunks = (len(searches) + BATCHMAXSEARCHES - 1) // BATCHMAXSEARCHES
+        prefetched = [threading.Event() for i in range(chunks)]
+        started = [threading.Event() for i in range(chunks)]
+        state = {"next": 0, "stopped": False}
+        lock = threading.Lock()
+        results = queue.Queue()
+        memo = {}  # name -> name_show data or not found error
+
+        def prefetch():
+            for k in range(chunks):
+                if k >= 2:
+                    started[k - 1].wait()  # keeps the name cache from filling up far ahead
+                if state["stopped"]:
+                    return
+                try:
+                    IdRequest.prefetch(self.names_of(searches[k * BATCHMAXSEARCHES:(k + 1) * BATCHMAXSEARCHES]),
+                                       memo)
+                except Exception as e:  # the single lookups will report backend problems
+                    log.debug("iter_lookups: prefetch failed:", repr(e))
+                prefetched[k].set()
+
+        def work():
+            requestContext.prefetched = memo
+            while True:
+                with lock:
+                    i = state["next"]
+                    if state["stopped"] or i >= len(searches):
+                        return
+                    state["next"] = i + 1
+                started[i // BATCHMAXSEARCHES].set()
+                prefetched[i // BATCHMAXSEARCHES].wait()
+                start = time.time()
+                try:
+                    body = self.lookup(searches[i], op)
+                    if isinstance(body, types.GeneratorType):
+                        body = b"".join(body)
+                    status = 200
+                except bottle.HTTPError as e:
+                    status, body = e.status_code, e.body
+                except Exception as e:
+                    log.debug("iter_lookups:", searches[i], repr(e))
+                    status, body = 500, "Lookup failed."
+                results.put((i, searches[i], status, body, time.time() - start))
+
+        for target, count in ((prefetch, min(chunks, 1)), (work, min(workers, len(searches)))):
+            for n in range(count):
+                t = threading.Thread(target=target)
+                t.daemon = True
+                t.start()
+        try:
+            pending = {}
+            nextIndex = 0
+            for n in range(len(searches)):
+                result = results.get()
+                if not ordered:
+                    yield result
+                    continue
+                pending[result[0]] = result
+                while nextIndex in pending:
+                    yield pending.pop(nextIndex)
+                    nextIndex += 1
+        finally:  # also if the caller stops early
+            state["stopped"] = True
+            for event in started + prefetched:
+                event.set()
+
     def lookup(self, search, op, request=None):
         log.debug("lookup: search:", search, " request:", request != None, " op:", op, len(self.idFprs))
-
+        options = ()
+        if request:
+            options = tuple(sorted((k, v) for k, v in request.query.allitems()
+                                   if k not in ("search", "op")))
+        start = time.time()
+        requestContext.path = "coalesced"  # unless this thread does the lookup itself
+        requestContext.timer = timer = RequestTimer() if SERVERTIMING else None
+        profiled = profiler.enter()
+        status = 200
+        try:
+            return self.inFlight.do((search, op, options), self._lookup, search, op, request)
+        except bottle.HTTPError as e:
+            status = e.status_code
+            raise
+        except Exception:
+            status = 500
+            raise
+        finally:
+            if profiled:
+                profiler.leave()
+            if METRICS:
+                metrics.observe_request(op, requestContext.path, status, time.time() - start)
+            if timer is not None and log.isEnabledFor(logging.DEBUG):
+                log.debug("lookup timing:", json.dumps({"search": search, "op": op, "path": requestContext.path,
+                                                        "status": status, "ms": round((time.time() - start) * 1000, 2),
+                                                        "phases": timer.record()}))
+
+    def _lookup(self, search, op, request=None):
         # looking up a Namecoin id/ ?
         if search.startswith("id/"):
+            requestContext.path = "name"
             name = search
             return self.lookup_from_name(name, op)
 
         # looking up a cached fingerprint?
-        if search.lower() in self.idFprs:
-            idFpr = search.lower()
-            return self.lookup_op_from_idFpr(idFpr, op)
+        idFpr = search.lower()
+        name = self.idFprs.get_name(idFpr)
+        if name is not None:
+            requestContext.path = "fpr"
+            return self.lookup_op_from_idFpr(idFpr, op, name)
+
+        # a fingerprint from the id/ namespace index?
+        if self.idIndex is not None:
+            name = self.idIndex.get_name(idFpr)
+            if name is not None:
+                requestContext.path = "idindex"
+                self.idFprs.put(name, idFpr)
+                return self.lookup_op_from_idFpr(idFpr, op, name)
 
         # if neither looking for a Namecoin id/ nor for a fingerprint - hand over to standard keyserver
+        requestContext.path = "proxy"
         return self.proxy_to_standard_pks(request, search, op)
 
+def accepts_gzip(acceptEncoding):
+    qualities = {}
+    for coding in acceptEncoding.lower().split(","):
+        parts = [p.strip() for p in coding.split(";")]
+        q = 1.0
+        for p in parts[1:]:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0
+        qualities[parts[0]] = q
+    return qualities.get("gzip", qualities.get("*", 0)) > 0
+
+def gzip_response(body):
+    """Compress a response body (str, bytes or an iterable of bytes) for the
+    current bottle request if the client accepts gzip."""
+    if isinstance(body, (str, unicode)) and not isinstance(body, bytes):
+        body = body.encode("utf-8")
+    if isinstance(body, bytes) and len(body) < GZIPMINBYTES:
+        return body
+    bottle.response.set_header("Vary", "Accept-Encoding")
+    if not accepts_gzip(bottle.request.headers.get("Accept-Encoding", "")):
+        return body
+    bottle.response.set_header("Content-Encoding", "gzip")
+    if isinstance(body, bytes):
+        compressor = zlib.compressobj(GZIPLEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+    return gzip_stream(body)
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(GZIPLEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+def make_server_adapter(backend, host, port, workers=SERVERWORKERS):
+    if backend == "threadpool":
+        import wsgiserver
+        return wsgiserver.ThreadPoolServer(host=host, port=port, workers=workers)
+    if backend == "asyncio":
+        import asyncioserver  # Python 3 only
+        return asyncioserver.AsyncioServer(host=host, port=port, workers=workers)
+    raise ValueError("Unknown server backend: " + str(backend))
+
 class KeyServer(object):
     def __init__(self, host=DEFAULTHOST, port=DEFAULTPORT,
-                 standardKeyServer=DEFAULTKEYSERVER):
+                 standardKeyServer=DEFAULTKEYSERVER, idIndex=None,
+                 serverBackend=DEFAULTSERVERBACKEND):
         self.host = host
         self.port = port
         self.standardKeyServer = standardKeyServer
+        self.serverBackend = serverBackend
+        self.server = None
         self.app = bottle.Bottle()
         self.app.route('/pks/lookup', ['GET', 'POST'], self.serve)
         self.app.route('/pks/add', ['GET', 'POST'], self.httpError501)  # as per the hkp spec
-        self.rh = RequestHandler(self.standardKeyServer)
+        self.app.route('/pks/batch', ['POST'], self.serve_batch)
+        if METRICS:
+            self.app.route('/metrics', 'GET', self.serve_metrics)
+            try:
+                import namerpc
+                if metrics.observe_rpc not in namerpc.callObservers:
+                    namerpc.callObservers.append(metrics.observe_rpc)
+            except ImportError:  # NMControl plugin mode
+                pass
+        self.rh = RequestHandler(self.standardKeyServer, idIndex)
 
     def start(self):
-        bottle.run(self.app, host=DEFAULTHOST, port=DEFAULTPORT)
+        if self.serverBackend == "wsgiref":
+            import wsgiserver
+            wsgiserver.patch_make_server()
+            bottle.run(self.app, host=self.host, port=self.port)
+            return
+        self.server = make_server_adapter(self.serverBackend, self.host, self.port)
+        bottle.run(self.app, server=self.server)
 
     def stop(self):
+        """Stop serving, requests in progress are completed."""
+        if self.server:
+            self.server.stop()
+            return
         self.app.server.shutdown()  # todo: simplify with bottle v0.13
 
     def serve(self):
-        log.debug(".............. request url:", bottle.request.url)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(".............. request url:", bottle.request.url)
 
-        return self.rh.lookup_req(bottle.request)
+        requestContext.timer = None
+        try:
+            body = self.rh.lookup_req(bottle.request)
+            with span("format"):
+                body = gzip_response(body)
+        except bottle.HTTPError as e:
+            if requestContext.timer is not None:
+                e.set_header("Server-Timing", requestContext.timer.server_timing())
+            raise
+        if requestContext.timer is not None:
+            bottle.response.set_header("Server-Timing", requestContext.timer.server_timing())
+        return body
+
+    def serve_batch(self):
+        """POST {"op": "get"|"index", "search": [search, ...]} - replies
+        {"results": [{"search":, "status":, "body": or "error":}, ...]}"""
+        try:
+            request = json.loads(bottle.request.body.read().decode("utf-8"))
+            op = request.get("op", bottle.request.query.op)
+            searches = request["search"]
+            if not isinstance(searches, list) or \
+                    not all(isinstance(search, (str, unicode)) for search in searches):
+                raise ValueError
+        except (ValueError, KeyError, AttributeError, TypeError):
+            bottle.abort(400, "Expected json: {\"op\": ..., \"search\": [...]}")
+        if len(searches) > BATCHMAXSEARCHES:
+            bottle.abort(413, "Too many searches, max: " + str(BATCHMAXSEARCHES))
+        log.debug("batch request:", op, len(searches))
+
+        results = []
+        for search, status, body in self.rh.lookup_batch(searches, op):
+            if isinstance(body, bytes):
+                body = body.decode("utf-8", "replace")
+            result = {"search": search, "status": status}
+            result["body" if status == 200 else "error"] = body
+            results.append(result)
+        bottle.response.content_type = "application/json"
+        return gzip_response(json.dumps({"results": results}))
+
+    def serve_metrics(self):
+        lines = metrics.render()
+        caches = [("fprindex", self.rh.idFprs), ("response", self.rh.responseCache),
+                  ("name", nameCache), ("blocktime", blockTimeCache), ("keystore", keyStore)]
+        caches = [(name, cache) for name, cache in caches if cache is not None]
+        for stat, kind, help in (("hits", "counter", "Cache hits."), ("misses", "counter", "Cache misses."),
+                                 ("evictions", "counter", "Entries evicted for space.")):
+            metric = "npkh_cache_%s_total" % stat
+            lines += ["# HELP %s %s" % (metric, help), "# TYPE %s %s" % (metric, kind)]
+            lines += ['%s{cache="%s"} %d' % (metric, name, getattr(cache, stat)) for name, cache in caches]
+        lines += ["# HELP npkh_cache_entries Cached entries.", "# TYPE npkh_cache_entries gauge"]
+        lines += ['npkh_cache_entries{cache="%s"} %d' % (name, len(cache))
+                  for name, cache in caches if hasattr(cache, "__len__")]
+        lines += ["# HELP npkh_coalesced_lookups_total Lookups answered by an identical concurrent lookup.",
+                  "# TYPE npkh_coalesced_lookups_total counter",
+                  "npkh_coalesced_lookups_total %d" % self.rh.inFlight.coalesced]
+        if self.rh.idIndex is not None:
+            stats = self.rh.idIndex.stats()
+            lines += ["# HELP npkh_idindex_entries Fingerprints in the id/ namespace index.",
+                      "# TYPE npkh_idindex_entries gauge", "npkh_idindex_entries %d" % stats["size"],
+                      "# HELP npkh_idindex_lag_blocks Blocks the id/ namespace index is behind.",
+                      "# TYPE npkh_idindex_lag_blocks gauge", "npkh_idindex_lag_blocks %d" % (stats["lag"] or 0)]
+        bottle.response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        return "\n".join(lines) + "\n"
 
     def httpError501(self):
         bottle.abort(501, "Not implemented.")
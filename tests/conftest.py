@@ -0,0 +1,71 @@
+"""
+Shared fixtures: the namecoind and keyserver stand-ins of the benchmarks and
+standalone mode configured against them. Nothing is logged to files or
+persisted.
+
+python -m pytest
+"""
+import pytest
+
+import common
+common.app["debug"] = False
+common.logToFile = False
+
+import namerpc
+import pluginKeyHandler
+
+import fakebackends
+import fixtures
+
+RPCUSER = "test"
+RPCPASSWORD = "test"
+
+@pytest.fixture(scope="session")
+def backends():
+    """(fixtures, FakeNamecoind, FakeKeyserver) for 12 names, both running."""
+    fix = fixtures.Fixtures(12)
+    keyserver = fakebackends.FakeKeyserver(fix).start()
+    fix.set_keyserver(keyserver.address)
+    namecoind = fakebackends.FakeNamecoind(fix).start()
+    yield fix, namecoind, keyserver
+    keyserver.stop()
+    namecoind.stop()
+
+@pytest.fixture
+def standalone(backends, monkeypatch):
+    """Standalone mode against the stand-ins. Nothing is cached across lookups
+    except block times; settings and module level caches are restored after
+    the test. Returns backends."""
+    fix, namecoind, keyserver = backends
+    settings = {"IdRequest": pluginKeyHandler.StandaloneIdRequest, "KEYSERVERSCHEME": "http",
+                "FPRINDEXFILE": None, "BLOCKTIMECACHEFILE": None, "KEYSTOREFILE": None,
+                "NAMECACHE": False, "PROXYCACHE": False,
+                "blockTimeCache": None, "nameCache": None, "chainTipWatcher": None, "keyStore": None}
+    for name, value in settings.items():
+        monkeypatch.setattr(pluginKeyHandler, name, value)
+    rpc = namerpc.CoinRpc(namerpc.CONTYPECLIENT, options={
+        "rpcport": namecoind.port, "rpcuser": RPCUSER, "rpcpassword": RPCPASSWORD})
+    monkeypatch.setitem(namerpc._sharedRpcs, ("auto", None), rpc)
+    return backends
+
+@pytest.fixture
+def rh(standalone):
+    fix, namecoind, keyserver = standalone
+    return pluginKeyHandler.RequestHandler(standardKeyServer=keyserver.address)
+
+def body_of(result):
+    if isinstance(result, (bytes, str)):
+        return result
+    return b"".join(result)  # streamed
+
+@pytest.fixture
+def rpc_calls(standalone):
+    """rpc_calls(fn) runs fn and returns (result, calls by method as seen by namecoind)."""
+    namecoind = standalone[1]
+    def run(fn):
+        namecoind.reset_counts()
+        result = fn()
+        if not isinstance(result, list):
+            result = body_of(result)
+        return result, dict(namecoind.counts)
+    return run
@@ -0,0 +1,57 @@
+"""
+Armor checksum, dearmoring and fingerprint calculation against the
+straightforward implementations in benchmarks/fixtures.py.
+"""
+import random
+
+import pytest
+
+import pluginKeyHandler
+
+import fixtures
+
+@pytest.mark.parametrize("length", [0, 1, 2, 3, 5, 6, 7, 63, 64, 65, 1000, 4096])
+def test_crc24_matches_table_implementation(length):
+    rnd = random.Random(length)
+    data = bytes(bytearray(rnd.getrandbits(8) for i in range(length)))
+    assert pluginKeyHandler.crc24(data) == fixtures.crc24(data)
+
+def test_dearmor_roundtrip():
+    data = bytes(bytearray(range(256))) * 3
+    assert pluginKeyHandler.dearmor(fixtures.armor(data)) == data
+    assert pluginKeyHandler.dearmor(data) == data  # binary unchanged
+
+def test_dearmor_headers_and_text():
+    data = b"\x99\x01\x02key material"
+    armored = fixtures.armor(data).replace(b"-----\n\n", b"-----\nVersion: test\nComment: x\n\n", 1)
+    assert pluginKeyHandler.dearmor(armored.decode("ascii")) == data
+
+def test_dearmor_checksum_mismatch():
+    armored = fixtures.armor(b"some key data")
+    crcPos = armored.rfind(b"\n=") + 2
+    bad = armored[:crcPos] + (b"AAAA" if armored[crcPos:crcPos + 4] != b"AAAA" else b"BBBB") + armored[crcPos + 4:]
+    with pytest.raises(pluginKeyHandler.ArmorChecksumError):
+        pluginKeyHandler.dearmor(bad)
+
+def test_dearmor_incomplete():
+    armored = fixtures.armor(b"some key data" * 20)
+    with pytest.raises(ValueError):
+        pluginKeyHandler.dearmor(armored[:60])
+    head = pluginKeyHandler.dearmor(armored[:90], partial=True)
+    assert (b"some key data" * 20).startswith(head) and head
+
+@pytest.mark.parametrize("signatures", [0, 5, 100])
+def test_calc_fingerprint(signatures):
+    fpr, armored = fixtures.make_key(signatures, seed=signatures)
+    assert pluginKeyHandler.calc_fingerprint(armored) == "0x" + fpr
+    assert pluginKeyHandler.head_fingerprint(armored[:1000]) == "0x" + fpr
+    pluginKeyHandler.validate_fingerprint(fpr.upper(), armored)
+    with pytest.raises(AssertionError):
+        pluginKeyHandler.validate_fingerprint("0x" + "0" * 40, armored)
+
+def test_calc_fingerprint_keyring_first_key():
+    fpr1, armored1 = fixtures.make_key(1, seed=1)
+    fpr2, armored2 = fixtures.make_key(1, seed=2)
+    ring = pluginKeyHandler.dearmor(armored1) + pluginKeyHandler.dearmor(armored2)
+    assert list(pluginKeyHandler.iter_primary_fingerprints(ring)) == [fpr1, fpr2]
+    assert pluginKeyHandler.calc_fingerprint(fixtures.armor(ring)) == "0x" + fpr1
@@ -0,0 +1,178 @@
+"""
+FprIndex, ResponseCache and SingleFlight.
+"""
+import json
+import os
+import threading
+import time
+
+import bottle
+import pytest
+
+from pluginKeyHandler import FprIndex, ResponseCache, SingleFlight
+
+def test_fprindex_put_get():
+    index = FprIndex()
+    index.put("id/a", "0xaa")
+    assert index.get_name("0xaa") == "id/a"
+    assert index.get_fpr("id/a") == "0xaa"
+    assert "0xaa" in index and "0xbb" not in index
+    index.put("id/a", "0xbb")  # new key
+    assert index.get_name("0xaa") is None
+    assert index.get_fpr("id/a") == "0xbb"
+    index.remove_name("id/a")
+    assert len(index) == 0 and index.get_fpr("id/a") is None
+
+def test_fprindex_fingerprint_moves_to_another_name():
+    index = FprIndex()
+    index.put("id/a", "0xaa")
+    index.put("id/b", "0xaa")  # same key claimed by a second name
+    assert index.get_name("0xaa") == "id/b"
+    assert index.get_fpr("id/a") is None
+    index.put("id/a", "0xcc")  # must not drop id/b's mapping
+    assert index.get_name("0xaa") == "id/b" and index.get_fpr("id/b") == "0xaa"
+    assert index.get_name("0xcc") == "id/a"
+    index.remove_name("id/a")
+    assert index.get_name("0xaa") == "id/b" and len(index) == 1
+
+def test_fprindex_expired_entry_keeps_new_owner():
+    index = FprIndex()
+    index.put("id/a", "0xaa")
+    index.put("id/b", "0xaa", ttlSeconds=-1)
+    assert index.get_name("0xaa") is None  # expired - removes id/b only
+    index.put("id/a", "0xcc")
+    assert index.get_name("0xcc") == "id/a" and len(index) == 1
+
+def test_fprindex_load_shared_fingerprint(tmp_path):
+    filename = str(tmp_path / "fprindex.json")
+    expiry = time.time() + 60
+    with open(filename, "w") as f:
+        json.dump([["0xaa", "id/a", expiry], ["0xaa", "id/b", expiry], ["0xcc", "id/a", expiry]], f)
+    index = FprIndex(filename=filename)
+    assert index.get_name("0xaa") == "id/b" and index.get_name("0xcc") == "id/a"
+
+def test_fprindex_expiry_and_eviction():
+    index = FprIndex(maxLen=2)
+    index.put("id/a", "0xaa", ttlSeconds=-1)
+    assert index.get_name("0xaa") is None and len(index) == 0
+    for name, fpr in [("id/b", "0xbb"), ("id/c", "0xcc"), ("id/d", "0xdd")]:
+        index.put(name, fpr)
+    assert index.get_name("0xbb") is None and index.get_fpr("id/b") is None
+    assert index.get_name("0xdd") == "id/d" and index.evictions == 1
+
+def test_fprindex_save_load(tmp_path):
+    filename = str(tmp_path / "index" / "fprindex.json")
+    index = FprIndex(filename=filename, saveSeconds=float("inf"))
+    index.put("id/a", "0xaa")
+    index.put("id/b", "0xbb", ttlSeconds=-1)  # expired, not loaded
+    index.save()
+    assert os.listdir(str(tmp_path / "index")) == ["fprindex.json"]  # no temporary file left
+    loaded = FprIndex(filename=filename)
+    assert loaded.get_name("0xaa") == "id/a" and len(loaded) == 1
+
+def test_fprindex_read_only(tmp_path):
+    filename = str(tmp_path / "fprindex.json")
+    with open(filename, "w") as f:
+        json.dump([["0xaa", "id/a", time.time() + 60]], f)
+    index = FprIndex(filename=filename, readOnly=True, saveSeconds=0)
+    assert index.get_name("0xaa") == "id/a"
+    index.put("id/b", "0xbb")
+    index.save()
+    with open(filename) as f:
+        assert len(json.load(f)) == 1
+
+def test_response_cache_hit_miss_expiry():
+    cache = ResponseCache(ttlSeconds={"index": 60, "get": -1})
+    key = ResponseCache.make_key(" Foo@Example.org", "INDEX", ["mr"])
+    assert key == ResponseCache.make_key("foo@example.org", "index", ("mr",))
+    assert cache.get(key) == (False, None)
+    cache.put(key, b"body")
+    assert cache.get(key) == (True, b"body")
+    cache.put(ResponseCache.make_key("x", "get"), b"body")  # no time to live - not stored
+    assert len(cache) == 1 and (cache.hits, cache.misses) == (1, 1)
+
+def test_response_cache_not_found():
+    cache = ResponseCache(notFoundSeconds=60)
+    key = ResponseCache.make_key("nobody", "index")
+    cache.put(key, None)
+    assert cache.get(key) == (True, None)
+    cache._cache[key] = (time.time() - 1, None)
+    assert cache.get(key) == (False, None)
+    assert cache.size == 0
+
+def test_response_cache_size_budget():
+    cache = ResponseCache(maxBytes=1000, ttlSeconds={"index": 60})
+    keys = [ResponseCache.make_key("s%d" % i, "index") for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, b"x" * 200)  # 300 bytes each with the overhead
+    cache.get(keys[0])  # most recently used
+    cache.put(keys[3], b"x" * 200)
+    assert cache.get(keys[1]) == (False, None)
+    assert cache.get(keys[0])[0] and cache.get(keys[3])[0]
+    assert cache.size == 900 and cache.evictions == 1
+    cache.put(ResponseCache.make_key("big", "index"), b"x" * 1000)  # larger than the budget
+    assert cache.size == 900
+
+def run_concurrently(count, fn):
+    results = [None] * count
+    def run(i):
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+def test_single_flight_coalesces():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+    def slow(x):
+        calls.append(x)
+        release.wait(5)
+        return x * 2
+    threads, results = run_concurrently(5, lambda: flight.do("key", slow, 21))
+    while flight.coalesced < 4:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert calls == [21] and results == [42] * 5
+    assert flight.do("key", slow, 1) == 2  # finished calls are not remembered
+
+def test_single_flight_streams_are_not_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+    def stream():
+        release.wait(5)
+        return (chunk for chunk in [b"a", b"b"])
+    threads, results = run_concurrently(3, lambda: b"".join(flight.do("key", stream)))
+    while flight.coalesced < 2:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert results == [b"ab"] * 3
+
+@pytest.mark.parametrize("error", [bottle.HTTPError(404, "No keys found."), ValueError("bad")])
+def test_single_flight_waiters_get_their_own_exception(error):
+    flight = SingleFlight()
+    release = threading.Event()
+    def failing():
+        release.wait(5)
+        raise error
+    threads, results = run_concurrently(4, lambda: flight.do("key", failing))
+    while flight.coalesced < 3:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(set(id(e) for e in results)) == 4 and error in results
+    for e in results:
+        assert type(e) is type(error) and str(e) == str(error)
+    if isinstance(error, bottle.HTTPError):
+        assert [(e.status_code, e.body) for e in results] == [(404, "No keys found.")] * 4
+        results[0].set_header("Server-Timing", "a")
+        assert all(e.get_header("Server-Timing") is None for e in results[1:])
@@ -0,0 +1,184 @@
+"""
+IdNamespaceIndex against an in-process fake of the namecoind calls it uses.
+"""
+import json
+import os
+
+import pytest
+
+from pluginKeyHandler import IdNamespaceIndex
+
+def fpr(i):
+    return "%040x" % i
+
+class FakeChain(object):
+    """name_scan, getblockcount, getblockhash, getblockheader and getblock. Block
+    hashes are "<height><branch>", blocks replaced by a reorg can still be
+    fetched like orphaned blocks of namecoind."""
+    def __init__(self, names, maxCalls=1000):
+        self.names = dict(names)  # name -> value dict, as seen by name_scan
+        self.blocks = {}
+        self.chain = []
+        self.calls = []
+        self.maxCalls = maxCalls
+        self.add_block([])
+
+    def add_block(self, nameOps, branch=""):
+        """nameOps: [(name, value dict), ...]"""
+        blockHash = "%d%s" % (len(self.chain), branch)
+        self.blocks[blockHash] = {
+            "hash": blockHash, "height": len(self.chain),
+            "previousblockhash": self.chain[-1] if self.chain else None,
+            "tx": [{"vout": [{"scriptPubKey": {"nameOp": {"op": "name_update", "name": name,
+                                                           "value": json.dumps(value)}}}]}
+                   for name, value in nameOps]}
+        self.chain.append(blockHash)
+        for name, value in nameOps:
+            self.names[name] = value
+        return blockHash
+
+    def reorg(self, depth, branchOps, branch="b"):
+        """Replace the last depth blocks by len(branchOps) blocks."""
+        del self.chain[-depth:]
+        for nameOps in branchOps:
+            self.add_block(nameOps, branch)
+
+    def call(self, method, params=()):
+        self.calls.append(method)
+        assert len(self.calls) <= self.maxCalls, "too many calls"
+        if method == "name_scan":
+            names = sorted(name for name in self.names if name >= params[0])[:params[1]]
+            return [{"name": name, "value": json.dumps(self.names[name]), "expires_in": 30000}
+                    for name in names]
+        if method == "getblockcount":
+            return len(self.chain) - 1
+        if method == "getblockhash":
+            return self.chain[params[0]]
+        if method == "getblockheader":
+            return dict((k, v) for k, v in self.blocks[params[0]].items() if k != "tx")
+        if method == "getblock":
+            return self.blocks[params[0]]
+        raise ValueError(method)
+
+def make_names(count):
+    names = dict(("id/n%02d" % i, {"gpg": {"fpr": fpr(i)}}) for i in range(count))
+    names["id/nokey"] = {"email": "x@example.org"}
+    names["d/domain"] = {"ip": "127.0.0.1"}  # other namespaces around id/
+    names["x/other"] = {"gpg": {"fpr": fpr(99)}}
+    return names
+
+@pytest.mark.parametrize("pageSize", [1, 2, 3, 11, 1000])
+def test_build_pages(pageSize):
+    chain = FakeChain(make_names(10))
+    index = IdNamespaceIndex(lambda: chain, pageSize=pageSize)
+    index.build()
+    assert len(index) == 10 and index.scanned == 11
+    assert [index.get_name("0x" + fpr(i)) for i in range(10)] == ["id/n%02d" % i for i in range(10)]
+    assert index.get_name("0x" + fpr(99)) is None
+    assert index.height == 0 and index.blockHash == "0"
+
+def test_checkpoint_without_index_rebuilds(tmp_path):
+    filename = str(tmp_path / "idindex.json")
+    chain = FakeChain(make_names(3))
+    index = IdNamespaceIndex(lambda: chain, filename=filename)
+    index.build()
+    assert os.path.isfile(filename) and os.path.isfile(filename + ".checkpoint")
+    for damage in ("missing", "corrupt"):
+        if damage == "missing":
+            os.remove(filename)
+        else:
+            with open(filename, "w") as f:
+                f.write("[[")
+        restarted = IdNamespaceIndex(lambda: chain, filename=filename)
+        assert restarted.height is None  # checkpoint ignored
+        restarted.sync()
+        assert "name_scan" in chain.calls
+        assert len(restarted) == 3 and restarted.get_name("0x" + fpr(2)) == "id/n02"
+
+def key(i):
+    return {"gpg": {"fpr": fpr(i)}}
+
+def built(names, **kwargs):
+    chain = FakeChain(names)
+    index = IdNamespaceIndex(lambda: chain, **kwargs)
+    index.build()
+    return chain, index
+
+def test_sync_applies_blocks():
+    chain, index = built(make_names(3))
+    chain.add_block([("id/new", key(50)), ("id/n00", key(51))])
+    chain.add_block([("id/n01", {"email": "no key"}), ("d/domain", key(52))])
+    index.sync()
+    assert index.height == 2 and index.lag() == 0
+    assert index.get_name("0x" + fpr(50)) == "id/new"
+    assert index.get_name("0x" + fpr(51)) == "id/n00" and index.get_name("0x" + fpr(0)) is None
+    assert index.get_name("0x" + fpr(1)) is None
+    assert index.get_name("0x" + fpr(52)) is None  # not an id/ name
+    assert chain.calls.count("name_scan") == 1  # the build only
+
+def test_sync_shared_fingerprint():
+    chain, index = built(make_names(3))
+    chain.add_block([("id/c", key(1))])  # takes id/n01's key
+    index.sync()
+    assert index.get_name("0x" + fpr(1)) == "id/c"
+    chain.add_block([("id/c", key(60))])  # and drops it again
+    index.sync()
+    assert index.get_name("0x" + fpr(1)) == "id/n01"
+    assert index.get_name("0x" + fpr(60)) == "id/c"
+    chain.add_block([("id/n01", key(61))])
+    index.sync()
+    assert index.get_name("0x" + fpr(1)) is None
+
+def test_reorg_rolls_back():
+    chain, index = built(make_names(3), reorgDepth=2)
+    chain.add_block([("id/a", key(70))])
+    chain.add_block([("id/n00", key(71))])
+    chain.add_block([("id/b", key(1)), ("id/n02", {})])
+    index.sync()
+    assert index.get_name("0x" + fpr(1)) == "id/b"
+    # the last two blocks are orphaned - the oldest one of them is rolled back via its header
+    chain.reorg(2, [[("id/n02", key(72))], [], []])
+    del chain.calls[:]
+    index.sync()
+    assert index.height == 4 and index.blockHash == "4b"
+    assert "getblockheader" in chain.calls and "name_scan" not in chain.calls
+    assert index.get_name("0x" + fpr(70)) == "id/a"  # before the fork
+    assert index.get_name("0x" + fpr(0)) == "id/n00" and index.get_name("0x" + fpr(71)) is None
+    assert index.get_name("0x" + fpr(1)) == "id/n01"  # id/b's claim undone
+    assert index.get_name("0x" + fpr(2)) is None and index.get_name("0x" + fpr(72)) == "id/n02"
+
+def test_reorg_deeper_than_recorded_rebuilds():
+    chain, index = built(make_names(3), reorgDepth=1)
+    chain.add_block([("id/a", key(70))])
+    chain.add_block([])
+    index.sync()
+    chain.reorg(2, [[("id/b", key(80))], [], []])
+    del chain.calls[:]
+    index.sync()
+    assert "name_scan" in chain.calls
+    assert index.get_name("0x" + fpr(80)) == "id/b" and index.height == 3
+
+def test_far_behind_rebuilds():
+    chain, index = built(make_names(3), maxCatchUp=2)
+    for i in range(3):
+        chain.add_block([])
+    del chain.calls[:]
+    index.sync()
+    assert "name_scan" in chain.calls and "getblock" not in chain.calls
+    assert index.height == 3
+
+def test_checkpoint_resume(tmp_path):
+    filename = str(tmp_path / "idindex.json")
+    chain, index = built(make_names(3), filename=filename)
+    chain.add_block([("id/c", key(1))])  # shared with id/n01
+    index.sync()
+    chain.add_block([("id/d", key(90))])
+    restarted = IdNamespaceIndex(lambda: chain, filename=filename)
+    assert restarted.height == 1 and restarted.blockHash == "1"
+    del chain.calls[:]
+    chain.add_block([("id/c", key(91))])
+    restarted.sync()
+    assert "name_scan" not in chain.calls and chain.calls.count("getblock") == 2
+    assert restarted.get_name("0x" + fpr(90)) == "id/d"
+    assert restarted.get_name("0x" + fpr(1)) == "id/n01"  # the other holder survived the restart
+    assert restarted.get_name("0x" + fpr(2)) == "id/n02"
@@ -0,0 +1,48 @@
+"""
+KeyStore: stored keys follow the key uri of the name.
+"""
+import time
+
+import pytest
+
+import pluginKeyHandler
+
+@pytest.fixture
+def store(standalone, monkeypatch):
+    store = pluginKeyHandler.KeyStore(":memory:")
+    monkeypatch.setattr(pluginKeyHandler, "KEYSTOREFILE", "keystore.sqlite")
+    monkeypatch.setattr(pluginKeyHandler, "keyStore", store)
+    return store
+
+def source_of(store, fpr):
+    row = store._db.execute("SELECT source FROM keys WHERE fpr=?", (fpr.lower(),)).fetchone()
+    return row and row[0]
+
+def standard_url(keyserver, fpr):
+    return "http://" + keyserver.address + "/pks/lookup?op=get&options=mr&search=0x" + fpr
+
+def test_changed_uri_drops_the_stored_key(standalone, store, rh, monkeypatch):
+    fix, namecoind, keyserver = standalone
+    name, fpr = fix.nameFprs[0]
+    oldUri = fix.names[name]["gpg"]["uri"]
+    rh.lookup(name, "get")
+    assert source_of(store, fpr) == oldUri
+    rh.lookup(name, "get")
+    assert store.hits == 1
+    newUri = oldUri.replace("127.0.0.1", "localhost")
+    monkeypatch.setitem(fix.names[name]["gpg"], "uri", newUri)
+    assert rh.lookup(name, "get") == fix.keys[fpr]
+    assert source_of(store, fpr) == newUri and store.hits == 1
+
+def test_refresh_uses_the_current_sources(standalone, store):
+    fix, namecoind, keyserver = standalone
+    name, fpr = fix.nameFprs[0]
+    store.refreshSeconds = 0
+    store.put(fpr, fix.keys[fpr], standard_url(keyserver, fpr))  # the custom uri failed back then
+    uri = fix.names[name]["gpg"]["uri"]
+    assert store.get(fpr, [uri, standard_url(keyserver, fpr)]) == fix.keys[fpr]
+    for i in range(500):
+        if source_of(store, fpr) == uri:
+            break
+        time.sleep(0.01)
+    assert source_of(store, fpr) == uri
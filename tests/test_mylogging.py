@@ -0,0 +1,36 @@
+"""
+mylogging: repeated configuration of a logger and print() style arguments.
+"""
+import logging
+
+import mylogging
+
+def test_handlers_installed_once(tmp_path):
+    filename = str(tmp_path / "log.txt")
+    log = mylogging.get_my_logger("test.once", filename=filename)
+    handlers = list(log.handlers)
+    assert len(handlers) == 2
+    assert mylogging.get_my_logger("test.once", filename=filename) is log
+    assert log.handlers == handlers  # same configuration - nothing added
+    mylogging.get_my_logger("test.once", levelConsole=mylogging.DEBUG, filename=filename)
+    assert len(log.handlers) == 2 and not set(log.handlers) & set(handlers)  # replaced
+    for h in log.handlers:
+        h.close()
+
+def test_background_handlers_installed_once():
+    log = mylogging.get_my_logger("test.background", background=True)
+    mylogging.get_my_logger("test.background", background=True)
+    assert len(log.handlers) == 1
+    assert isinstance(log.handlers[0], mylogging.QueueHandler)
+
+def test_join_args_unicode():
+    args = ("a", 1, None, b"bytes \xc3\xa4", u"unicode \xe4", mylogging.lazy(sorted, [2, 1]))
+    assert mylogging.join_args_unicode(*args) in (
+        u"a 1 None bytes \xe4 unicode \xe4 [1, 2]",  # Python 2
+        u"a 1 None b'bytes \\xc3\\xa4' unicode \xe4 [1, 2]")  # Python 3
+
+def test_disabled_level_skips_arguments():
+    log = mylogging.get_my_logger("test.level", levelConsole=mylogging.INFO)
+    evaluated = []
+    log.debug("x", mylogging.lazy(evaluated.append, 1))
+    assert evaluated == [] and not log.isEnabledFor(logging.DEBUG)
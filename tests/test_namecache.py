@@ -0,0 +1,79 @@
+"""
+NameCache and ChainTipWatcher without push notifications, against a fake of
+the namecoind calls they use.
+"""
+import time
+
+from pluginKeyHandler import ChainTipWatcher, NameCache
+
+class FakeTip(object):
+    """getbestblockhash, getblockheader and getblock of a chain of blocks
+    with name operations."""
+    def __init__(self):
+        self.blocks = {}
+        self.best = None
+        self.calls = []
+        self.add_block([])
+
+    def add_block(self, names):
+        height = 0 if self.best is None else self.blocks[self.best]["height"] + 1
+        blockHash = "block%d" % height
+        self.blocks[blockHash] = {
+            "hash": blockHash, "height": height, "previousblockhash": self.best,
+            "tx": [{"vout": [{"scriptPubKey": {"nameOp": {"op": "name_update", "name": name}}}]}
+                   for name in names]}
+        self.best = blockHash
+
+    def call(self, method, params=()):
+        self.calls.append(method)
+        if method == "getbestblockhash":
+            return self.best
+        if method == "getblockheader":
+            return {"height": self.blocks[params[0]]["height"]}
+        if method == "getblock":
+            return self.blocks[params[0]]
+        raise ValueError(method)
+
+def make_cache(checkTip):
+    chain = FakeTip()
+    watcher = ChainTipWatcher(lambda: chain, pollSeconds=60)
+    cache = NameCache(watcher, checkTip=checkTip)
+    watcher.check()
+    for name in ("id/a", "id/b"):
+        cache.put(name, {"name": name, "expires_in": 1000}, cache.generation)
+    del chain.calls[:]
+    return chain, watcher, cache
+
+def test_hits_reuse_a_recent_tip_check():
+    chain, watcher, cache = make_cache(checkTip=60)
+    for i in range(10):
+        assert cache.get("id/a")["name"] == "id/a"
+    assert chain.calls == [] and cache.hits == 10
+
+def test_hits_check_the_tip_when_the_last_check_is_old():
+    chain, watcher, cache = make_cache(checkTip=0.5)
+    watcher.lastCheck -= 1
+    assert cache.get("id/a") is not None and cache.get("id/b") is not None
+    assert chain.calls == ["getbestblockhash"]  # shared by the second hit
+
+def test_new_tip_invalidates_touched_names():
+    chain, watcher, cache = make_cache(checkTip=0.5)
+    chain.add_block(["id/a"])
+    assert cache.get("id/a") is not None  # checked recently - may be stale
+    watcher.lastCheck -= 1
+    assert cache.get("id/a") is None  # the tip check finds the block
+    assert cache.get("id/b") is not None and cache.tip == ("block1", 1)
+    assert chain.calls.count("getbestblockhash") == 1 and chain.calls.count("getblock") == 1
+
+def test_every_hit_checks_with_zero_interval():
+    chain, watcher, cache = make_cache(checkTip=0)
+    time.sleep(0.01)
+    cache.get("id/a")
+    time.sleep(0.01)
+    cache.get("id/a")
+    assert chain.calls == ["getbestblockhash"] * 2
+
+def test_no_tip_check_with_none():
+    chain, watcher, cache = make_cache(checkTip=None)
+    watcher.lastCheck -= 30
+    assert cache.get("id/a") is not None and chain.calls == []
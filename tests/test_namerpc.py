@@ -0,0 +1,37 @@
+"""
+namerpc connection pools and cookie authentication.
+"""
+import os
+
+import namerpc
+
+class FakeConnection(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+def write_cookie(datadir, credentials, mtime):
+    filename = os.path.join(datadir, namerpc.COOKIEAUTH_FILE)
+    with open(filename, "w") as f:
+        f.write(credentials)
+    os.utime(filename, (mtime, mtime))
+
+def test_cookie_change_drops_the_old_pool(tmp_path):
+    datadir = str(tmp_path)
+    with open(os.path.join(datadir, namerpc.COINAPP + ".conf"), "w") as f:
+        f.write("rpcport=18336\n")
+    write_cookie(datadir, "__cookie__:old", 1000000)
+    rpc = namerpc.CoinRpc(namerpc.CONTYPECLIENT, datadir=datadir)
+    oldPool = rpc.pool
+    conn = FakeConnection()
+    oldPool._release(conn)  # an idle connection with the old credentials
+    rpc.reload_cookie_if_changed()
+    assert rpc.pool is oldPool  # unchanged cookie
+
+    write_cookie(datadir, "__cookie__:new", 2000000)
+    rpc.reload_cookie_if_changed()
+    assert rpc.pool is not oldPool and rpc.options["rpcpassword"] == "new"
+    assert conn.closed and oldPool not in namerpc._pools.values()
+    assert rpc.pool in namerpc._pools.values()
+    namerpc.drop_pool(rpc.pool)
@@ -0,0 +1,67 @@
+"""
+Responses of the standard keyserver (the stand-in) passed through.
+"""
+import socket
+
+import pytest
+
+import pluginKeyHandler
+
+import fixtures
+
+def large_key(seed):
+    fpr, armored = fixtures.make_key(1000, seed=seed)
+    assert len(armored) > pluginKeyHandler.STREAMTHRESHOLDBYTES
+    return fpr, armored
+
+def test_large_key_is_validated_and_streamed(standalone, rh, monkeypatch):
+    fix, namecoind, keyserver = standalone
+    fpr, armored = large_key(1)
+    monkeypatch.setitem(fix.keys, fpr, armored)
+    result = rh.lookup("0x" + fpr, "get")
+    assert not isinstance(result, bytes)  # streamed from the spool
+    assert b"".join(result) == armored
+
+def test_large_key_with_bad_checksum_is_refused(standalone, rh, monkeypatch):
+    fix, namecoind, keyserver = standalone
+    fpr, armored = large_key(2)
+    crcPos = armored.rfind(b"\n=") + 2
+    bad = armored[:crcPos] + (b"AAAA" if armored[crcPos:crcPos + 4] != b"AAAA" else b"BBBB") + armored[crcPos + 4:]
+    monkeypatch.setitem(fix.keys, fpr, bad)
+    with pytest.raises(pluginKeyHandler.ArmorChecksumError):
+        rh.lookup("0x" + fpr, "get")
+
+def test_large_key_of_another_fingerprint_is_refused(standalone, rh, monkeypatch):
+    fix, namecoind, keyserver = standalone
+    fpr, armored = large_key(3)
+    otherFpr, otherArmored = large_key(4)
+    monkeypatch.setitem(fix.keys, fpr, otherArmored)
+    with pytest.raises(AssertionError):
+        rh.lookup("0x" + fpr, "get")
+
+def test_upstream_not_found(standalone, rh):
+    with pytest.raises(Exception) as e:
+        rh.lookup("0x" + "0" * 40, "get")
+    assert getattr(e.value, "status_code", None) == 404
+
+def test_upstream_metrics_label_custom_hosts(standalone, monkeypatch):
+    fix, namecoind, keyserver = standalone
+    monkeypatch.setattr(pluginKeyHandler, "metrics", pluginKeyHandler.Metrics())
+    pool = pluginKeyHandler.HttpPool()
+    pool.add_metric_host(keyserver.address)
+    port = keyserver.address.split(":")[1]
+    fpr = fix.nameFprs[0][1]
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    closedPort = s.getsockname()[1]
+    s.close()
+    for host in ("127.0.0.1", "localhost"):  # configured, from a gpg.uri
+        pool.read("http://%s:%s/key/%s" % (host, port, fpr))
+        pool.read("http://%s:%s/key/%s" % (host, port, fpr))
+        with pytest.raises(socket.error):
+            pool.read("http://%s:%s/key/%s" % (host, closedPort, fpr))
+    lines = pluginKeyHandler.metrics.render()
+    assert 'npkh_upstream_errors_total{host="127.0.0.1"} 1' in lines
+    assert 'npkh_upstream_errors_total{host="custom"} 1' in lines
+    assert not [line for line in lines if "localhost" in line]
+    assert 'npkh_upstream_duration_seconds_count{host="custom"} 2' in lines
@@ -0,0 +1,57 @@
+"""
+Backend calls per lookup, counted by the namecoind stand-in of the
+benchmarks. Caches that span lookups are off except for block times.
+"""
+import pytest
+
+import pluginKeyHandler
+
+def test_index_by_name(standalone, rh, rpc_calls):
+    fix, namecoind, keyserver = standalone
+    name, fpr = fix.nameFprs[0]
+    body, calls = rpc_calls(lambda: rh.lookup(name, "index"))
+    assert fpr in body
+    assert calls == {"name_show": 1, "getblockhash": 1, "getblockheader": 1}
+    body, calls = rpc_calls(lambda: rh.lookup(name, "index"))  # block time cached
+    assert calls == {"name_show": 1}
+
+@pytest.mark.parametrize("i", [2, 3])  # key from a custom uri and from the standard keyserver
+def test_get_by_name(standalone, rh, rpc_calls, i):
+    fix, namecoind, keyserver = standalone
+    name, fpr = fix.nameFprs[i]
+    body, calls = rpc_calls(lambda: rh.lookup(name, "get"))
+    assert body == fix.keys[fpr]
+    assert sum(calls.values()) <= 3
+    assert calls["name_show"] == 1
+
+@pytest.mark.parametrize("op", ["index", "get"])
+def test_by_fingerprint(standalone, rh, rpc_calls, op):
+    fix, namecoind, keyserver = standalone
+    name, fpr = fix.nameFprs[4]
+    rh.lookup(name, "index")  # puts the fingerprint into the index
+    body, calls = rpc_calls(lambda: rh.lookup("0x" + fpr, op))
+    assert (fpr in body) if op == "index" else (body == fix.keys[fpr])
+    assert calls == {"name_show": 1}
+
+def test_proxied_search(standalone, rh, rpc_calls):
+    fix, namecoind, keyserver = standalone
+    email = sorted(fix.emails)[0]
+    body, calls = rpc_calls(lambda: rh.lookup(email, "index"))
+    assert fix.emails[email] in body.decode("utf-8").lower()
+    assert calls == {}
+
+def test_memo_sends_each_call_once(standalone, rh):
+    fix, namecoind, keyserver = standalone
+    idRequest = pluginKeyHandler.IdRequest(fix.nameFprs[5][0], rh.standardKeyServer)
+    idRequest.get_index()
+    idRequest.get_index()
+    assert len(idRequest.rpcCalls) == len(set((m, repr(a)) for m, a in idRequest.rpcCalls))
+    assert idRequest.rpcMemoHits > 0
+
+def test_batch_is_one_round_trip(standalone, rh, rpc_calls):
+    fix, namecoind, keyserver = standalone
+    names = [name for name, fpr in fix.nameFprs[6:]] + ["id/doesnotexist"]
+    rh.lookup(fix.nameFprs[0][0], "index")  # block time of the names (all at the same height) cached
+    results, calls = rpc_calls(lambda: rh.lookup_batch(names, "index"))
+    assert [status for search, status, body in results] == [200] * (len(names) - 1) + [404]
+    assert calls == {"batch": 1, "name_show": len(names)}
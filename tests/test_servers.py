@@ -0,0 +1,84 @@
+"""
+The threadpool and asyncio server backends: keep-alive, stopping with idle
+connections and slow clients.
+"""
+import socket
+import sys
+import threading
+import time
+
+import bottle
+import pytest
+
+import pluginKeyHandler
+
+BACKENDS = ["threadpool"] + (["asyncio"] if sys.version_info >= (3, 7) else [])
+
+@pytest.fixture(params=BACKENDS)
+def server(request, monkeypatch):
+    """(adapter, thread) of a running server with a /ping route."""
+    monkeypatch.setattr(pluginKeyHandler, "KEEPALIVESECONDS", 30)
+    monkeypatch.setattr(pluginKeyHandler, "SERVERIOSECONDS", 0.5)
+    app = bottle.Bottle()
+    app.route("/ping", ["GET", "POST"], lambda: "pong")
+    adapter = pluginKeyHandler.make_server_adapter(request.param, "127.0.0.1", 0)
+    t = threading.Thread(target=adapter.run, args=(app,))
+    t.daemon = True
+    t.start()
+    for i in range(500):
+        if adapter.port:
+            break
+        time.sleep(0.01)
+    yield adapter, t
+    adapter.stop()
+    t.join(5)
+
+def connect(adapter):
+    return socket.create_connection(("127.0.0.1", adapter.port), timeout=5)
+
+def read_response(sock):
+    data = b""
+    while b"\r\n\r\n" not in data or not data.endswith(b"pong"):
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def test_keep_alive(server):
+    adapter, t = server
+    sock = connect(adapter)
+    for i in range(2):
+        sock.sendall(b"GET /ping HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert read_response(sock).startswith(b"HTTP/1.1 200")
+    sock.close()
+
+@pytest.mark.parametrize("requests", [0, 1])  # connected only, or idle after a request
+def test_stop_closes_idle_connections(server, requests):
+    adapter, t = server
+    sock = connect(adapter)
+    if requests:
+        sock.sendall(b"GET /ping HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert read_response(sock).startswith(b"HTTP/1.1 200")
+    time.sleep(0.2)  # the server waits for the next request line now
+    start = time.time()
+    adapter.stop()
+    t.join(5)
+    assert not t.is_alive() and time.time() - start < 2
+    assert sock.recv(100) == b""  # closed by the server
+    sock.close()
+
+@pytest.mark.skipif("asyncio" not in BACKENDS, reason="Python 3.7+")
+@pytest.mark.parametrize("server", ["asyncio"], indirect=True)
+@pytest.mark.parametrize("partial", [
+    b"GET /ping HTTP/1.1\r\nHost: x\r\n",  # headers never end
+    b"POST /ping HTTP/1.1\r\nHost: x\r\nContent-Length: 10\r\n\r\nabc",  # body never ends
+])
+def test_asyncio_slow_client_times_out(server, partial):
+    adapter, t = server
+    sock = connect(adapter)
+    sock.sendall(partial)
+    start = time.time()
+    assert sock.recv(100).startswith(b"HTTP/1.1 408")
+    assert time.time() - start < 2
+    sock.close()
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Threaded HTTP/1.1 keep-alive WSGI server on wsgiref (the "threadpool" server
+backend) and the patch making bottle's plain wsgiref backend stoppable.
+
+Kept out of pluginKeyHandler so command line lookups don't pay for loading
+wsgiref and http.server.
+
+"""
+
+import logging
+import socket
+import threading
+import time
+import wsgiref.simple_server
+
+try:
+    import Queue as queue  # Python 2.X
+except ImportError:
+    import queue  # Python 3+
+
+import bottle
+
+import pluginKeyHandler
+
+log = pluginKeyHandler.log
+
+# workaround to make bottle stoppable - this can be cleaned up with bottle 0.13
+original_make_server = wsgiref.simple_server.make_server
+def my_make_server(*args, **kwargs):
+    server = original_make_server(*args, **kwargs)
+    args[2].server = server  # app
+    return server
+def patch_make_server():  # only for the wsgiref backend
+    wsgiref.simple_server.make_server = my_make_server
+# now stop via app.server.shutdown()
+
+class BodyReader(object):
+    """wsgi.input limited to the request body. The unread rest is drained after
+    the response so the next request on a keep-alive connection starts at the
+    right place."""
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def _limit(self, size):
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size=-1):
+        size = self._limit(size)
+        data = self.rfile.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        size = self._limit(size)
+        data = self.rfile.readline(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def drain(self):
+        while self.remaining > 0 and self.read(min(self.remaining, 65536)):
+            pass
+
+class KeepAliveServerHandler(wsgiref.simple_server.ServerHandler):
+    """Answers with HTTP/1.1 and sends bodies of unknown length chunked, so the
+    connection can stay open."""
+    http_version = "1.1"
+    chunked = False
+    failed = False
+    responseHeaders = None
+    _chunking = False
+
+    def cleanup_headers(self):
+        wsgiref.simple_server.ServerHandler.cleanup_headers(self)
+        if ("Content-Length" not in self.headers and
+                self.environ.get("SERVER_PROTOCOL") == "HTTP/1.1" and
+                not self.status.startswith(("1", "204", "304"))):
+            self.headers["Transfer-Encoding"] = "chunked"
+            self.chunked = True
+
+    def send_headers(self):
+        wsgiref.simple_server.ServerHandler.send_headers(self)
+        self._chunking = self.chunked
+
+    def _write(self, data):
+        if self._chunking:
+            if not data:
+                return  # an empty chunk would end the body
+            data = ("%x\r\n" % len(data)).encode("ascii") + data + b"\r\n"
+        wsgiref.simple_server.ServerHandler._write(self, data)
+
+    def finish_content(self):
+        wsgiref.simple_server.ServerHandler.finish_content(self)
+        if self._chunking:
+            self._chunking = False
+            self._write(b"0\r\n\r\n")
+
+    def handle_error(self):
+        self.failed = True
+        wsgiref.simple_server.ServerHandler.handle_error(self)
+
+    def close(self):
+        self.responseHeaders = self.headers  # reset by close()
+        wsgiref.simple_server.ServerHandler.close(self)
+
+class KeepAliveRequestHandler(wsgiref.simple_server.WSGIRequestHandler):
+    """Handles requests of a connection until the client closes it, asks to
+    close it or it is idle for KEEPALIVESECONDS. Reading a request and writing
+    its response may take up to SERVERIOSECONDS per socket operation."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are separate writes - don't wait for the delayed ack
+
+    def address_string(self):  # no reverse DNS lookups
+        return self.client_address[0]
+
+    def log_message(self, format, *args):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("http:", self.address_string(), format % args)
+
+    def handle(self):
+        self.close_connection = True
+        try:
+            self.handle_one()
+            while not self.close_connection:
+                self.handle_one()
+        except (socket.timeout, socket.error):
+            pass  # idle too long or connection reset
+
+    def handle_one(self):
+        if not self.server.wait_for_request(self.connection):  # stopping
+            self.close_connection = True
+            return
+        try:
+            self.connection.settimeout(pluginKeyHandler.KEEPALIVESECONDS)  # waiting for the next request
+            self.raw_requestline = self.rfile.readline(65537)
+        finally:
+            self.server.request_started(self.connection)
+        self.connection.settimeout(pluginKeyHandler.SERVERIOSECONDS)  # slow clients may take a while to read a key
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = True
+            return
+        if not self.parse_request():  # an error code has been sent
+            self.close_connection = True
+            return
+
+        environ = self.get_environ()
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = None
+            stdin = self.rfile
+            self.close_connection = True
+        else:
+            body = BodyReader(self.rfile, int(environ.get("CONTENT_LENGTH") or 0))
+            stdin = body
+        handler = KeepAliveServerHandler(stdin, self.wfile, self.get_stderr(), environ,
+                                         multithread=True)
+        handler.request_handler = self  # backpointer for logging
+        handler.run(self.server.get_app())
+
+        headers = handler.responseHeaders
+        if (handler.failed or headers is None or
+                ("Content-Length" not in headers and not handler.chunked) or
+                headers.get("Connection", "").lower() == "close"):
+            self.close_connection = True
+        if body is not None and not self.close_connection:
+            body.drain()
+
+class ThreadPoolWSGIServer(wsgiref.simple_server.WSGIServer):
+    """WSGIServer handing accepted connections to a bounded pool of worker
+    threads. Accepting blocks while all workers are busy."""
+    def __init__(self, serverAddress, handlerClass, workers=None):
+        self.workers = []  # server_close() is called if binding fails
+        self.stopping = False
+        self.idle = set()  # connections waiting for their next request
+        self.idleLock = threading.Lock()
+        wsgiref.simple_server.WSGIServer.__init__(self, serverAddress, handlerClass)
+        workers = workers or pluginKeyHandler.SERVERWORKERS
+        self.connections = queue.Queue(workers)
+        for i in range(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def process_request(self, request, clientAddress):
+        self.connections.put((request, clientAddress))
+
+    def _work(self):
+        while True:
+            item = self.connections.get()
+            if item is None:
+                return
+            request, clientAddress = item
+            try:
+                self.finish_request(request, clientAddress)
+            except Exception:
+                self.handle_error(request, clientAddress)
+            finally:
+                self.shutdown_request(request)
+
+    def wait_for_request(self, connection):
+        """Called by a handler before it reads the next request line. False if
+        the server is stopping."""
+        with self.idleLock:
+            if self.stopping:
+                return False
+            self.idle.add(connection)
+            return True
+
+    def request_started(self, connection):
+        with self.idleLock:
+            self.idle.discard(connection)
+
+    def server_close(self):
+        """Stop accepting, close idle keep-alive connections and wait for
+        running requests to finish."""
+        wsgiref.simple_server.WSGIServer.server_close(self)
+        with self.idleLock:
+            self.stopping = True
+            idle = list(self.idle)
+        for connection in idle:
+            try:
+                connection.shutdown(socket.SHUT_RD)  # the waiting read returns, a response can still be sent
+            except socket.error:
+                pass
+        for t in self.workers:
+            self.connections.put(None)
+        stopTime = time.time() + pluginKeyHandler.SERVERSTOPSECONDS
+        for t in self.workers:
+            t.join(max(0, stopTime - time.time()))
+
+class ThreadPoolServer(bottle.ServerAdapter):
+    """Bottle server adapter for ThreadPoolWSGIServer with keep-alive."""
+    srv = None
+
+    def run(self, app):
+        self.srv = ThreadPoolWSGIServer((self.host, self.port), KeepAliveRequestHandler,
+                                        self.options.get("workers", pluginKeyHandler.SERVERWORKERS))
+        self.srv.set_app(app)
+        self.port = self.srv.server_port
+        try:
+            self.srv.serve_forever()
+        finally:
+            self.srv.server_close()
+
+    def stop(self):
+        if self.srv:
+            self.srv.shutdown()